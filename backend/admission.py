@@ -0,0 +1,197 @@
+import asyncio
+import json
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+
+
+class Overloaded(Exception):
+    """A pool's queue is full, or a request waited too long for a slot"""
+
+
+class AdmissionPool:
+    """Concurrency limit with a bounded, time-limited wait queue"""
+
+    def __init__(self, name: str, concurrency: int, queue_limit: int, queue_timeout: float):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_limit = queue_limit
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.waiting = 0
+        self.admitted_total = 0
+        self.rejected_total = 0
+        self.max_wait_seconds = 0.0
+
+    async def acquire(self) -> None:
+        if self.active + self.waiting >= self.concurrency + self.queue_limit:
+            self.rejected_total += 1
+            raise Overloaded(f"{self.name} queue is full")
+
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.rejected_total += 1
+            raise Overloaded(f"Timed out waiting for a {self.name} slot")
+        finally:
+            self.waiting -= 1
+
+        self.active += 1
+        self.admitted_total += 1
+        self.max_wait_seconds = max(self.max_wait_seconds, time.perf_counter() - started)
+
+    def release(self) -> None:
+        self.active -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted_total": self.admitted_total,
+            "rejected_total": self.rejected_total,
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+class MemoryBudget:
+    """A worker's budget for upload bytes held in memory.
+
+    Each upload asks for an in-memory spool as large as its body, up to
+    UPLOAD_SPOOL_MEMORY bytes; when the budget cannot cover it, the upload
+    spills straight to disk instead of waiting, so memory stays bounded
+    under an upload storm. Every worker holds its own budget, so each gets
+    its share of UPLOAD_MEMORY_BUDGET (`worker_share`) to keep the server
+    as a whole within it.
+    """
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.in_use = 0
+        self.spilled_total = 0
+
+    @staticmethod
+    def worker_share(limit: int) -> int:
+        """This worker's part of a memory budget shared by all of the server's workers"""
+        return limit // max(settings.WEB_CONCURRENCY, 1)
+
+    def reserve(self, wanted: int) -> int:
+        """Reserve up to `wanted` bytes; returns the amount granted (0 = spill to disk)"""
+        if wanted <= 0 or self.in_use + wanted > self.limit:
+            if wanted > 0:
+                self.spilled_total += 1
+            return 0
+        self.in_use += wanted
+        return wanted
+
+    def release(self, granted: int) -> None:
+        self.in_use -= granted
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": self.limit, "in_use": self.in_use, "spilled_total": self.spilled_total}
+
+
+# (method, path pattern, pool name); anything unmatched is not throttled
+ROUTES: List[Tuple[str, "re.Pattern[str]", str]] = [
+    ("POST", re.compile(r"^/api/upload$"), "upload"),
+    ("PUT", re.compile("^" + re.escape(settings.LOCAL_UPLOAD_PATH) + "$"), "upload"),
+    ("POST", re.compile(r"^/api/uploads$"), "upload"),
+    ("PATCH", re.compile(r"^/api/uploads/[^/]+$"), "upload"),
+    ("POST", re.compile(r"^/api/uploads/[^/]+/finalize$"), "upload"),
+    ("*", re.compile(r"^/api/admin/"), "admin"),
+]
+
+
+class AdmissionControl:
+    """Separate upload and admin pools plus the upload memory budget"""
+
+    def __init__(self):
+        self.pools = {
+            "upload": AdmissionPool("upload", settings.UPLOAD_CONCURRENCY,
+                                    settings.UPLOAD_QUEUE_LIMIT, settings.UPLOAD_QUEUE_TIMEOUT),
+            "admin": AdmissionPool("admin", settings.ADMIN_CONCURRENCY,
+                                   settings.ADMIN_QUEUE_LIMIT, settings.ADMIN_QUEUE_TIMEOUT),
+        }
+        self.memory = MemoryBudget(MemoryBudget.worker_share(settings.UPLOAD_MEMORY_BUDGET))
+
+    def pool_for(self, method: str, path: str) -> Optional[AdmissionPool]:
+        for route_method, pattern, pool in ROUTES:
+            if route_method in ("*", method) and pattern.match(path):
+                return self.pools[pool]
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **{name: pool.stats() for name, pool in self.pools.items()},
+            "upload_memory": self.memory.stats(),
+        }
+
+
+class AdmissionMiddleware:
+    """Route requests into separate upload and admin pools.
+
+    Uploads and the print counter's lookups no longer compete for the same
+    slots, so a burst of large uploads queues (and past the queue limit is
+    turned away with 503 + Retry-After) while lookups stay fast. Upload
+    requests also get their in-memory spool size from the memory budget,
+    passed on as `request.state.upload_spool_memory`.
+    """
+
+    def __init__(self, app, control: AdmissionControl):
+        self.app = app
+        self.control = control
+
+    async def __call__(self, scope, receive, send):
+        pool = None
+        if scope["type"] == "http":
+            pool = self.control.pool_for(scope["method"], scope["path"])
+        if pool is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await pool.acquire()
+        except Overloaded as error:
+            await self._reject(send, str(error))
+            return
+
+        granted = 0
+        try:
+            if pool.name == "upload":
+                granted = self.control.memory.reserve(self._spool_size(scope))
+                scope.setdefault("state", {})["upload_spool_memory"] = granted
+            await self.app(scope, receive, send)
+        finally:
+            self.control.memory.release(granted)
+            pool.release()
+
+    @staticmethod
+    def _spool_size(scope) -> int:
+        """In-memory spool to reserve: the declared body size, capped at UPLOAD_SPOOL_MEMORY"""
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    return min(max(int(value), 0), settings.UPLOAD_SPOOL_MEMORY)
+                except ValueError:
+                    break
+        # Chunked bodies could be any size
+        return settings.UPLOAD_SPOOL_MEMORY
+
+    @staticmethod
+    async def _reject(send, detail: str) -> None:
+        body = json.dumps({"detail": f"Server busy: {detail}. Please retry shortly."}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
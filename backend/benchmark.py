@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark for the XeroQ backend
+Run with: python benchmark.py [--duration S] [--concurrency N] [--blob-latency MS] [--compare FILE]
+
+Boots the app in-process (no server, no Supabase) on SQLite metadata and
+local-disk blobs, each wrapped so every call waits an injected latency to
+stand in for network round trips. It then drives three scenarios through an
+ASGI transport:
+
+- seed: uploads that give the later scenarios jobs to work on
+- mixed: a steady concurrent mix of uploads (100 KB to 50 MB), lookups
+  and downloads
+- burst: waves of simultaneous lookups and then downloads, like a queue at
+  the print counter
+
+Throughput, p50/p95/p99 latency, errors and peak RSS are reported per
+scenario and operation (RSS covers the whole process, the in-process
+client included). The results are saved as JSON so a later run can be
+compared against them with --compare.
+"""
+
+import argparse
+import asyncio
+import functools
+import inspect
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+SIZE_UNITS = {"K": 1024, "M": 1024 * 1024}
+FILLER_BYTES = 1024 * 1024  # random block repeated to make up upload bodies
+PRINT_OPTIONS = json.dumps({"copies": "1", "colorMode": "bw", "duplex": "single", "paperSize": "a4"})
+
+
+def parse_size(text: str) -> int:
+    text = text.strip().upper()
+    if text[-1:] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+
+def parse_weights(text: str) -> Dict[str, float]:
+    weights = {}
+    for item in text.split(","):
+        name, _, weight = item.partition("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: fall back to the peak so far (KB on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LatencyProxy:
+    """Wraps a storage backend so each of its async calls first waits the injected latency"""
+
+    def __init__(self, inner: Any, latency: float, jitter: float):
+        self._inner = inner
+        self._latency = latency
+        self._jitter = jitter
+
+    def _delay(self) -> float:
+        return max(0.0, self._latency * (1 + random.uniform(-self._jitter, self._jitter)))
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self._inner, name)
+        if not inspect.iscoroutinefunction(attribute) or self._latency <= 0:
+            return attribute
+
+        @functools.wraps(attribute)
+        async def delayed(*args, **kwargs):
+            await asyncio.sleep(self._delay())
+            return await attribute(*args, **kwargs)
+        return delayed
+
+
+class Recorder:
+    """Latencies, errors and bytes per operation for one scenario, plus its peak RSS"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, Dict[str, int]] = {}
+        self.bytes: Dict[str, int] = {}
+        self.peak_rss = current_rss()
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def record(self, operation: str, seconds: float, status: int, size: int = 0) -> None:
+        self.latencies.setdefault(operation, []).append(seconds)
+        self.bytes[operation] = self.bytes.get(operation, 0) + size
+        if status >= 400:
+            errors = self.errors.setdefault(operation, {})
+            errors[str(status)] = errors.get(str(status), 0) + 1
+
+    async def sample_rss(self, interval: float = 0.05) -> None:
+        while True:
+            self.peak_rss = max(self.peak_rss, current_rss())
+            await asyncio.sleep(interval)
+
+    def summary(self) -> Dict[str, Any]:
+        operations = {}
+        for operation, latencies in sorted(self.latencies.items()):
+            ordered = sorted(latencies)
+            operations[operation] = {
+                "count": len(ordered),
+                "errors": self.errors.get(operation, {}),
+                "throughput_per_s": round(len(ordered) / self.elapsed, 2) if self.elapsed else 0.0,
+                "mb_per_s": round(self.bytes[operation] / self.elapsed / 1e6, 2) if self.elapsed else 0.0,
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+            }
+        return {
+            "seconds": round(self.elapsed, 2),
+            "peak_rss_mb": round(self.peak_rss / 1e6, 1),
+            "operations": operations,
+        }
+
+
+class Workload:
+    """Requests against the in-process app, with the OTPs of the jobs uploaded so far"""
+
+    def __init__(self, client, args: argparse.Namespace, max_pdf_size: int):
+        self.client = client
+        self.args = args
+        self.max_pdf_size = max_pdf_size
+        self.sizes = [min(parse_size(size), max_pdf_size) for size in args.upload_sizes.split(",")]
+        self.size_weights = [float(weight) for weight in args.upload_weights.split(",")]
+        self.filler = os.urandom(FILLER_BYTES)
+        self.otps: List[str] = []
+
+    def _body(self, size: int, boundary: str) -> Tuple[int, AsyncIterator[bytes]]:
+        """Multipart upload body, generated as it is sent so large uploads do not sit in memory"""
+        head = (
+            f'--{boundary}\r\nContent-Disposition: form-data; name="printOptions"\r\n\r\n{PRINT_OPTIONS}\r\n'
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="benchmark.pdf"\r\n'
+            f"Content-Type: application/pdf\r\n\r\n"
+        ).encode()
+        tail = f"\r\n--{boundary}--\r\n".encode()
+        # A unique first line gives every upload its own digest, so none are deduplicated
+        first = f"%PDF-1.4\n% {uuid.uuid4().hex}\n".encode()
+
+        async def chunks():
+            yield head + first
+            remaining = size - len(first)
+            offset = random.randrange(FILLER_BYTES)
+            while remaining > 0:
+                chunk = self.filler[offset:offset + min(remaining, FILLER_BYTES - offset)]
+                offset = 0
+                remaining -= len(chunk)
+                yield chunk
+            yield tail
+
+        return len(head) + size + len(tail), chunks()
+
+    async def upload(self, recorder: Recorder, size: Optional[int] = None) -> None:
+        size = size or random.choices(self.sizes, self.size_weights)[0]
+        boundary = uuid.uuid4().hex
+        length, body = self._body(size, boundary)
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/upload", content=body,
+            headers={"content-type": f"multipart/form-data; boundary={boundary}", "content-length": str(length)},
+        )
+        recorder.record("upload", time.perf_counter() - started, response.status_code, size)
+        if response.status_code == 200:
+            self.otps.append(response.json()["otp"])
+
+    async def lookup(self, recorder: Recorder) -> None:
+        if not self.otps:
+            return
+        started = time.perf_counter()
+        response = await self.client.get("/api/admin/lookup", params={"otp": random.choice(self.otps)})
+        recorder.record("lookup", time.perf_counter() - started, response.status_code)
+
+    async def download(self, recorder: Recorder) -> None:
+        if not self.otps:
+            return
+        started = time.perf_counter()
+        size = 0
+        async with self.client.stream("GET", "/api/admin/download", params={"otp": random.choice(self.otps)}) as response:
+            async for chunk in response.aiter_raw():
+                size += len(chunk)
+        recorder.record("download", time.perf_counter() - started, response.status_code, size)
+
+
+async def run_scenario(name: str, scenario) -> Dict[str, Any]:
+    recorder = Recorder(name)
+    sampler = asyncio.create_task(recorder.sample_rss())
+    try:
+        await scenario(recorder)
+    finally:
+        recorder.elapsed = time.perf_counter() - recorder.started
+        sampler.cancel()
+    summary = recorder.summary()
+    print_scenario(name, summary)
+    return summary
+
+
+async def seed(workload: Workload, recorder: Recorder) -> None:
+    semaphore = asyncio.Semaphore(workload.args.concurrency)
+
+    async def one():
+        async with semaphore:
+            await workload.upload(recorder, size=min(workload.sizes))
+
+    await asyncio.gather(*(one() for _ in range(workload.args.seed_jobs)))
+
+
+async def mixed(workload: Workload, recorder: Recorder) -> None:
+    mix = parse_weights(workload.args.mix)
+    operations = {"upload": workload.upload, "lookup": workload.lookup, "download": workload.download}
+    names = [name for name in mix if name in operations]
+    deadline = time.perf_counter() + workload.args.duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            operation = random.choices(names, [mix[name] for name in names])[0]
+            await operations[operation](recorder)
+
+    await asyncio.gather(*(worker() for _ in range(workload.args.concurrency)))
+
+
+async def burst(workload: Workload, recorder: Recorder) -> None:
+    for _ in range(workload.args.bursts):
+        await asyncio.gather(*(workload.lookup(recorder) for _ in range(workload.args.burst_size)))
+        await asyncio.gather(*(workload.download(recorder) for _ in range(workload.args.burst_size)))
+
+
+def print_scenario(name: str, summary: Dict[str, Any]) -> None:
+    print(f"\n📊 {name}: {summary['seconds']}s, peak RSS {summary['peak_rss_mb']} MB")
+    print(f"   {'operation':<10}{'count':>7}{'errors':>8}{'ops/s':>9}{'MB/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for operation, stats in summary["operations"].items():
+        print(f"   {operation:<10}{stats['count']:>7}{sum(stats['errors'].values()):>8}"
+              f"{stats['throughput_per_s']:>9}{stats['mb_per_s']:>8}"
+              f"{stats['p50_ms']:>9}{stats['p95_ms']:>9}{stats['p99_ms']:>9}")
+
+
+def compare(results: Dict[str, Any], baseline_path: str) -> None:
+    """Print p95 latency and throughput changes against an earlier results file"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    print(f"\n🔍 Compared with {baseline_path} ({baseline.get('git_commit') or 'unknown commit'})")
+    for scenario, summary in results["scenarios"].items():
+        previous_operations = baseline.get("scenarios", {}).get(scenario, {}).get("operations", {})
+        for operation, stats in summary["operations"].items():
+            previous = previous_operations.get(operation)
+            if not previous:
+                continue
+            p95 = (stats["p95_ms"] - previous["p95_ms"]) / previous["p95_ms"] * 100 if previous["p95_ms"] else 0.0
+            rate = ((stats["throughput_per_s"] - previous["throughput_per_s"]) / previous["throughput_per_s"] * 100
+                    if previous["throughput_per_s"] else 0.0)
+            print(f"   {scenario}/{operation:<10} p95 {previous['p95_ms']:>8} -> {stats['p95_ms']:>8} ms ({p95:+.1f}%)"
+                  f"   ops/s {previous['throughput_per_s']:>8} -> {stats['throughput_per_s']:>8} ({rate:+.1f}%)")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    import main as app_module  # imported here, once the environment points at the stand-ins
+
+    results: Dict[str, Any] = {
+        "started_at": datetime.now().isoformat(),
+        "git_commit": git_commit(),
+        "config": vars(args),
+        "scenarios": {},
+    }
+    # The app builds its storage in the lifespan; the backends are wrapped once it has
+    async with app_module.app.router.lifespan_context(app_module.app):
+        storage = app_module.storage
+        storage.jobs = LatencyProxy(storage.jobs, args.metadata_latency / 1000, args.jitter)
+        storage.blobs = LatencyProxy(storage.blobs, args.blob_latency / 1000, args.jitter)
+
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark",
+                                     timeout=args.request_timeout) as client:
+            workload = Workload(client, args, app_module.settings.MAX_FILE_SIZE_PDF)
+            for name, scenario in (("seed", seed), ("mixed", mixed), ("burst", burst)):
+                results["scenarios"][name] = await run_scenario(name, functools.partial(scenario, workload))
+
+    results["peak_rss_mb"] = max(summary["peak_rss_mb"] for summary in results["scenarios"].values())
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the XeroQ backend in-process with injected storage latency")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of mixed load")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients in the seed and mixed scenarios")
+    parser.add_argument("--mix", default="upload=1,lookup=6,download=3", help="relative weights of mixed operations")
+    parser.add_argument("--upload-sizes", default="100K,1M,5M,20M,50M", help="upload sizes to choose from")
+    parser.add_argument("--upload-weights", default="40,30,15,10,5", help="relative weight of each upload size")
+    parser.add_argument("--seed-jobs", type=int, default=50, help="jobs uploaded before the timed scenarios")
+    parser.add_argument("--bursts", type=int, default=5, help="lookup/download waves in the burst scenario")
+    parser.add_argument("--burst-size", type=int, default=100, help="simultaneous requests per wave")
+    parser.add_argument("--metadata-latency", type=float, default=20, help="ms added to every metadata call")
+    parser.add_argument("--blob-latency", type=float, default=40, help="ms added to every blob store call")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency jitter as a fraction (0.25 = +/-25%%)")
+    parser.add_argument("--request-timeout", type=float, default=120, help="client timeout per request in seconds")
+    parser.add_argument("--output", help="results file (default: ./data/benchmarks/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    # Point the app at throwaway local backends before it is imported
+    workdir = tempfile.mkdtemp(prefix="xeroq-benchmark-")
+    os.environ.update({
+        "METADATA_BACKEND": "sqlite",
+        "SQLITE_PATH": os.path.join(workdir, "xeroq.db"),
+        "BLOB_BACKEND": "local",
+        "LOCAL_BLOB_DIR": os.path.join(workdir, "blobs"),
+        "RESUMABLE_UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "PREVIEW_CACHE_DIR": os.path.join(workdir, "previews"),
+        "BLOB_CACHE_DIR": os.path.join(workdir, "blob-cache"),
+    })
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    # Conversions and previews compete for CPU with the request path; opt in to include them
+    os.environ.setdefault("CONVERSION_ENABLED", "false")
+    os.environ.setdefault("PREVIEW_ENABLED", "false")
+
+    print(f"🚀 XeroQ benchmark: {args.concurrency} clients, {args.duration}s mixed load, "
+          f"metadata +{args.metadata_latency}ms, blobs +{args.blob_latency}ms")
+    try:
+        results = asyncio.run(main(args))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or os.path.join("data", "benchmarks", f"{datetime.now():%Y%m%d-%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\n💾 Results saved to {output} (peak RSS {results['peak_rss_mb']} MB)")
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,945 @@
+import os
+import json
+import shutil
+import uuid
+import asyncio
+import time
+import hashlib
+import logging
+import httpx
+from collections import deque
+from datetime import datetime
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Optional, Dict, BinaryIO, List, AsyncIterator, Tuple
+from config import settings
+from cache import DiskCache
+from http_client import http_limits, http_timeout, supabase_credentials
+from signing import sign_token
+
+logger = logging.getLogger(__name__)
+
+# Conditional/range request headers honoured on download, and the response
+# headers passed back to the client so ranges and caching work end to end
+DOWNLOAD_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since")
+DOWNLOAD_RESPONSE_HEADERS = ("content-length", "content-range", "accept-ranges", "etag", "last-modified")
+
+# Large blobs are stored as parts plus a manifest object named with this
+# suffix, so the file path alone says how to read or delete a blob
+MANIFEST_SUFFIX = ".manifest.json"
+MAX_PARTS = 64
+
+
+class BlobExistsError(Exception):
+    """Raised by `upload` when a blob with that name is already stored"""
+
+
+class FileStream:
+    """An open download: status, response headers and a chunk iterator"""
+
+    status_code: int = 200
+    headers: Dict[str, str]
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        raise NotImplementedError
+        yield b""
+
+    async def aclose(self) -> None:
+        pass
+
+
+class BlobStore:
+    """Interface for the backend that holds uploaded file bytes"""
+
+    async def upload(self, file_obj: BinaryIO, name: str, content_type: str) -> str:
+        """Store a file under `name` and return its path"""
+        raise NotImplementedError
+
+    def stored_name(self, name: str, size: int) -> str:
+        """The path `upload` will store a file of `size` bytes under"""
+        return name
+
+    async def download(self, name: str) -> bytes:
+        raise NotImplementedError
+
+    async def exists(self, name: str) -> bool:
+        raise NotImplementedError
+
+    async def create_upload_url(self, name: str, content_type: str, max_size: int) -> Dict[str, Any]:
+        """Signed URL a client can upload `name` to directly: {"url", "method", "headers"}"""
+        raise NotImplementedError
+
+    async def open(self, name: str, request_headers: Optional[Dict[str, str]] = None) -> FileStream:
+        """Open a streaming download honouring Range and conditional headers"""
+        raise NotImplementedError
+
+    async def delete(self, names: List[str]) -> bool:
+        raise NotImplementedError
+
+    async def move(self, source: str, destination: str) -> bool:
+        """Rename a blob; False if `source` is missing, BlobExistsError if `destination` is taken"""
+        raise NotImplementedError
+
+    def iter_blobs(self, page_size: int = 1000) -> AsyncIterator[Tuple[str, Optional[float]]]:
+        """Yield (name, created timestamp) for every stored blob"""
+        raise NotImplementedError
+
+    async def iter_part_sets(self, page_size: int = 1000) -> AsyncIterator[Tuple[List[str], Optional[float], bool]]:
+        """Yield (part names, newest part timestamp, in use) for each multipart upload attempt.
+
+        A set is in use when its blob's manifest lists it; any other set was
+        left by a transfer that failed or was abandoned before committing.
+        Stores that never split blobs have none.
+        """
+        return
+        yield
+
+    def prefetch(self, name: str) -> None:
+        """Hint that a blob is about to be downloaded (only a cached store acts on it)"""
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return None
+
+    async def warm_up(self, connections: int) -> int:
+        """Open up to `connections` pooled connections ahead of traffic; returns how many answered"""
+        return 0
+
+    async def aclose(self) -> None:
+        pass
+
+
+class HTTPFileStream(FileStream):
+    """Download relayed from an upstream httpx streaming response"""
+
+    def __init__(self, response: httpx.Response):
+        self.response = response
+        self.status_code = response.status_code
+        self.headers = {
+            name: response.headers[name]
+            for name in DOWNLOAD_RESPONSE_HEADERS
+            if name in response.headers
+        }
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        try:
+            async for chunk in self.response.aiter_bytes(settings.DOWNLOAD_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.response.aclose()
+
+
+class MultipartFileStream(FileStream):
+    """Download of a multipart blob, fetching its parts in parallel.
+
+    Up to MULTIPART_CONCURRENCY part ranges are in flight ahead of the one
+    being sent, and are yielded strictly in order.
+    """
+
+    def __init__(self, store: "SupabaseBlobStore", manifest: Dict[str, Any], status_code: int,
+                 headers: Dict[str, str], start: int = 0, end: int = -1):
+        self.store = store
+        self.manifest = manifest
+        self.status_code = status_code
+        self.headers = headers
+        self.start = start
+        self.end = end
+        self._pending: "deque[asyncio.Task]" = deque()
+
+    def _ranges(self):
+        part_size = self.manifest["part_size"]
+        for index, part_name in enumerate(self.manifest["parts"]):
+            part_start = index * part_size
+            part_end = min(part_start + part_size, self.manifest["size"]) - 1
+            if part_end < self.start or part_start > self.end:
+                continue
+            yield part_name, max(self.start, part_start) - part_start, min(self.end, part_end) - part_start
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        if self.end < self.start:
+            return
+
+        ranges = iter(self._ranges())
+        try:
+            while True:
+                while len(self._pending) < settings.MULTIPART_CONCURRENCY:
+                    next_range = next(ranges, None)
+                    if next_range is None:
+                        break
+                    self._pending.append(asyncio.create_task(self.store._get_range(*next_range)))
+                if not self._pending:
+                    break
+
+                data = await self._pending.popleft()
+                for offset in range(0, len(data), settings.DOWNLOAD_CHUNK_SIZE):
+                    yield data[offset:offset + settings.DOWNLOAD_CHUNK_SIZE]
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        while self._pending:
+            self._pending.popleft().cancel()
+
+
+class SupabaseBlobStore(BlobStore):
+    """Blobs in a Supabase Storage bucket, over a pooled async HTTP client"""
+
+    def __init__(self, bucket: str = settings.STORAGE_BUCKET):
+        supabase_url, auth_headers = supabase_credentials()
+        self.http = httpx.AsyncClient(
+            base_url=f"{supabase_url}/storage/v1",
+            headers=auth_headers,
+            timeout=http_timeout(),
+            limits=http_limits(),
+        )
+        self.bucket = bucket
+
+    async def aclose(self) -> None:
+        await self.http.aclose()
+
+    async def warm_up(self, connections: int) -> int:
+        # Concurrent requests make the pool open (and keep alive) one
+        # connection each, TLS handshake included
+        async def probe() -> bool:
+            response = await self.http.get(f"/bucket/{self.bucket}")
+            return response.status_code < 500
+
+        results = await asyncio.gather(*(probe() for _ in range(connections)), return_exceptions=True)
+        return sum(result is True for result in results)
+
+    async def _read_chunks(self, file_obj: BinaryIO) -> AsyncIterator[bytes]:
+        """Yield a file in UPLOAD_CHUNK_SIZE pieces without blocking the loop"""
+        while True:
+            chunk = await asyncio.to_thread(file_obj.read, settings.UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    @staticmethod
+    def _file_descriptor(file_obj: BinaryIO) -> Optional[int]:
+        """Descriptor to read parts from concurrently, or None for in-memory files"""
+        if not getattr(file_obj, "_rolled", True):
+            return None
+        try:
+            file_obj.flush()
+            return file_obj.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def stored_name(self, name: str, size: int) -> str:
+        base = name.removesuffix(MANIFEST_SUFFIX)
+        return base + MANIFEST_SUFFIX if size >= settings.MULTIPART_THRESHOLD else base
+
+    async def _put(self, name: str, content: Any, content_type: str, content_length: int) -> None:
+        response = await self.http.post(
+            f"/object/{self.bucket}/{name}",
+            content=content,
+            headers={
+                "content-type": content_type,
+                "content-length": str(content_length),
+                "cache-control": "max-age=3600",
+                "x-upsert": "false",
+            },
+        )
+
+        if not response.is_success:
+            # Storage reports an existing object as 409, or as 400 "Duplicate"
+            if response.status_code == 409 or "Duplicate" in response.text:
+                raise BlobExistsError(name)
+            raise Exception(f"Failed to upload file ({response.status_code}): {response.text}")
+
+    async def upload(self, file_obj: BinaryIO, name: str, content_type: str) -> str:
+        file_obj.seek(0, os.SEEK_END)
+        file_size = file_obj.tell()
+        file_obj.seek(0)
+
+        if file_size >= settings.MULTIPART_THRESHOLD:
+            if not getattr(file_obj, "_rolled", True):
+                # An upload still spooled in memory goes to disk first, so
+                # parts can be read from it concurrently
+                await asyncio.to_thread(file_obj.rollover)
+            fd = self._file_descriptor(file_obj)
+            if fd is not None:
+                return await self._upload_multipart(fd, file_size, self.stored_name(name, file_size), content_type)
+
+        # Never store plain bytes under a manifest name
+        name = name.removesuffix(MANIFEST_SUFFIX)
+        await self._put(name, self._read_chunks(file_obj), content_type, file_size)
+        return name
+
+    async def _upload_multipart(self, fd: int, file_size: int, manifest_name: str, content_type: str) -> str:
+        """Upload parts concurrently, each retried on failure, then commit the manifest.
+
+        Parts go under a prefix unique to this attempt, so two uploads of the
+        same content never touch each other's parts; whichever commits its
+        manifest first wins and the other cleans up.
+        """
+        part_size = max(settings.MULTIPART_PART_SIZE, -(-file_size // MAX_PARTS))
+        prefix = f"{manifest_name.removesuffix(MANIFEST_SUFFIX)}.parts/{uuid.uuid4().hex}"
+        offsets = range(0, file_size, part_size)
+        part_names = [f"{prefix}/{index:05d}" for index in range(len(offsets))]
+        semaphore = asyncio.Semaphore(settings.MULTIPART_CONCURRENCY)
+
+        async def send_part(part_name: str, offset: int) -> None:
+            async with semaphore:
+                data = await asyncio.to_thread(os.pread, fd, min(part_size, file_size - offset), offset)
+                for attempt in range(settings.MULTIPART_RETRIES + 1):
+                    try:
+                        await self._put(part_name, data, "application/octet-stream", len(data))
+                        return
+                    except BlobExistsError:
+                        return  # an earlier attempt landed but its response was lost
+                    except Exception as error:
+                        if attempt == settings.MULTIPART_RETRIES:
+                            raise
+                        logger.warning("Retrying upload of %s: %s", part_name, error)
+                        await asyncio.sleep(0.5 * 2 ** attempt)
+
+        results = await asyncio.gather(
+            *(send_part(part_name, offset) for part_name, offset in zip(part_names, offsets)),
+            return_exceptions=True,
+        )
+        try:
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+
+            manifest = json.dumps({
+                "size": file_size,
+                "part_size": part_size,
+                "content_type": content_type,
+                "parts": part_names,
+            }).encode()
+            await self._put(manifest_name, manifest, "application/json", len(manifest))
+        except BaseException:
+            await self.delete(part_names)
+            raise
+        return manifest_name
+
+    async def _read_manifest(self, name: str) -> Tuple[Dict[str, Any], str, float]:
+        """A multipart blob's manifest, with an ETag and mtime for the whole blob"""
+        response = await self.http.get(f"/object/{self.bucket}/{name}")
+        if not response.is_success:
+            raise Exception(f"Failed to download file ({response.status_code})")
+
+        etag = f'"{hashlib.md5(response.content).hexdigest()}"'
+        try:
+            mtime = parsedate_to_datetime(response.headers["last-modified"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            mtime = 0.0
+        return response.json(), etag, mtime
+
+    async def _get_range(self, name: str, start: int, end: int) -> bytes:
+        """Fetch bytes start..end (inclusive) of one object, retrying on failure"""
+        for attempt in range(settings.MULTIPART_RETRIES + 1):
+            try:
+                response = await self.http.get(
+                    f"/object/{self.bucket}/{name}",
+                    headers={"range": f"bytes={start}-{end}", "accept-encoding": "identity"},
+                )
+                if response.status_code == 206:
+                    return response.content
+                if response.status_code == 200:
+                    return response.content[start:end + 1]
+                raise Exception(f"Failed to download part ({response.status_code})")
+            except Exception as error:
+                if attempt == settings.MULTIPART_RETRIES:
+                    raise
+                logger.warning("Retrying download of %s: %s", name, error)
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    async def download(self, name: str) -> bytes:
+        if name.endswith(MANIFEST_SUFFIX):
+            file_stream = await self.open(name)
+            return b"".join([chunk async for chunk in file_stream.iter_chunks()])
+
+        response = await self.http.get(f"/object/{self.bucket}/{name}")
+
+        if not response.is_success:
+            raise Exception(f"Failed to download file ({response.status_code})")
+        return response.content
+
+    async def exists(self, name: str) -> bool:
+        response = await self.http.head(f"/object/{self.bucket}/{name}")
+        if response.is_success:
+            return True
+        # Missing objects come back as 400 or 404 depending on the Storage version
+        if response.status_code in (400, 404):
+            return False
+        raise Exception(f"Failed to check file ({response.status_code})")
+
+    async def create_upload_url(self, name: str, content_type: str, max_size: int) -> Dict[str, Any]:
+        # The size cap is enforced by the bucket's file size limit and by
+        # the finalize check; Storage signed upload URLs cannot carry one
+        response = await self.http.post(
+            f"/object/upload/sign/{self.bucket}/{name}",
+            headers={"x-upsert": "false"},
+        )
+        if not response.is_success:
+            raise Exception(f"Failed to sign upload URL ({response.status_code}): {response.text}")
+
+        return {
+            "url": str(self.http.base_url).rstrip("/") + response.json()["url"],
+            "method": "PUT",
+            "headers": {"content-type": content_type, "x-upsert": "false"},
+        }
+
+    async def open(self, name: str, request_headers: Optional[Dict[str, str]] = None) -> FileStream:
+        if name.endswith(MANIFEST_SUFFIX):
+            manifest, etag, mtime = await self._read_manifest(name)
+            status_code, headers, start, end = _conditional_range(manifest["size"], etag, mtime, request_headers)
+            return MultipartFileStream(self, manifest, status_code, headers, start, end)
+
+        # Ask for the raw bytes so the forwarded Content-Length stays valid
+        headers = {"accept-encoding": "identity"}
+        for header in DOWNLOAD_REQUEST_HEADERS:
+            if request_headers and request_headers.get(header):
+                headers[header] = request_headers.get(header)
+
+        request = self.http.build_request("GET", f"/object/{self.bucket}/{name}", headers=headers)
+        response = await self.http.send(request, stream=True)
+
+        # 304 and 416 are valid answers to conditional/range requests
+        if response.is_success or response.status_code in (304, 416):
+            return HTTPFileStream(response)
+
+        await response.aclose()
+        raise Exception(f"Failed to download file ({response.status_code})")
+
+    async def delete(self, names: List[str]) -> bool:
+        # Multipart blobs take their parts with them
+        manifests = [name for name in names if name.endswith(MANIFEST_SUFFIX)]
+        if manifests:
+            found = await asyncio.gather(*(self._read_manifest(name) for name in manifests), return_exceptions=True)
+            names = names + [
+                part_name
+                for result in found if not isinstance(result, BaseException)
+                for part_name in result[0]["parts"]
+            ]
+
+        deleted = True
+        for start in range(0, len(names), 1000):
+            response = await self.http.request(
+                "DELETE",
+                f"/object/{self.bucket}",
+                json={"prefixes": names[start:start + 1000]},
+            )
+            deleted = deleted and response.is_success
+        return deleted
+
+    async def move(self, source: str, destination: str) -> bool:
+        # A multipart blob moves as its manifest; the parts stay where it lists them
+        response = await self.http.post(
+            "/object/move",
+            json={"bucketId": self.bucket, "sourceKey": source, "destinationKey": destination},
+        )
+        if response.is_success:
+            return True
+        if response.status_code == 409 or "Duplicate" in response.text or "already exists" in response.text:
+            raise BlobExistsError(destination)
+        if response.status_code in (400, 404):
+            return False
+        raise Exception(f"Failed to move file ({response.status_code}): {response.text}")
+
+    async def _list(self, prefix: str, page_size: int) -> AsyncIterator[Tuple[str, Optional[float], bool]]:
+        """Yield (name, created timestamp, is folder) for the entries directly under `prefix`"""
+        offset = 0
+        while True:
+            response = await self.http.post(
+                f"/object/list/{self.bucket}",
+                json={
+                    "prefix": prefix,
+                    "limit": page_size,
+                    "offset": offset,
+                    "sortBy": {"column": "name", "order": "asc"},
+                },
+            )
+            response.raise_for_status()
+            items = response.json()
+
+            for item in items:
+                name = f"{prefix}/{item['name']}" if prefix else item["name"]
+                # Folders come back without an id
+                created_at = item.get("created_at")
+                timestamp = datetime.fromisoformat(created_at.replace("Z", "+00:00")).timestamp() if created_at else None
+                yield name, timestamp, item.get("id") is None
+
+            if len(items) < page_size:
+                break
+            offset += page_size
+
+    async def iter_blobs(self, page_size: int = 1000, prefix: str = "") -> AsyncIterator[Tuple[str, Optional[float]]]:
+        async for name, created_at, is_folder in self._list(prefix, page_size):
+            if not is_folder:
+                yield name, created_at
+            elif not name.endswith(".parts"):
+                # The parts of multipart blobs go with their manifest (see iter_part_sets)
+                async for entry in self.iter_blobs(page_size, name):
+                    yield entry
+
+    async def iter_part_sets(self, page_size: int = 1000,
+                             prefix: str = "") -> AsyncIterator[Tuple[List[str], Optional[float], bool]]:
+        async for name, _, is_folder in self._list(prefix, page_size):
+            if not is_folder:
+                continue
+            if not name.endswith(".parts"):
+                async for entry in self.iter_part_sets(page_size, name):
+                    yield entry
+                continue
+
+            # `<blob>.parts/<attempt>/<index>`, committed by `<blob>.manifest.json`
+            manifest_name = name.removesuffix(".parts") + MANIFEST_SUFFIX
+            try:
+                manifest_parts = set()
+                if await self.exists(manifest_name):
+                    manifest_parts = set((await self._read_manifest(manifest_name))[0]["parts"])
+            except Exception as error:
+                # Unsure which parts are live: leave them for the next run
+                logger.warning("Skipping %s: %s", name, error)
+                continue
+            async for attempt, _, attempt_is_folder in self._list(name, page_size):
+                if not attempt_is_folder:
+                    continue
+                parts, newest = [], None
+                async for part_name, created_at, _ in self._list(attempt, page_size):
+                    parts.append(part_name)
+                    if created_at is not None:
+                        newest = max(newest or created_at, created_at)
+                if parts:
+                    yield parts, newest, not manifest_parts.isdisjoint(parts)
+
+
+class LocalFileStream(FileStream):
+    """Download served from a file on local disk.
+
+    The file is opened before the response starts (see `open_local_file`),
+    so it can be unlinked while it is being sent. Chunks are read with
+    pread() in a worker thread, as Starlette's FileResponse does, so cold
+    pages never fault on the event loop; uvicorn has no ASGI extension that
+    would let a sendfile() path hand the descriptor to the socket instead.
+    """
+
+    def __init__(self, fd: int, status_code: int, headers: Dict[str, str], start: int = 0, end: int = -1):
+        self.fd = fd
+        self.status_code = status_code
+        self.headers = headers
+        self.start = start
+        self.end = end
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        position = self.start
+        while position <= self.end:
+            size = min(settings.DOWNLOAD_CHUNK_SIZE, self.end + 1 - position)
+            chunk = await asyncio.to_thread(os.pread, self.fd, size, position)
+            if not chunk:
+                break  # truncated underneath us
+            position += len(chunk)
+            yield chunk
+
+    async def aclose(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def _etag_matches(etag: str, header_value: str) -> bool:
+    candidates = [tag.strip().removeprefix("W/") for tag in header_value.split(",")]
+    return "*" in candidates or etag in candidates
+
+
+def _parse_range(header_value: str, size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range; None means it is unsatisfiable.
+
+    Raises ValueError for malformed or multi-part ranges, which are ignored
+    (the whole file is served) as RFC 9110 allows.
+    """
+    unit, _, spec = header_value.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        raise ValueError(f"Unsupported range: {header_value}")
+    first, _, last = spec.strip().partition("-")
+    if not first:
+        length = int(last)
+        if length <= 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    if start >= size:
+        return None
+    end = int(last) if last else size - 1
+    if end < start:
+        raise ValueError(f"Invalid range: {header_value}")
+    return start, min(end, size - 1)
+
+
+def _conditional_range(size: int, etag: str, mtime: float,
+                       request_headers: Optional[Dict[str, str]]) -> Tuple[int, Dict[str, str], int, int]:
+    """Apply conditional and Range request headers to a stored file.
+
+    Returns the status code, response headers and the inclusive byte range
+    to send, for stores that serve downloads themselves.
+    """
+    last_modified = formatdate(mtime, usegmt=True)
+    headers = {"accept-ranges": "bytes", "etag": etag, "last-modified": last_modified}
+    request_headers = request_headers or {}
+
+    if_none_match = request_headers.get("if-none-match")
+    if_modified_since = request_headers.get("if-modified-since")
+    if if_none_match:
+        if _etag_matches(etag, if_none_match):
+            return 304, headers, 0, -1
+    elif if_modified_since:
+        try:
+            if int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp():
+                return 304, headers, 0, -1
+        except (TypeError, ValueError):
+            pass
+
+    range_header = request_headers.get("range")
+    if_range = request_headers.get("if-range")
+    if range_header and (not if_range or if_range in (etag, last_modified)):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            pass  # malformed or multi-part: fall through to the whole file
+        else:
+            if byte_range is None:
+                headers["content-range"] = f"bytes */{size}"
+                return 416, headers, 0, -1
+            start, end = byte_range
+            headers["content-range"] = f"bytes {start}-{end}/{size}"
+            headers["content-length"] = str(end - start + 1)
+            return 206, headers, start, end
+
+    headers["content-length"] = str(size)
+    return 200, headers, 0, size - 1
+
+
+async def open_local_file(path: str, request_headers: Optional[Dict[str, str]] = None,
+                          validators: Optional[Tuple[str, float]] = None) -> LocalFileStream:
+    """Open a local file as a download; `validators` (etag, mtime) default to the file's own"""
+    def prepare() -> Tuple[int, int, Dict[str, str], int, int]:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            stat = os.fstat(fd)
+            etag, mtime = validators or (f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"', stat.st_mtime)
+            status_code, headers, start, end = _conditional_range(stat.st_size, etag, mtime, request_headers)
+            if end < start:
+                # 304 or 416: nothing to send, so nothing to keep open
+                os.close(fd)
+                fd = -1
+            elif hasattr(os, "posix_fadvise"):
+                # Let the kernel read ahead aggressively for the pread() loop
+                os.posix_fadvise(fd, start, end - start + 1, os.POSIX_FADV_SEQUENTIAL)
+        except BaseException:
+            if fd >= 0:
+                os.close(fd)
+            raise
+        return fd, status_code, headers, start, end
+
+    return LocalFileStream(*await asyncio.to_thread(prepare))
+
+
+class LocalBlobStore(BlobStore):
+    """Blobs on the local filesystem, for single-shop and offline deployments"""
+
+    def __init__(self, root: str = settings.LOCAL_BLOB_DIR):
+        self.root = os.path.realpath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, name: str) -> str:
+        path = os.path.realpath(os.path.join(self.root, name))
+        if not path.startswith(self.root + os.sep):
+            raise ValueError(f"Invalid blob name: {name}")
+        return path
+
+    @staticmethod
+    def _copy(file_obj: BinaryIO, out: BinaryIO) -> None:
+        # Spooled uploads that rolled over to disk are copied kernel-side with
+        # sendfile(); in-memory spools and other streams fall back to a copy loop
+        if getattr(file_obj, "_rolled", True):
+            try:
+                file_obj.flush()
+                in_fd = file_obj.fileno()
+                size = os.fstat(in_fd).st_size
+                offset = 0
+                while offset < size:
+                    sent = os.sendfile(out.fileno(), in_fd, offset, size - offset)
+                    if sent == 0:
+                        break
+                    offset += sent
+                if offset == size:
+                    return
+            except (AttributeError, OSError, ValueError):
+                pass
+            out.seek(0)
+            out.truncate()
+
+        file_obj.seek(0)
+        shutil.copyfileobj(file_obj, out, settings.UPLOAD_CHUNK_SIZE)
+
+    def _write(self, file_obj: BinaryIO, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = f"{path}.{uuid.uuid4().hex}.part"
+        try:
+            with open(partial_path, "wb") as out:
+                self._copy(file_obj, out)
+            # link() refuses to overwrite, matching the bucket's upsert=false
+            try:
+                os.link(partial_path, path)
+            except FileExistsError:
+                raise BlobExistsError(os.path.relpath(path, self.root))
+        finally:
+            if os.path.exists(partial_path):
+                os.unlink(partial_path)
+
+    async def upload(self, file_obj: BinaryIO, name: str, content_type: str) -> str:
+        await asyncio.to_thread(self._write, file_obj, self._path(name))
+        return name
+
+    async def download(self, name: str) -> bytes:
+        def read() -> bytes:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+
+        return await asyncio.to_thread(read)
+
+    async def exists(self, name: str) -> bool:
+        return await asyncio.to_thread(os.path.isfile, self._path(name))
+
+    async def create_upload_url(self, name: str, content_type: str, max_size: int) -> Dict[str, Any]:
+        # Stand-in for a storage signed URL: the backend's own upload
+        # endpoint, authorised by a token bound to this name, type and size
+        self._path(name)
+        token = sign_token(
+            {"kind": "blob_upload", "name": name, "type": content_type, "max": max_size},
+            settings.UPLOAD_URL_TTL,
+        )
+        return {
+            "url": f"{settings.LOCAL_UPLOAD_PATH}?token={token}",
+            "method": "PUT",
+            "headers": {"content-type": content_type},
+        }
+
+    async def open(self, name: str, request_headers: Optional[Dict[str, str]] = None) -> FileStream:
+        return await open_local_file(self._path(name), request_headers)
+
+    async def delete(self, names: List[str]) -> bool:
+        def remove() -> None:
+            for name in names:
+                try:
+                    os.unlink(self._path(name))
+                except FileNotFoundError:
+                    pass
+
+        await asyncio.to_thread(remove)
+        return True
+
+    async def move(self, source: str, destination: str) -> bool:
+        def rename() -> bool:
+            source_path, destination_path = self._path(source), self._path(destination)
+            os.makedirs(os.path.dirname(destination_path), exist_ok=True)
+            # link() + unlink() rather than rename(), which would overwrite
+            try:
+                os.link(source_path, destination_path)
+            except FileExistsError:
+                raise BlobExistsError(destination)
+            except FileNotFoundError:
+                return False
+            try:
+                os.unlink(source_path)
+            except FileNotFoundError:
+                pass
+            return True
+
+        return await asyncio.to_thread(rename)
+
+    async def iter_blobs(self, page_size: int = 1000) -> AsyncIterator[Tuple[str, Optional[float]]]:
+        def scan() -> List[Tuple[str, Optional[float]]]:
+            entries = []
+            for directory, _, filenames in os.walk(self.root):
+                for filename in filenames:
+                    if filename.endswith(".part"):
+                        continue  # upload still being written
+                    path = os.path.join(directory, filename)
+                    try:
+                        entries.append((os.path.relpath(path, self.root), os.stat(path).st_mtime))
+                    except FileNotFoundError:
+                        pass
+            return sorted(entries)
+
+        for entry in await asyncio.to_thread(scan):
+            yield entry
+
+
+class CachedBlobStore(BlobStore):
+    """Remote blob store fronted by a size-bounded LRU cache on local disk.
+
+    At the counter a lookup is followed by a download and often a reprint.
+    The lookup prefetches the job's blob in the background, and the
+    download and any reprint are then served from the local copy, with the
+    same range and conditional handling as LocalBlobStore. Blobs are never
+    overwritten in place, so a cached copy stays valid until the blob is
+    deleted. Misses with no prefetch in flight stream from the remote store.
+    """
+
+    def __init__(self, inner: BlobStore, cache: DiskCache):
+        self.inner = inner
+        self.cache = cache
+        self._fetches: Dict[str, asyncio.Task] = {}
+        self._semaphore = asyncio.Semaphore(settings.BLOB_CACHE_PREFETCH_CONCURRENCY)
+        self.prefetched = 0
+        self.prefetch_failures = 0
+        self.served_cached = 0
+        self.served_remote = 0
+
+    @staticmethod
+    def _key(name: str) -> str:
+        return hashlib.sha256(name.encode()).hexdigest()
+
+    def _cached(self, key: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Local path and validators of a cached blob"""
+        meta = self.cache.get(f"{key}.meta")
+        if meta is None:
+            return None
+        path = self.cache.path(key)
+        if path is None:
+            return None
+        return path, json.loads(meta)
+
+    def prefetch(self, name: str) -> None:
+        key = self._key(name)
+        if key in self._fetches or self._cached(key):
+            return
+        task = asyncio.create_task(self._fetch(name, key))
+        self._fetches[key] = task
+        task.add_done_callback(lambda _: self._fetches.pop(key, None))
+
+    async def _fetch(self, name: str, key: str) -> None:
+        async with self._semaphore:
+            temp_path = self.cache.temp_path()
+            try:
+                file_stream = await self.inner.open(name)
+                try:
+                    with open(temp_path, "wb") as f:
+                        async for chunk in file_stream.iter_chunks():
+                            await asyncio.to_thread(f.write, chunk)
+                finally:
+                    await file_stream.aclose()
+
+                # Keep the remote validators so cached and remote responses agree
+                try:
+                    mtime = parsedate_to_datetime(file_stream.headers["last-modified"]).timestamp()
+                except (KeyError, TypeError, ValueError):
+                    mtime = time.time()
+                meta = {"etag": file_stream.headers.get("etag") or f'"{key[:32]}"', "mtime": mtime}
+                if self.cache.put_file(key, temp_path):
+                    self.cache.put(f"{key}.meta", json.dumps(meta).encode())
+                    self.prefetched += 1
+
+            except Exception as error:
+                self.prefetch_failures += 1
+                logger.warning("Prefetch of %s failed: %s", name, error)
+            finally:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+
+    async def open(self, name: str, request_headers: Optional[Dict[str, str]] = None) -> FileStream:
+        key = self._key(name)
+        fetch = self._fetches.get(key)
+        if fetch is not None:
+            # The lookup's prefetch is already under way; finish it and serve locally
+            await asyncio.shield(fetch)
+
+        cached = self._cached(key)
+        if cached is None:
+            self.served_remote += 1
+            return await self.inner.open(name, request_headers)
+
+        path, meta = cached
+        try:
+            # Once open, the copy can be evicted without breaking the response
+            file_stream = await open_local_file(path, request_headers, (meta["etag"], meta["mtime"]))
+        except FileNotFoundError:
+            # Evicted since the lookup above, possibly by another worker
+            self.served_remote += 1
+            return await self.inner.open(name, request_headers)
+        self.served_cached += 1
+        return file_stream
+
+    async def download(self, name: str) -> bytes:
+        cached = self._cached(self._key(name))
+        if cached is None:
+            return await self.inner.download(name)
+
+        def read() -> bytes:
+            with open(cached[0], "rb") as f:
+                return f.read()
+
+        try:
+            return await asyncio.to_thread(read)
+        except FileNotFoundError:
+            return await self.inner.download(name)
+
+    async def upload(self, file_obj: BinaryIO, name: str, content_type: str) -> str:
+        return await self.inner.upload(file_obj, name, content_type)
+
+    def stored_name(self, name: str, size: int) -> str:
+        return self.inner.stored_name(name, size)
+
+    async def exists(self, name: str) -> bool:
+        # Always asked of the remote store: deduplication must not trust a
+        # local copy of a blob that has since been deleted
+        return await self.inner.exists(name)
+
+    async def create_upload_url(self, name: str, content_type: str, max_size: int) -> Dict[str, Any]:
+        return await self.inner.create_upload_url(name, content_type, max_size)
+
+    async def delete(self, names: List[str]) -> bool:
+        for name in names:
+            key = self._key(name)
+            self.cache.invalidate(key)
+            self.cache.invalidate(f"{key}.meta")
+        return await self.inner.delete(names)
+
+    async def move(self, source: str, destination: str) -> bool:
+        key = self._key(source)
+        self.cache.invalidate(key)
+        self.cache.invalidate(f"{key}.meta")
+        return await self.inner.move(source, destination)
+
+    def iter_blobs(self, page_size: int = 1000) -> AsyncIterator[Tuple[str, Optional[float]]]:
+        return self.inner.iter_blobs(page_size)
+
+    def iter_part_sets(self, page_size: int = 1000) -> AsyncIterator[Tuple[List[str], Optional[float], bool]]:
+        return self.inner.iter_part_sets(page_size)
+
+    def cache_stats(self) -> Optional[Dict[str, Any]]:
+        return {
+            **self.cache.stats(),
+            "prefetched": self.prefetched,
+            "prefetch_failures": self.prefetch_failures,
+            "prefetching": len(self._fetches),
+            "served_cached": self.served_cached,
+            "served_remote": self.served_remote,
+        }
+
+    async def warm_up(self, connections: int) -> int:
+        return await self.inner.warm_up(connections)
+
+    async def aclose(self) -> None:
+        for task in list(self._fetches.values()):
+            task.cancel()
+        await self.inner.aclose()
+
+
+def create_blob_store() -> BlobStore:
+    """Build the blob backend selected by BLOB_BACKEND"""
+    if settings.BLOB_BACKEND == "local":
+        return LocalBlobStore()
+    if settings.BLOB_BACKEND == "supabase":
+        store = SupabaseBlobStore()
+        if settings.BLOB_CACHE_ENABLED:
+            return CachedBlobStore(store, DiskCache(settings.BLOB_CACHE_DIR, DiskCache.worker_share(settings.BLOB_CACHE_BYTES)))
+        return store
+    raise ValueError(f"Unknown BLOB_BACKEND: {settings.BLOB_BACKEND}")
@@ -0,0 +1,225 @@
+import os
+import re
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Generic, Hashable, Optional, Tuple, TypeVar
+from config import settings
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """In-process LRU cache whose entries also expire after a time-to-live.
+
+    Not thread-safe: it is meant to be used from the event loop only.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[V]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        deadline, value = entry
+        if deadline <= time.monotonic():
+            del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """Return a live entry without touching LRU order or hit/miss counters"""
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def set(self, key: Hashable, value: V, expires_in: Optional[float] = None) -> None:
+        """Cache `value`; `expires_in` can only shorten the default TTL"""
+        ttl = self.ttl if expires_in is None else min(self.ttl, expires_in)
+        if ttl <= 0 or self.max_entries <= 0:
+            self._entries.pop(key, None)
+            return
+
+        self._entries[key] = (time.monotonic() + ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+class DiskCache:
+    """Size-bounded LRU cache of files in a local directory.
+
+    Reads refresh an entry's mtime and writes evict the least recently used
+    files once the total goes over `max_bytes`. The index is rebuilt from
+    the directory (oldest mtime first) on startup, so entries survive a
+    restart. Workers sharing a directory each enforce the bound on the
+    entries they know about, so each is given its share of the configured
+    budget (`worker_share`) to keep the directory as a whole within it.
+    Event loop only, like TTLCache.
+    """
+
+    KEY_PATTERN = re.compile(r"^[0-9a-z][0-9a-z._-]*$")
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = os.path.realpath(root)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root, exist_ok=True)
+        self._entries: "OrderedDict[str, int]" = OrderedDict()  # key -> size, LRU first
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        found = []
+        for entry in os.scandir(self.root):
+            if entry.is_file() and entry.name.endswith(".tmp"):
+                # Left behind by a write that never finished (recent ones may
+                # belong to another worker sharing the directory)
+                if entry.stat().st_mtime < time.time() - 3600:
+                    os.unlink(entry.path)
+            elif entry.is_file() and self.KEY_PATTERN.match(entry.name):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.size += size
+        self._evict()
+
+    @staticmethod
+    def worker_share(max_bytes: int) -> int:
+        """This worker's part of a cache budget shared by all of the server's workers"""
+        return max_bytes // max(settings.WEB_CONCURRENCY, 1)
+
+    def _path(self, key: str) -> str:
+        if not self.KEY_PATTERN.match(key):
+            raise ValueError(f"Invalid cache key: {key!r}")
+        return os.path.join(self.root, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except FileNotFoundError:
+            # Removed by another worker sharing the directory
+            self.size -= self._entries.pop(key, 0)
+            self.misses += 1
+            return None
+
+        if key not in self._entries:
+            self._entries[key] = len(data)
+            self.size += len(data)
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+
+    def path(self, key: str) -> Optional[str]:
+        """Path of a cached file, marking it recently used; None on a miss"""
+        path = self._path(key)
+        try:
+            size = os.stat(path).st_size
+            os.utime(path)
+        except FileNotFoundError:
+            self.size -= self._entries.pop(key, 0)
+            self.misses += 1
+            return None
+
+        if key not in self._entries:
+            self._entries[key] = size
+            self.size += size
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return path
+
+    def temp_path(self) -> str:
+        """A scratch path in the cache directory, for files later added with put_file"""
+        return os.path.join(self.root, f"{uuid.uuid4().hex}.tmp")
+
+    def put_file(self, key: str, source: str) -> bool:
+        """Move a finished file (from temp_path) into the cache; False if it is too large to keep"""
+        size = os.path.getsize(source)
+        if size > self.max_bytes:
+            os.unlink(source)
+            return False
+        os.replace(source, self._path(key))
+
+        self.size += size - self._entries.pop(key, 0)
+        self._entries[key] = size
+        self._evict()
+        return True
+
+    def put(self, key: str, data: bytes) -> None:
+        if len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        partial_path = f"{path}.tmp"
+        with open(partial_path, "wb") as f:
+            f.write(data)
+        os.replace(partial_path, path)
+
+        self.size += len(data) - self._entries.pop(key, 0)
+        self._entries[key] = len(data)
+        self._evict()
+
+    def invalidate(self, key: str) -> None:
+        self.size -= self._entries.pop(key, 0)
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self) -> None:
+        while self.size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+            try:
+                os.unlink(os.path.join(self.root, key))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
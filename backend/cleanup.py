@@ -1,60 +1,247 @@
 #!/usr/bin/env python3
 """
 Cleanup script for expired print jobs
-Run with: python cleanup.py
+Run with: python cleanup.py [--batch-size N] [--concurrency N] [--resume] [--reconcile]
+
+Expired jobs are paged through in (expires_at, otp) order with keyset
+pagination, and each page's rows and blobs are deleted in bounded parallel
+batches. Progress is checkpointed after every page, so an interrupted run can
+pick up where it stopped with --resume. --reconcile additionally removes
+blobs that no job references, parts of abandoned multipart uploads and jobs
+whose blob is missing.
 """
 
+import argparse
 import asyncio
-from storage import SupabaseStorage
+import json
+import os
+import time
 from datetime import datetime
+from typing import Any, Dict, List, Optional
+from storage import SupabaseStorage
+from resumable import ResumableUploads
+from expiry import expiry_timestamp
+from logs import setup_logging
+
+DEFAULT_CHECKPOINT = ".cleanup_checkpoint.json"
+
+
+def load_checkpoint(path: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+def save_checkpoint(path: str, checkpoint: Dict[str, Any]) -> None:
+    partial_path = f"{path}.tmp"
+    with open(partial_path, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(partial_path, path)
+
+
+async def delete_blobs(storage: SupabaseStorage, file_paths: List[str], batch_size: int, concurrency: int) -> int:
+    """Delete blobs in parallel batches; returns how many batches failed"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete_batch(batch: List[str]) -> bool:
+        async with semaphore:
+            return await storage.delete_files(batch)
+
+    batches = [file_paths[i:i + batch_size] for i in range(0, len(file_paths), batch_size)]
+    results = await asyncio.gather(*(delete_batch(batch) for batch in batches))
+    return results.count(False)
+
+
+async def cleanup_expired_jobs(storage: SupabaseStorage, batch_size: int = 100, concurrency: int = 4,
+                               checkpoint_path: str = DEFAULT_CHECKPOINT, resume: bool = False) -> int:
+    """Delete expired jobs page by page; returns the number of jobs removed"""
+    checkpoint = load_checkpoint(checkpoint_path) if resume else None
+    if checkpoint:
+        cutoff = checkpoint["cutoff"]
+        after = tuple(checkpoint["after"]) if checkpoint["after"] else None
+        print(f"↩️  Resuming cleanup of jobs expired before {cutoff} after {after}")
+    else:
+        cutoff = datetime.now().isoformat()
+        after = None
+
+    semaphore = asyncio.Semaphore(concurrency)
+    removed = 0
+    failed_pages = 0
+
+    async def expire_page(otps: List[str]) -> int:
+        async with semaphore:
+            return await storage.expire_jobs(otps)
+
+    async def finish(page_key: Any, task: "asyncio.Task[int]") -> None:
+        nonlocal removed, failed_pages
+        try:
+            removed += await task
+            # Only advance past pages that finished in order, so a resume
+            # never skips a page that failed
+            if not failed_pages:
+                save_checkpoint(checkpoint_path, {"cutoff": cutoff, "after": page_key})
+        except Exception as error:
+            failed_pages += 1
+            print(f"⚠️  Page ending at {page_key} failed: {error}")
+
+    # Pages are read sequentially (each keyset query needs the previous
+    # page's last key) while up to `concurrency` of them are being deleted
+    in_flight: List[Any] = []
+    while True:
+        rows = await storage.jobs.list_by_expiry(before=cutoff, after=after, limit=batch_size)
+        if not rows:
+            break
+        after = (rows[-1]["expires_at"], rows[-1]["otp"])
+        in_flight.append((after, asyncio.create_task(expire_page([row["otp"] for row in rows]))))
+
+        while in_flight and (in_flight[0][1].done() or len(in_flight) >= concurrency):
+            await finish(*in_flight.pop(0))
+
+        if len(rows) < batch_size:
+            break
+
+    for page_key, task in in_flight:
+        await finish(page_key, task)
+
+    if failed_pages:
+        print(f"⚠️  {failed_pages} page(s) failed; rerun with --resume to retry them")
+    elif os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    return removed
 
-async def cleanup_expired_jobs():
+
+async def reconcile_orphans(storage: SupabaseStorage, batch_size: int = 100, concurrency: int = 4,
+                            grace_seconds: float = 3600) -> Dict[str, int]:
+    """Remove blobs without a job, jobs without a blob and abandoned multipart parts.
+
+    Anything younger than `grace_seconds` is left alone, since an upload
+    writes its blob before its row (and its parts before their manifest).
+    """
+    cutoff = time.time() - grace_seconds
+
+    # Blobs that no job references
+    blob_names = set()
+    orphan_blobs: List[str] = []
+    page: List[str] = []
+    async for name, created_at in storage.blobs.iter_blobs(batch_size):
+        blob_names.add(name)
+        if created_at is None or created_at < cutoff:
+            page.append(name)
+        if len(page) >= batch_size:
+            referenced = set(await storage.jobs.existing_file_paths(page))
+            orphan_blobs.extend(name for name in page if name not in referenced)
+            page = []
+    if page:
+        referenced = set(await storage.jobs.existing_file_paths(page))
+        orphan_blobs.extend(name for name in page if name not in referenced)
+
+    failed_batches = await delete_blobs(storage, orphan_blobs, batch_size, concurrency)
+
+    # Parts of multipart transfers that failed or were abandoned before
+    # committing a manifest
+    orphan_parts: List[str] = []
+    orphan_part_sets = 0
+    async for part_names, created_at, in_use in storage.blobs.iter_part_sets(batch_size):
+        if not in_use and created_at is not None and created_at < cutoff:
+            orphan_parts.extend(part_names)
+            orphan_part_sets += 1
+
+    failed_batches += await delete_blobs(storage, orphan_parts, batch_size, concurrency)
+
+    # Jobs whose blob is gone can never be downloaded
+    missing_blob_jobs: List[str] = []
+    after = None
+    while True:
+        rows = await storage.jobs.list_by_expiry(after=after, limit=batch_size)
+        for row in rows:
+            try:
+                old_enough = expiry_timestamp(row["upload_time"]) < cutoff
+            except (TypeError, ValueError):
+                old_enough = True
+            if row["file_path"] not in blob_names and old_enough:
+                missing_blob_jobs.append(row["otp"])
+        if len(rows) < batch_size:
+            break
+        after = (rows[-1]["expires_at"], rows[-1]["otp"])
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def delete_job(otp: str) -> bool:
+        async with semaphore:
+            return await storage.delete(otp)
+
+    await asyncio.gather(*(delete_job(otp) for otp in missing_blob_jobs))
+
+    return {
+        "orphan_blobs": len(orphan_blobs),
+        "orphan_part_sets": orphan_part_sets,
+        "failed_blob_batches": failed_batches,
+        "jobs_missing_blobs": len(missing_blob_jobs),
+    }
+
+
+async def main(args: argparse.Namespace) -> bool:
     """Clean up expired print jobs and files"""
     storage = SupabaseStorage()
-    
+
     try:
         print("🧹 Starting cleanup of expired print jobs...")
-        
-        # Get expired jobs first to delete their files
-        current_time = datetime.now().isoformat()
-        result = storage.supabase.table("print_jobs").select("file_path").lt("expires_at", current_time).execute()
-        
-        expired_jobs = result.data if result.data else []
-        
-        # Delete files from storage
-        if expired_jobs:
-            file_paths = [job["file_path"] for job in expired_jobs]
-            try:
-                storage.supabase.storage.from_("print-files").remove(file_paths)
-                print(f"🗑️  Deleted {len(file_paths)} files from storage")
-            except Exception as e:
-                print(f"⚠️  Some files could not be deleted from storage: {e}")
-        
-        # Delete expired database records
-        delete_result = storage.supabase.table("print_jobs").delete().lt("expires_at", current_time).execute()
-        
-        print(f"✅ Cleaned up {len(expired_jobs)} expired print jobs")
-        
+
+        removed = await cleanup_expired_jobs(
+            storage,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            checkpoint_path=args.checkpoint,
+            resume=args.resume,
+        )
+        print(f"✅ Cleaned up {removed} expired print jobs")
+
+        stale_uploads = ResumableUploads().purge_stale()
+        print(f"✅ Removed {stale_uploads} abandoned resumable uploads")
+
+        if args.reconcile:
+            print("\n🔎 Reconciling blobs and jobs...")
+            result = await reconcile_orphans(
+                storage,
+                batch_size=args.batch_size,
+                concurrency=args.concurrency,
+                grace_seconds=args.grace_minutes * 60,
+            )
+            print(f"🗑️  Deleted {result['orphan_blobs']} orphan blobs ({result['failed_blob_batches']} failed batches)")
+            print(f"🗑️  Deleted {result['orphan_part_sets']} abandoned multipart uploads")
+            print(f"🗑️  Deleted {result['jobs_missing_blobs']} jobs whose blob was missing")
+
         # Get current statistics
-        stats_result = storage.supabase.table("print_jobs").select("status").execute()
-        stats = stats_result.data if stats_result.data else []
-        
-        total_jobs = len(stats)
-        pending_jobs = len([job for job in stats if job["status"] == "pending"])
-        completed_jobs = len([job for job in stats if job["status"] == "completed"])
-        
+        total_jobs = await storage.jobs.count()
+        pending_jobs = await storage.jobs.count("pending")
+        completed_jobs = await storage.jobs.count("completed")
+
         print("\n📊 Current Statistics:")
         print(f"Total jobs: {total_jobs}")
         print(f"Pending jobs: {pending_jobs}")
         print(f"Completed jobs: {completed_jobs}")
-        
+
         print("\n🎉 Cleanup completed successfully!")
-        
+
     except Exception as error:
         print(f"❌ Cleanup error: {error}")
         return False
-    
+    finally:
+        await storage.aclose()
+
     return True
 
 if __name__ == "__main__":
-    asyncio.run(cleanup_expired_jobs())
+    parser = argparse.ArgumentParser(description="Clean up expired XeroQ print jobs")
+    parser.add_argument("--batch-size", type=int, default=100, help="jobs per page and blobs per delete call")
+    parser.add_argument("--concurrency", type=int, default=4, help="pages/batches deleted in parallel")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="checkpoint file for resuming")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    parser.add_argument("--reconcile", action="store_true", help="also remove orphan blobs, abandoned parts and jobs missing blobs")
+    parser.add_argument("--grace-minutes", type=float, default=60, help="skip blobs/jobs younger than this")
+    args = parser.parse_args()
+    setup_logging(fmt="text")
+    asyncio.run(main(args))
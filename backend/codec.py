@@ -0,0 +1,206 @@
+import zlib
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, BinaryIO, Callable, Dict, Optional
+from config import settings
+from blob_store import MANIFEST_SUFFIX, FileStream, _conditional_range
+
+try:
+    import zstandard
+except ImportError:  # falls back to gzip
+    zstandard = None
+
+
+class Codec:
+    """Compression applied to blobs at rest, recorded as a suffix on the blob path"""
+
+    name = ""
+    suffix = ""
+    tail_bytes = 0  # how much of the end of the stream content_size needs
+
+    def compress(self, source: BinaryIO, target: BinaryIO, size: int) -> None:
+        """Compress `size` bytes from `source` into `target` (run in a thread)"""
+        raise NotImplementedError
+
+    def decompressor(self) -> Any:
+        """A streaming decoder with decompress(chunk) and flush()"""
+        raise NotImplementedError
+
+    def content_size(self, head: bytes, tail: bytes = b"") -> Optional[int]:
+        """Decoded size recorded in the stream's header (or in its last `tail_bytes`), if the format has one"""
+        return None
+
+
+class ZstdCodec(Codec):
+    name = "zstd"
+    suffix = ".zst"
+
+    def __init__(self, level: int):
+        self.level = level
+
+    def compress(self, source: BinaryIO, target: BinaryIO, size: int) -> None:
+        # Passing the size writes it into the frame header, which gives
+        # downloads their Content-Length back
+        zstandard.ZstdCompressor(level=self.level).copy_stream(
+            source, target, size=size, read_size=settings.UPLOAD_CHUNK_SIZE
+        )
+
+    def decompressor(self) -> Any:
+        return zstandard.ZstdDecompressor().decompressobj()
+
+    def content_size(self, head: bytes, tail: bytes = b"") -> Optional[int]:
+        try:
+            size = zstandard.frame_content_size(head)
+        except zstandard.ZstdError:
+            return None
+        return size if size >= 0 else None
+
+
+class GzipCodec(Codec):
+    name = "gzip"
+    suffix = ".gz"
+    tail_bytes = 4  # ISIZE, the decoded size modulo 2^32 (uploads stay far below that)
+
+    def __init__(self, level: int):
+        self.level = min(max(level, 1), 9)
+
+    def compress(self, source: BinaryIO, target: BinaryIO, size: int) -> None:
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)  # 31 = gzip framing
+        for chunk in iter(lambda: source.read(settings.UPLOAD_CHUNK_SIZE), b""):
+            target.write(compressor.compress(chunk))
+        target.write(compressor.flush())
+
+    def decompressor(self) -> Any:
+        return zlib.decompressobj(31)
+
+    def content_size(self, head: bytes, tail: bytes = b"") -> Optional[int]:
+        return int.from_bytes(tail, "little") if len(tail) == self.tail_bytes else None
+
+
+CODECS = {
+    ZstdCodec.suffix: ZstdCodec(settings.BLOB_CODEC_LEVEL),
+    GzipCodec.suffix: GzipCodec(settings.BLOB_CODEC_LEVEL),
+}
+
+
+def active_codec() -> Optional[Codec]:
+    """The codec selected by BLOB_CODEC (gzip when zstandard is not installed)"""
+    if settings.BLOB_CODEC == "none":
+        return None
+    if settings.BLOB_CODEC == "zstd" and zstandard is not None:
+        return CODECS[ZstdCodec.suffix]
+    return CODECS[GzipCodec.suffix]
+
+
+def codec_for_type(content_type: str) -> Optional[Codec]:
+    """The codec new uploads of this content type are stored with, if any"""
+    if content_type not in settings.BLOB_CODEC_TYPES:
+        return None
+    return active_codec()
+
+
+def codec_for_path(file_path: str) -> Optional[Codec]:
+    """The codec a stored blob was written with, from its path"""
+    base = file_path.removesuffix(MANIFEST_SUFFIX)
+    for suffix, codec in CODECS.items():
+        if base.endswith(suffix):
+            if suffix == ZstdCodec.suffix and zstandard is None:
+                raise RuntimeError(f"{file_path} is zstd-compressed but zstandard is not installed")
+            return codec
+    return None
+
+
+def decode_bytes(codec: Codec, data: bytes) -> bytes:
+    decoder = codec.decompressor()
+    return decoder.decompress(data) + decoder.flush()
+
+
+class DecodedFileStream(FileStream):
+    """Download of a compressed blob, decompressed on the fly.
+
+    The decoded size is read from the stored format (zstd's frame header,
+    gzip's trailer), so downloads get their Content-Length and a single
+    Range is honoured: the blob is decoded from the start and the bytes
+    before the range are dropped, which costs CPU rather than a second
+    stored copy. ETag and Last-Modified come from the stored blob, so
+    conditional requests and If-Range keep working. When the size cannot
+    be read the whole file is sent, as a server may ignore Range.
+    """
+
+    def __init__(self, inner: FileStream, codec: Codec):
+        self.inner = inner
+        self.codec = codec
+        self.status_code = inner.status_code
+        self.headers = {
+            name: value for name, value in inner.headers.items()
+            if name in ("etag", "last-modified")
+        }
+        self.headers["accept-ranges"] = "none"
+        self._chunks: Optional[AsyncIterator[bytes]] = None
+        self._head = b""
+        self._start = 0
+        self._end: Optional[int] = None  # last decoded byte to send, None = to the end
+
+    @classmethod
+    async def open(cls, inner: FileStream, codec: Codec, request_headers: Optional[Dict[str, str]] = None,
+                   read_tail: Optional[Callable[[int], Awaitable[bytes]]] = None) -> "DecodedFileStream":
+        """Wrap an opened stored blob; `read_tail(n)` fetches its last n bytes for formats that need them"""
+        stream = cls(inner, codec)
+        if stream.status_code != 200:
+            return stream
+
+        # Read ahead to the format header for the decoded size
+        stream._chunks = inner.iter_chunks().__aiter__()
+        stream._head = await anext(stream._chunks, b"")
+        tail = await read_tail(codec.tail_bytes) if codec.tail_bytes and read_tail else b""
+        size = codec.content_size(stream._head, tail)
+        if size is None:
+            return stream
+
+        try:
+            mtime = parsedate_to_datetime(inner.headers["last-modified"]).timestamp()
+        except (KeyError, TypeError, ValueError):
+            mtime = 0.0
+        etag = inner.headers.get("etag") or f'"{codec.name}-{size}-{int(mtime)}"'
+        # The stored blob already answered the conditional headers
+        ranged = {
+            header: request_headers.get(header)
+            for header in ("range", "if-range")
+            if request_headers and request_headers.get(header)
+        }
+        stream.status_code, stream.headers, start, end = _conditional_range(size, etag, mtime, ranged)
+        if stream.status_code == 416:
+            await stream.aclose()
+            stream._chunks = None
+        elif stream.status_code == 206:
+            stream._start, stream._end = start, end
+        return stream
+
+    async def _decoded(self) -> AsyncIterator[bytes]:
+        decoder = self.codec.decompressor()
+        if self._head:
+            yield decoder.decompress(self._head)
+        async for chunk in self._chunks:
+            yield decoder.decompress(chunk)
+        yield decoder.flush()
+
+    async def iter_chunks(self) -> AsyncIterator[bytes]:
+        if self._chunks is None:
+            return
+        position = 0  # decoded offset of the next chunk
+        try:
+            async for data in self._decoded():
+                chunk_start, position = position, position + len(data)
+                if position <= self._start:
+                    continue
+                if self._end is not None and chunk_start > self._end:
+                    break
+                data = data[max(self._start - chunk_start, 0):]
+                if self._end is not None:
+                    data = data[:self._end + 1 - max(chunk_start, self._start)]
+                if data:
+                    yield data
+        finally:
+            await self.aclose()
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
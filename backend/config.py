@@ -22,9 +22,129 @@ class Settings:
     # Server Configuration for large files
     MAX_REQUEST_SIZE = 100 * 1024 * 1024  # 100MB to handle 50MB PDFs with overhead
     UPLOAD_CHUNK_SIZE = 1024 * 1024  # 1MB chunks
+    DOWNLOAD_CHUNK_SIZE = int(os.getenv("DOWNLOAD_CHUNK_SIZE", "65536"))  # 64KB chunks
+    
+    # Server processes: gunicorn.conf.py for production, main.py for development
+    HOST = os.getenv("HOST", "0.0.0.0")
+    PORT = int(os.getenv("PORT", "8000"))
+    WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "0"))  # worker processes, 0 = one per available core (gunicorn.conf.py sets the actual count)
+    WORKER_MAX_MEMORY = int(os.getenv("WORKER_MAX_MEMORY", str(768 * 1024 * 1024)))  # RSS that recycles a worker, 0 = never
+    GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "120"))  # seconds in-flight uploads get to finish on shutdown
+    KEEPALIVE_TIMEOUT = int(os.getenv("KEEPALIVE_TIMEOUT", "60"))  # seconds an idle connection is kept open
+    
+    # Admission control: separate pools for uploads and the admin (print
+    # counter) endpoints, and a global budget for upload bytes held in memory
+    MAX_CONNECTIONS = int(os.getenv("MAX_CONNECTIONS", "1000"))  # uvicorn's outer cap, per worker
+    UPLOAD_CONCURRENCY = int(os.getenv("UPLOAD_CONCURRENCY", "16"))
+    UPLOAD_QUEUE_LIMIT = int(os.getenv("UPLOAD_QUEUE_LIMIT", "64"))
+    UPLOAD_QUEUE_TIMEOUT = float(os.getenv("UPLOAD_QUEUE_TIMEOUT", "30"))  # seconds
+    ADMIN_CONCURRENCY = int(os.getenv("ADMIN_CONCURRENCY", "64"))
+    ADMIN_QUEUE_LIMIT = int(os.getenv("ADMIN_QUEUE_LIMIT", "256"))
+    ADMIN_QUEUE_TIMEOUT = float(os.getenv("ADMIN_QUEUE_TIMEOUT", "5"))  # seconds
+    UPLOAD_SPOOL_MEMORY = int(os.getenv("UPLOAD_SPOOL_MEMORY", str(8 * 1024 * 1024)))  # per upload
+    UPLOAD_MEMORY_BUDGET = int(os.getenv("UPLOAD_MEMORY_BUDGET", str(64 * 1024 * 1024)))  # all uploads, split between the workers
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", "5"))  # seconds
+    
+    # Metadata backend: "supabase" (print_jobs table) or "sqlite" (embedded, WAL)
+    METADATA_BACKEND = os.getenv("METADATA_BACKEND", "supabase").lower()
+    SQLITE_PATH = os.getenv("SQLITE_PATH", "./data/xeroq.db")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_READERS = int(os.getenv("SQLITE_READERS", "4"))  # reader threads, one connection each
+    
+    # Read-through cache of print jobs keyed by OTP
+    JOB_CACHE_SIZE = int(os.getenv("JOB_CACHE_SIZE", "1024"))  # single-worker only, see SupabaseStorage
+    JOB_CACHE_TTL = float(os.getenv("JOB_CACHE_TTL", "30"))  # seconds
+    
+    # How often the incremental job counters are reset from the database
+    COUNTER_RECONCILE_INTERVAL = float(os.getenv("COUNTER_RECONCILE_INTERVAL", "300"))  # seconds
+    
+    # Background expiry scheduler
+    EXPIRY_SCHEDULER_ENABLED = os.getenv("EXPIRY_SCHEDULER_ENABLED", "true").lower() == "true"
+    EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "100"))
+    EXPIRY_CONCURRENCY = int(os.getenv("EXPIRY_CONCURRENCY", "4"))
+    EXPIRY_PAGE_SIZE = int(os.getenv("EXPIRY_PAGE_SIZE", "1000"))
+    EXPIRY_RESCAN_INTERVAL = float(os.getenv("EXPIRY_RESCAN_INTERVAL", "300"))  # seconds
+    EXPIRY_RETRY_DELAY = float(os.getenv("EXPIRY_RETRY_DELAY", "30"))  # seconds
+    
+    # Blob storage backend: "supabase" (print-files bucket) or "local" (disk)
+    BLOB_BACKEND = os.getenv("BLOB_BACKEND", "supabase").lower()
+    LOCAL_BLOB_DIR = os.getenv("LOCAL_BLOB_DIR", "./data/blobs")
+    
+    # Direct-to-storage uploads: signed upload URL, then a finalize call
+    UPLOAD_SIGNING_SECRET = os.getenv("UPLOAD_SIGNING_SECRET", "")  # share across workers
+    UPLOAD_URL_TTL = int(os.getenv("UPLOAD_URL_TTL", "900"))  # seconds
+    LOCAL_UPLOAD_PATH = os.getenv("LOCAL_UPLOAD_PATH", "/api/upload/direct")  # local stand-in endpoint
+    
+    # Resumable (tus-style) uploads staged on local disk until finalized
+    RESUMABLE_UPLOAD_DIR = os.getenv("RESUMABLE_UPLOAD_DIR", "./data/uploads")
+    RESUMABLE_UPLOAD_TTL = float(os.getenv("RESUMABLE_UPLOAD_TTL", "86400"))  # seconds
+    RESUMABLE_UPLOAD_PURGE_INTERVAL = float(os.getenv("RESUMABLE_UPLOAD_PURGE_INTERVAL", "3600"))  # seconds
+    
+    # Storage HTTP client configuration (shared keep-alive pool)
+    STORAGE_BUCKET = os.getenv("STORAGE_BUCKET", "print-files")
+    STORAGE_POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "20"))
+    STORAGE_POOL_KEEPALIVE = int(os.getenv("STORAGE_POOL_KEEPALIVE", "10"))
+    STORAGE_KEEPALIVE_EXPIRY = float(os.getenv("STORAGE_KEEPALIVE_EXPIRY", "30"))
+    STORAGE_CONNECT_TIMEOUT = float(os.getenv("STORAGE_CONNECT_TIMEOUT", "5"))
+    STORAGE_TIMEOUT = float(os.getenv("STORAGE_TIMEOUT", "60"))  # read/write, sized for 50MB files
+    STORAGE_POOL_TIMEOUT = float(os.getenv("STORAGE_POOL_TIMEOUT", "10"))
+    STORAGE_WARM_CONNECTIONS = int(os.getenv("STORAGE_WARM_CONNECTIONS", "4"))  # opened per client at startup
+    
+    # Large blobs are uploaded/downloaded as parallel parts
+    MULTIPART_THRESHOLD = int(os.getenv("MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+    MULTIPART_PART_SIZE = int(os.getenv("MULTIPART_PART_SIZE", str(5 * 1024 * 1024)))
+    MULTIPART_CONCURRENCY = int(os.getenv("MULTIPART_CONCURRENCY", "4"))
+    MULTIPART_RETRIES = int(os.getenv("MULTIPART_RETRIES", "3"))
+    
+    # Local disk cache in front of remote blob storage (prefetched on lookup)
+    BLOB_CACHE_ENABLED = os.getenv("BLOB_CACHE_ENABLED", "true").lower() == "true"
+    BLOB_CACHE_DIR = os.getenv("BLOB_CACHE_DIR", "./data/blob-cache")
+    BLOB_CACHE_BYTES = int(os.getenv("BLOB_CACHE_BYTES", str(2 * 1024 * 1024 * 1024)))
+    BLOB_CACHE_PREFETCH_CONCURRENCY = int(os.getenv("BLOB_CACHE_PREFETCH_CONCURRENCY", "4"))
+    
+    # Compression of stored blobs for the content types that benefit from it
+    # ("zstd", "gzip" or "none"; zstd falls back to gzip without zstandard).
+    # DOCX is a zip archive already, so only uncompressed image formats are listed
+    BLOB_CODEC = os.getenv("BLOB_CODEC", "zstd").lower()
+    BLOB_CODEC_LEVEL = int(os.getenv("BLOB_CODEC_LEVEL", "3"))
+    BLOB_CODEC_TYPES = set(filter(None, os.getenv("BLOB_CODEC_TYPES", "image/bmp,image/tiff").split(",")))
+    # Store the raw bytes unless compression gets them below this fraction
+    BLOB_CODEC_MAX_RATIO = float(os.getenv("BLOB_CODEC_MAX_RATIO", "0.9"))
+    
+    # Print-ready conversion of DOCX and images to PDF after upload
+    CONVERSION_ENABLED = os.getenv("CONVERSION_ENABLED", "true").lower() == "true"
+    CONVERSION_WORKERS = int(os.getenv("CONVERSION_WORKERS", "2"))  # worker processes
+    CONVERSION_TIMEOUT = float(os.getenv("CONVERSION_TIMEOUT", "120"))  # seconds per document
+    CONVERSION_DPI = int(os.getenv("CONVERSION_DPI", "300"))
+    SOFFICE_PATH = os.getenv("SOFFICE_PATH", "soffice")  # LibreOffice, for DOCX
+    
+    # First-page previews for the print counter, rendered in the background
+    PREVIEW_ENABLED = os.getenv("PREVIEW_ENABLED", "true").lower() == "true"
+    PREVIEW_WORKERS = int(os.getenv("PREVIEW_WORKERS", "1"))  # worker processes
+    PREVIEW_MAX_SIZE = int(os.getenv("PREVIEW_MAX_SIZE", "480"))  # pixels along the long edge
+    PREVIEW_QUALITY = int(os.getenv("PREVIEW_QUALITY", "70"))  # JPEG quality
+    PREVIEW_TIMEOUT = float(os.getenv("PREVIEW_TIMEOUT", "30"))  # seconds
+    PREVIEW_CACHE_DIR = os.getenv("PREVIEW_CACHE_DIR", "./data/previews")
+    PREVIEW_CACHE_BYTES = int(os.getenv("PREVIEW_CACHE_BYTES", str(64 * 1024 * 1024)))
+    
+    # Prometheus metrics on /metrics (request latency, storage timings, bytes)
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+    # With several workers each one writes its samples here and a scrape adds
+    # them up (gunicorn.conf.py passes it on as PROMETHEUS_MULTIPROC_DIR)
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "./data/metrics")
+    # How often each worker refreshes its job and admission gauges for
+    # scrapes that another worker answers
+    METRICS_SYNC_INTERVAL = float(os.getenv("METRICS_SYNC_INTERVAL", "5"))  # seconds
+    
+    # Logging: records go through a queue and are written by a background thread
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json").lower()  # "json" or "text"
+    LOG_CHUNK_TRACE = os.getenv("LOG_CHUNK_TRACE", "false").lower() == "true"  # one record per upload chunk
     
     # OTP Configuration
     OTP_EXPIRY_HOURS = int(os.getenv("OTP_EXPIRY_HOURS", "1"))
+    OTP_POOL_SIZE = int(os.getenv("OTP_POOL_SIZE", "1024"))  # pre-generated codes per refill
+    OTP_INSERT_ATTEMPTS = int(os.getenv("OTP_INSERT_ATTEMPTS", "3"))
     
     @classmethod
     def validate(cls):
@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import hashlib
+import logging
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Set
+from config import settings
+from blob_store import MANIFEST_SUFFIX, BlobExistsError
+from models import PrintJob
+from upload_stream import UPLOAD_TYPES
+
+try:
+    from PIL import Image, ImageOps, ImageSequence
+except ImportError:  # images are then printed as uploaded
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+PDF_CONTENT_TYPE = "application/pdf"
+
+# Page sizes in points (1/72 inch), portrait
+PAPER_SIZES = {
+    "a4": (595.28, 841.89),
+    "a3": (841.89, 1190.55),
+    "letter": (612.0, 792.0),
+    "legal": (612.0, 1008.0),
+    "4x6": (288.0, 432.0),
+    "5x7": (360.0, 504.0),
+}
+
+# The print options that change the rendered PDF (copies and duplex are
+# left to the printer)
+RENDER_OPTIONS = ("colorMode", "paperSize", "imageSize")
+
+
+def rendered_blob_name(file_path: str, print_options: Dict[str, Any]) -> str:
+    """Blob path of the print-ready PDF, next to the original and keyed by the options it was rendered with"""
+    options = {key: print_options.get(key) for key in RENDER_OPTIONS}
+    key = hashlib.sha256(json.dumps(options, sort_keys=True).encode()).hexdigest()[:16]
+    base = file_path[:-len(MANIFEST_SUFFIX)] if file_path.endswith(MANIFEST_SUFFIX) else file_path
+    return f"{base}.print/{key}.pdf"
+
+
+# --- Worker side: these run in the process pool, so they stay top level ---
+
+def _page_pixels(print_options: Dict[str, Any], landscape: bool, dpi: int):
+    width, height = PAPER_SIZES.get(print_options.get("paperSize") or "a4", PAPER_SIZES["a4"])
+    if landscape:
+        width, height = height, width
+    return round(width / 72 * dpi), round(height / 72 * dpi)
+
+
+def _render_page(image, print_options: Dict[str, Any], dpi: int):
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+        # Transparent areas print as paper white
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image)
+
+    mode = "L" if print_options.get("colorMode") == "bw" else "RGB"
+    image = image.convert(mode)
+    page = _page_pixels(print_options, image.width > image.height, dpi)
+
+    image_size = print_options.get("imageSize") or "fit"
+    if image_size == "fill":
+        # Cover the whole page, cropping the overflow evenly
+        image = ImageOps.fit(image, page, Image.LANCZOS)
+    elif image_size == "actual":
+        # Keep the image's physical size; anything past the page is cropped
+        source_dpi = image.info.get("dpi", (96, 96))[0] or 96
+        scale = dpi / float(source_dpi)
+        image = image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+                             Image.LANCZOS)
+    else:
+        image = ImageOps.contain(image, page, Image.LANCZOS)
+
+    canvas = Image.new(mode, page, "white")
+    canvas.paste(image, ((page[0] - image.width) // 2, (page[1] - image.height) // 2))
+    return canvas
+
+
+def render_image(source: str, target: str, print_options: Dict[str, Any], dpi: int) -> None:
+    """Lay an image out on the chosen paper size as a PDF (every page of a multi-page TIFF).
+
+    Each page is appended to the PDF as soon as it is rendered, so only one
+    full-resolution page is in memory at a time however long the TIFF is.
+    """
+    with Image.open(source) as image:
+        frames = ImageSequence.Iterator(image) if image.format == "TIFF" else [image]
+        for index, frame in enumerate(frames):
+            page = _render_page(frame.copy(), print_options, dpi)
+            page.save(target, "PDF", resolution=dpi, append=index > 0)
+            page.close()
+
+
+def render_docx(source: str, target: str, print_options: Dict[str, Any], soffice: str, timeout: float) -> None:
+    """Convert a DOCX to PDF with headless LibreOffice (grayscale through Ghostscript if available)"""
+    with tempfile.TemporaryDirectory() as workdir:
+        # A private profile lets several conversions run side by side
+        subprocess.run(
+            [soffice, f"-env:UserInstallation=file://{workdir}/profile", "--headless",
+             "--convert-to", "pdf", "--outdir", workdir, source],
+            check=True, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        converted = os.path.join(workdir, os.path.splitext(os.path.basename(source))[0] + ".pdf")
+
+        ghostscript = shutil.which("gs")
+        if print_options.get("colorMode") == "bw" and ghostscript:
+            subprocess.run(
+                [ghostscript, "-q", "-dBATCH", "-dNOPAUSE", "-dSAFER", "-sDEVICE=pdfwrite",
+                 "-sColorConversionStrategy=Gray", "-dProcessColorModel=/DeviceGray",
+                 f"-sOutputFile={target}", converted],
+                check=True, timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            )
+        else:
+            shutil.move(converted, target)
+
+
+def convert_file(source: str, target: str, content_type: str, print_options: Dict[str, Any],
+                 dpi: int, soffice: Optional[str], timeout: float) -> None:
+    """Render `source` into a print-ready PDF at `target`"""
+    family, _ = UPLOAD_TYPES[content_type]
+    if family == "image":
+        render_image(source, target, print_options, dpi)
+    elif family == "docx":
+        render_docx(source, target, print_options, soffice, timeout)
+    else:
+        raise ValueError(f"No converter for {content_type}")
+
+
+# --- Event loop side ---
+
+class ConversionService:
+    """Turns uploaded DOCX and image files into print-ready PDFs in the background.
+
+    Conversion is CPU-bound (and LibreOffice is a subprocess anyway), so it
+    runs in a small process pool off the event loop. The rendered PDF is
+    stored next to the original under a key derived from the options that
+    shape it, so identical uploads with identical options share one render,
+    and the job is marked ready once it is there. Until then (or if
+    conversion fails) the print counter gets the original file.
+    """
+
+    def __init__(self, storage, workers: int = settings.CONVERSION_WORKERS):
+        self.storage = storage
+        self.workers = workers
+        self.soffice = shutil.which(settings.SOFFICE_PATH)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.converted = 0
+        self.reused = 0
+        self.failed = 0
+        self.last_seconds = 0.0
+
+    def supports(self, content_type: str) -> bool:
+        """Whether uploads of this type get a print-ready rendering"""
+        if not settings.CONVERSION_ENABLED or content_type not in UPLOAD_TYPES:
+            return False
+        family, _ = UPLOAD_TYPES[content_type]
+        return (family == "image" and Image is not None) or (family == "docx" and self.soffice is not None)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Started on first use; "spawn" keeps the workers from inheriting the
+        # event loop, sockets and database threads of this process
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        # A conversion that timed out keeps its worker busy (or stuck) until
+        # it finishes, so the pool is torn down and the next call starts a
+        # fresh one; conversions running next to it fail and fall back to
+        # the original file
+        if self._pool is pool:
+            self._pool = None
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, job: PrintJob) -> None:
+        """Queue a stored job for conversion"""
+        task = asyncio.create_task(self._convert(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _convert(self, job: PrintJob) -> None:
+        started = time.perf_counter()
+        print_path = rendered_blob_name(job.file_path, job.print_options)
+        try:
+            stored = await self._find_rendered(print_path)
+            if stored:
+                print_path = stored
+                self.reused += 1
+            else:
+                print_path = await self._render(job, print_path)
+                self.converted += 1
+                self.last_seconds = time.perf_counter() - started
+                logger.info("Converted %s in %.2fs", job.filename, self.last_seconds,
+                            extra={"otp": job.otp, "duration_ms": round(self.last_seconds * 1000, 1)})
+
+            if not await self.storage.update(job.otp, {"print_file_path": print_path, "print_status": "ready"}):
+                # The job went away while we were converting
+                await self.storage.release_blobs([print_path])
+
+        except Exception as error:
+            self.failed += 1
+            logger.warning("Conversion failed: %r", error, extra={"otp": job.otp})
+            await self.storage.update(job.otp, {"print_status": "failed"})
+
+    async def _find_rendered(self, print_path: str) -> Optional[str]:
+        """Stored path of an existing rendering (large ones are kept as multipart manifests)"""
+        large = self.storage.blobs.stored_name(print_path, settings.MULTIPART_THRESHOLD)
+        for candidate in dict.fromkeys((print_path, large)):
+            if await self.storage.blobs.exists(candidate):
+                return candidate
+        return None
+
+    async def _render(self, job: PrintJob, print_path: str) -> str:
+        with tempfile.TemporaryDirectory() as workdir:
+            _, extension = os.path.splitext(job.filename)
+            source = os.path.join(workdir, f"source{extension.lower()}")
+            target = os.path.join(workdir, "print.pdf")
+
+            await self.storage.download_to_file(job.file_path, source)
+
+            loop = asyncio.get_running_loop()
+            pool = self._executor()
+            try:
+                await asyncio.wait_for(
+                    loop.run_in_executor(
+                        pool, convert_file, source, target, job.file_type, job.print_options,
+                        settings.CONVERSION_DPI, self.soffice, settings.CONVERSION_TIMEOUT,
+                    ),
+                    timeout=settings.CONVERSION_TIMEOUT,
+                )
+            except asyncio.TimeoutError:
+                self._recycle(pool)
+                raise
+
+            print_path = self.storage.blobs.stored_name(print_path, os.path.getsize(target))
+            with open(target, "rb") as f:
+                try:
+                    return await self.storage.blobs.upload(f, print_path, PDF_CONTENT_TYPE)
+                except BlobExistsError:
+                    return print_path  # rendered concurrently for an identical job
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.CONVERSION_ENABLED,
+            "workers": self.workers,
+            "in_progress": len(self._tasks),
+            "converted": self.converted,
+            "reused": self.reused,
+            "failed": self.failed,
+            "last_seconds": round(self.last_seconds, 3),
+            "images": Image is not None,
+            "docx": self.soffice is not None,
+        }
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,56 @@
+from datetime import datetime
+from typing import Any, Dict, Optional
+from models import PrintJob
+
+
+class JobCounters:
+    """Job counts kept up to date incrementally by the storage layer.
+
+    Each write adjusts the counts in place so hot paths never need a table
+    count; `reconcile` periodically resets them from the database to absorb
+    drift (writes from other workers, manual cleanup, jobs that expired).
+    """
+
+    def __init__(self):
+        self.total = 0
+        self.pending = 0
+        self.completed = 0
+        self.expired = 0  # rows past expires_at that have not been removed yet
+        self.reconciled_at: Optional[str] = None
+
+    def _adjust(self, status: Optional[str], delta: int) -> None:
+        if status == "pending":
+            self.pending = max(self.pending + delta, 0)
+        elif status == "completed":
+            self.completed = max(self.completed + delta, 0)
+
+    def job_added(self, job: PrintJob) -> None:
+        self.total += 1
+        self._adjust(job.status, 1)
+
+    def job_removed(self, job: PrintJob, expired: bool = False) -> None:
+        self.total = max(self.total - 1, 0)
+        self._adjust(job.status, -1)
+        if expired:
+            self.expired = max(self.expired - 1, 0)
+
+    def status_changed(self, old_status: str, new_status: str) -> None:
+        if old_status != new_status:
+            self._adjust(old_status, -1)
+            self._adjust(new_status, 1)
+
+    def reconcile(self, total: int, pending: int, completed: int, expired: int) -> None:
+        self.total = total
+        self.pending = pending
+        self.completed = completed
+        self.expired = expired
+        self.reconciled_at = datetime.now().isoformat()
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "total": self.total,
+            "pending": self.pending,
+            "completed": self.completed,
+            "expired": self.expired,
+            "reconciled_at": self.reconciled_at,
+        }
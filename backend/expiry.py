@@ -0,0 +1,198 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def expiry_timestamp(expires_at: str) -> float:
+    """POSIX timestamp of a job's expires_at, read as local time like the API does"""
+    return datetime.fromisoformat(expires_at.replace('Z', '+00:00')).replace(tzinfo=None).timestamp()
+
+
+class ExpiryScheduler:
+    """Background engine that removes jobs and their blobs as they expire.
+
+    Upcoming expirations sit in a min-heap keyed by expires_at. The run loop
+    sleeps until the earliest one is due (or until an earlier job is
+    scheduled), then deletes everything due in batches, with a bounded number
+    of batches in flight. Jobs written by other workers or tools are picked
+    up by a periodic rescan of the database.
+
+    `_deadlines` holds the live entry of each job, so a job scheduled twice
+    (upload + rescan) is queued once and a job deleted early is dropped
+    from the schedule; heap entries it no longer matches are skipped when
+    they surface, and the heap is rebuilt once they outnumber the live ones.
+    """
+
+    def __init__(self, storage, batch_size: int = settings.EXPIRY_BATCH_SIZE,
+                 concurrency: int = settings.EXPIRY_CONCURRENCY):
+        self.storage = storage
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self._heap: List[Tuple[float, str]] = []
+        self._deadlines: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._last_rescan = 0.0
+
+        # Metrics
+        self.sweeps = 0
+        self.expired_total = 0
+        self.failed_batches = 0
+        self.last_sweep_seconds = 0.0
+        self.last_sweep_at: Optional[str] = None
+
+    def schedule(self, otp: str, expires_at: str) -> None:
+        """Track a job so it is removed once it expires"""
+        try:
+            deadline = expiry_timestamp(expires_at)
+        except ValueError:
+            logger.warning("Cannot schedule expiry: bad expires_at %r", expires_at, extra={"otp": otp})
+            return
+
+        if self._deadlines.get(otp) == deadline:
+            return
+        next_deadline = self._next_deadline()
+        self._push(otp, deadline)
+        if next_deadline is None or deadline < next_deadline:
+            self._wakeup.set()
+
+    def unschedule(self, otp: str) -> None:
+        """Stop tracking a job that was removed before it expired"""
+        if self._deadlines.pop(otp, None) is not None:
+            self._compact()
+
+    def _push(self, otp: str, deadline: float) -> None:
+        self._deadlines[otp] = deadline
+        heapq.heappush(self._heap, (deadline, otp))
+        self._compact()
+
+    def _is_live(self, entry: Tuple[float, str]) -> bool:
+        deadline, otp = entry
+        return self._deadlines.get(otp) == deadline
+
+    def _compact(self) -> None:
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._heap = [(deadline, otp) for otp, deadline in self._deadlines.items()]
+            heapq.heapify(self._heap)
+
+    def _next_deadline(self) -> Optional[float]:
+        """The earliest live deadline, dropping stale entries off the top"""
+        while self._heap and not self._is_live(self._heap[0]):
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    async def load(self, before: Optional[str] = None) -> int:
+        """Schedule jobs from the database, page by page in expiry order"""
+        loaded = 0
+        after = None
+        while True:
+            rows = await self.storage.jobs.list_by_expiry(before=before, after=after, limit=settings.EXPIRY_PAGE_SIZE)
+            for row in rows:
+                self.schedule(row["otp"], row["expires_at"])
+            loaded += len(rows)
+            if len(rows) < settings.EXPIRY_PAGE_SIZE:
+                break
+            after = (rows[-1]["expires_at"], rows[-1]["otp"])
+        self._last_rescan = time.monotonic()
+        return loaded
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def _pop_due(self, now: float) -> List[str]:
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            entry = heapq.heappop(self._heap)
+            if self._is_live(entry):
+                del self._deadlines[entry[1]]
+                due.append(entry[1])
+        return due
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                if time.monotonic() - self._last_rescan >= settings.EXPIRY_RESCAN_INTERVAL:
+                    await self.load(before=datetime.now().isoformat())
+
+                now = time.time()
+                next_deadline = self._next_deadline()
+                if next_deadline is not None and next_deadline <= now:
+                    await self.sweep()
+                    continue
+
+                # Sleep until the next job is due, a new earliest job arrives,
+                # or the next rescan
+                delay = settings.EXPIRY_RESCAN_INTERVAL
+                if next_deadline is not None:
+                    delay = min(delay, next_deadline - now)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=max(delay, 0))
+                except asyncio.TimeoutError:
+                    pass
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as error:
+                logger.exception("Expiry scheduler error")
+                await asyncio.sleep(settings.EXPIRY_RETRY_DELAY)
+
+    async def sweep(self) -> int:
+        """Delete every job that is due now; returns the number removed"""
+        started = time.perf_counter()
+        due = self._pop_due(time.time())
+        batches = [due[i:i + self.batch_size] for i in range(0, len(due), self.batch_size)]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def expire(batch: List[str]) -> int:
+            async with semaphore:
+                return await self.storage.expire_jobs(batch)
+
+        results = await asyncio.gather(*(expire(batch) for batch in batches), return_exceptions=True)
+
+        removed = 0
+        retry_at = time.time() + settings.EXPIRY_RETRY_DELAY
+        for batch, result in zip(batches, results):
+            if isinstance(result, BaseException):
+                logger.warning("Expiry batch of %d failed, retrying later: %s", len(batch), result)
+                self.failed_batches += 1
+                for otp in batch:
+                    self._push(otp, retry_at)
+            else:
+                removed += result
+
+        self.sweeps += 1
+        self.expired_total += removed
+        self.last_sweep_seconds = time.perf_counter() - started
+        self.last_sweep_at = datetime.now().isoformat()
+        if removed:
+            logger.info("Expired %d print job(s) in %.3fs", removed, self.last_sweep_seconds)
+        return removed
+
+    def stats(self) -> Dict[str, Any]:
+        # Cheap enough for every /health and scrape: no pass over the heap
+        next_deadline = self._next_deadline()
+        return {
+            "scheduled": len(self._deadlines),
+            "next_due_in": round(next_deadline - time.time(), 1) if next_deadline is not None else None,
+            "sweeps": self.sweeps,
+            "expired_total": self.expired_total,
+            "failed_batches": self.failed_batches,
+            "last_sweep_seconds": round(self.last_sweep_seconds, 4),
+            "last_sweep_at": self.last_sweep_at,
+        }
@@ -0,0 +1,76 @@
+# Production server: gunicorn -c gunicorn.conf.py main:app
+
+import os
+import shutil
+import secrets
+from config import settings
+
+
+def available_cores() -> int:
+    # Honour CPU affinity (containers, taskset) where the platform reports it
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+bind = f"{settings.HOST}:{settings.PORT}"
+workers = settings.WEB_CONCURRENCY or available_cores()
+worker_class = "server.XeroQWorker"
+
+# Each worker imports the app, and so builds its own storage clients, HTTP
+# pools, SQLite connections and logging thread, after it has been forked
+preload_app = False
+
+# Workers are recycled on memory use (WORKER_MAX_MEMORY), not request count
+max_requests = 0
+
+# gunicorn waits this long for workers to drain before killing them; uvicorn
+# gets the same window for in-flight requests
+graceful_timeout = settings.GRACEFUL_TIMEOUT + 10
+# Heartbeat: a worker silent for this long is restarted. Workers keep
+# beating while they drain (server.XeroQWorker), so this can stay well below
+# graceful_timeout and still only catch workers whose event loop is stuck
+timeout = 60
+keepalive = settings.KEEPALIVE_TIMEOUT
+
+limit_request_line = 8190
+limit_request_fields = 100
+limit_request_field_size = 8190
+
+# The app writes its own access records (logs.RequestIdMiddleware)
+accesslog = None
+
+# Workers are forked from this process after `config` was imported above,
+# so they see what is set on `settings` here rather than in os.environ. The
+# environment is updated too, for processes re-executed on a binary upgrade.
+settings.WEB_CONCURRENCY = workers
+os.environ["WEB_CONCURRENCY"] = str(workers)
+
+# Signed direct upload URLs must verify in whichever worker receives the
+# upload, so every worker needs the same key
+if workers > 1 and not settings.UPLOAD_SIGNING_SECRET:
+    settings.UPLOAD_SIGNING_SECRET = secrets.token_urlsafe(32)
+    os.environ["UPLOAD_SIGNING_SECRET"] = settings.UPLOAD_SIGNING_SECRET
+
+
+# Workers write their metrics to a shared directory that a scrape of any
+# one of them adds up (prometheus_client's multiprocess mode). It reads the
+# variable when it is first imported, so this must run before the workers
+# import the app.
+if workers > 1 and settings.METRICS_ENABLED:
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", settings.METRICS_MULTIPROC_DIR)
+
+
+# Start every run from an empty directory, and drop the live gauges of
+# workers that exit (their counters and histograms keep counting)
+def on_starting(server):
+    directory = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+
+
+def child_exit(server, worker):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
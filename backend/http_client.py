@@ -0,0 +1,35 @@
+import os
+import httpx
+from typing import Dict, Tuple
+from config import settings
+
+
+def http_limits() -> httpx.Limits:
+    """Connection pool limits shared by the database and storage clients"""
+    return httpx.Limits(
+        max_connections=settings.STORAGE_POOL_SIZE,
+        max_keepalive_connections=settings.STORAGE_POOL_KEEPALIVE,
+        keepalive_expiry=settings.STORAGE_KEEPALIVE_EXPIRY,
+    )
+
+
+def http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        settings.STORAGE_TIMEOUT,
+        connect=settings.STORAGE_CONNECT_TIMEOUT,
+        pool=settings.STORAGE_POOL_TIMEOUT,
+    )
+
+
+def supabase_credentials() -> Tuple[str, Dict[str, str]]:
+    """Return the Supabase base URL and service-role auth headers"""
+    supabase_url = os.getenv("NEXT_PUBLIC_SUPABASE_URL")
+    supabase_service_key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
+
+    if not supabase_url or not supabase_service_key:
+        raise ValueError("Missing Supabase environment variables")
+
+    return supabase_url.rstrip("/"), {
+        "apikey": supabase_service_key,
+        "Authorization": f"Bearer {supabase_service_key}",
+    }
@@ -0,0 +1,145 @@
+import sys
+import json
+import time
+import uuid
+import atexit
+import logging
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from typing import Optional
+from config import settings
+
+# ID of the request being handled, carried into every record logged on its
+# behalf (and into background tasks it starts, which copy the context)
+request_id: ContextVar[str] = ContextVar("request_id", default="-")
+
+# LogRecord attributes that are not caller-supplied `extra` fields
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "request_id"}
+
+_listener: Optional[QueueListener] = None
+
+
+def _extra_fields(record: logging.LogRecord) -> dict:
+    return {key: value for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, request ID and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+            **_extra_fields(record),
+        }
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines for local development, extra fields as key=value"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = (f"{datetime.fromtimestamp(record.created).strftime('%H:%M:%S.%f')[:-3]} "
+                f"{record.levelname:<7} [{getattr(record, 'request_id', '-')}] {record.name}: {record.getMessage()}")
+        fields = _extra_fields(record)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class ContextQueueHandler(QueueHandler):
+    """Queue handler that stamps the request ID and renders tracebacks before enqueueing.
+
+    Only in-memory work happens on the caller's thread (usually the event
+    loop); formatting to text and the stdout write happen on the listener's
+    thread.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.request_id = request_id.get()
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(level: str = settings.LOG_LEVEL, fmt: str = settings.LOG_FORMAT) -> None:
+    """Route all logging through a queue drained by a background thread (idempotent)"""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter() if fmt == "json" else TextFormatter())
+
+    queue: SimpleQueue = SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level.upper())
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(ContextQueueHandler(queue))
+
+    # httpx logs every storage request at INFO; those are only worth seeing when debugging
+    logging.getLogger("httpx").setLevel(max(root.level, logging.WARNING))
+
+    # Per-chunk upload tracing is far too chatty for anything but debugging
+    logging.getLogger("upload_stream.chunks").setLevel(logging.DEBUG if settings.LOG_CHUNK_TRACE else logging.WARNING)
+
+    _listener = QueueListener(queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+class RequestIdMiddleware:
+    """Give every request an ID (the caller's X-Request-ID if sane), log its outcome and echo the ID back"""
+
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("access")
+
+    @staticmethod
+    def _incoming(scope) -> Optional[str]:
+        for name, value in scope.get("headers", []):
+            if name == b"x-request-id":
+                candidate = value.decode("latin-1")
+                if 0 < len(candidate) <= 64 and all(c.isalnum() or c in "-_." for c in candidate):
+                    return candidate
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current = self._incoming(scope) or uuid.uuid4().hex[:16]
+        token = request_id.set(current)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_id(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-request-id", current.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            self.logger.info(
+                "%s %s %s", scope["method"], scope["path"], status,
+                extra={"status": status, "duration_ms": round((time.perf_counter() - started) * 1000, 1)},
+            )
+            request_id.reset(token)
@@ -1,20 +1,98 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Depends, Request
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
+from starlette.datastructures import UploadFile as StarletteUploadFile
+from starlette.formparsers import MultiPartException
+from starlette.requests import ClientDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-import uvicorn
 import os
 import json
-import random
-import string
 from datetime import datetime, timedelta
-from typing import Optional
-import io
-from storage import SupabaseStorage
-from models import PrintJob, PrintOptions
+from typing import Optional, Tuple
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from tempfile import SpooledTemporaryFile
+from storage import SupabaseStorage, job_blob_paths
+from admission import AdmissionControl, AdmissionMiddleware
+from metadata_store import DuplicateOTPError
+from upload_stream import SNIFF_BYTES, UPLOAD_TYPES, UploadRejected, format_size, matches_signature, receive_upload
+from blob_store import BlobExistsError
+from signing import sign_token, verify_token
+from resumable import TUS_VERSION, ResumableUploads, parse_upload_metadata
+from logs import RequestIdMiddleware, setup_logging
+import metrics
+from config import settings
+from models import PrintJob
 from dotenv import load_dotenv
 
 load_dotenv()
+setup_logging()
+
+logger = logging.getLogger(__name__)
+
+# Created by the lifespan, once per worker process: importing this module
+# stays cheap, and nothing is connected before gunicorn forks
+storage: Optional[SupabaseStorage] = None
+
+async def reconcile_counters_periodically():
+    """Keep the incremental job counters in line with the database"""
+    while True:
+        await asyncio.sleep(settings.COUNTER_RECONCILE_INTERVAL)
+        await storage.reconcile_counters()
+
+async def purge_stale_uploads_periodically():
+    """Drop resumable uploads that were abandoned or finalized long ago"""
+    while True:
+        await asyncio.sleep(settings.RESUMABLE_UPLOAD_PURGE_INTERVAL)
+        try:
+            removed = await asyncio.to_thread(resumable_uploads.purge_stale)
+            if removed:
+                logger.info("Purged %d stale resumable upload(s)", removed)
+        except Exception as error:
+            logger.warning("Could not purge stale resumable uploads: %s", error)
+
+async def collect_state_metrics_periodically():
+    """Keep this worker's state gauges fresh for scrapes that another worker answers"""
+    while True:
+        await asyncio.sleep(settings.METRICS_SYNC_INTERVAL)
+        collect_state_metrics()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build storage and warm its connection pools, seed the job counters and
+    expiry schedule and keep them running; undo it all on shutdown"""
+    global storage
+    storage = SupabaseStorage()
+    await storage.warm_up()
+    await storage.reconcile_counters()
+    counter_task = asyncio.create_task(reconcile_counters_periodically())
+    purge_task = asyncio.create_task(purge_stale_uploads_periodically())
+    metrics_task = asyncio.create_task(collect_state_metrics_periodically()) if metrics.multiprocess_dir() else None
+    
+    try:
+        loaded = await storage.load_active_jobs()
+        logger.info("Loaded %d active job(s) into the OTP allocator and expiry schedule", loaded)
+    except Exception as error:
+        logger.warning("Could not load active jobs, relying on rescans: %s", error)
+    
+    if settings.EXPIRY_SCHEDULER_ENABLED:
+        storage.expiry.start()
+    
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        # Stop background work and release pooled storage connections
+        app.state.ready = False
+        counter_task.cancel()
+        purge_task.cancel()
+        if metrics_task:
+            metrics_task.cancel()
+        await storage.expiry.stop()
+        await storage.conversions.aclose()
+        await storage.previews.aclose()
+        await storage.aclose()
 
 # Initialize FastAPI app with increased limits
 app = FastAPI(
@@ -22,9 +100,15 @@ app = FastAPI(
     version="1.0.0",
     # Increase request size limits for file uploads
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    lifespan=lifespan
 )
 
+# Keep uploads and print counter requests in separate admission pools (added
+# before CORS so that 503 responses still carry CORS headers)
+admission = AdmissionControl()
+app.add_middleware(AdmissionMiddleware, control=admission)
+
 # Add CORS middleware to allow frontend requests
 app.add_middleware(
     CORSMiddleware,
@@ -32,84 +116,109 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Resumable uploads report progress in these headers
+    expose_headers=["Location", "Upload-Offset", "Upload-Length", "Tus-Resumable", "X-Page-Count", "X-Request-ID"],
 )
 
-# Initialize storage
-storage = SupabaseStorage()
+# Latency, bytes and error classes per route, exposed on /metrics
+if settings.METRICS_ENABLED:
+    app.add_middleware(metrics.MetricsMiddleware)
+
+# Outermost, so every request (rejected ones included) gets an ID and an access log record
+app.add_middleware(RequestIdMiddleware)
+
+resumable_uploads = ResumableUploads()
 
 def generate_otp() -> str:
-    """Generate a 6-character OTP"""
-    chars = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
-    return ''.join(random.choice(chars) for _ in range(6))
+    """Allocate a 6-character OTP that no active job is using"""
+    return storage.otps.allocate()
+
+async def store_print_job(otp: str, filename: str, file_path: str, file_type: str,
+                          print_options: dict) -> str:
+    """Create the print_jobs row for a stored file; returns the OTP it was stored under"""
+    print_job = PrintJob(
+        otp=otp,
+        filename=filename,
+        file_path=file_path,
+        file_type=file_type,
+        print_options=print_options,
+        upload_time=datetime.now().isoformat(),
+        status="pending",
+        expires_at=(datetime.now() + timedelta(hours=24)).isoformat()
+    )
+    converting = storage.conversions.supports(file_type)
+    if converting:
+        print_job.print_status = "queued"
+    
+    # If another worker issued the same OTP in the meantime, the insert is
+    # rejected and we take a fresh code. The caller releases the code it
+    # passed in if this fails; codes drawn here are released here
+    for attempt in range(settings.OTP_INSERT_ATTEMPTS):
+        try:
+            await storage.set(print_job.otp, print_job)
+            break
+        except DuplicateOTPError:
+            # The code belongs to the other worker's job, not to this process
+            storage.otps.release(print_job.otp)
+            if attempt == settings.OTP_INSERT_ATTEMPTS - 1:
+                raise
+            print_job.otp = generate_otp()
+        except Exception:
+            if print_job.otp != otp:
+                storage.otps.release(print_job.otp)
+            raise
+    
+    # DOCX and images are rendered to a print-ready PDF, and every job gets
+    # a preview for the print counter, in the background
+    if converting:
+        storage.conversions.submit(print_job)
+    storage.previews.submit(print_job)
+    return print_job.otp
+
+def served_file(print_job: PrintJob, original: bool = False) -> Tuple[str, str, str]:
+    """Blob path, download filename and media type the print counter gets for a job"""
+    if print_job.print_status == "ready" and print_job.print_file_path and not original:
+        return print_job.print_file_path, f"{os.path.splitext(print_job.filename)[0]}.pdf", "application/pdf"
+    return print_job.file_path, print_job.filename, print_job.file_type
 
 @app.get("/")
 async def root():
     return {"message": "XeroQ Python Backend is running!"}
 
 @app.post("/api/upload")
-async def upload_file(
-    request: Request,
-    file: UploadFile = File(...),
-    printOptions: str = Form(...)
-):
-    """Upload file and create print job - matches Next.js /api/upload"""
+async def upload_file(request: Request):
+    """Upload file and create print job - matches Next.js /api/upload
+    
+    The multipart body is parsed here rather than by FastAPI so the file can
+    be checked while it streams in: type from its part headers, magic bytes
+    from the first chunk and the per-type size limit on every chunk.
+    """
+    form = None
     try:
-        print("=== UPLOAD REQUEST START ===")
+        logger.debug("Upload started", extra={"content_length": request.headers.get("content-length")})
+        
+        try:
+            form, digest = await receive_upload(request)
+        except UploadRejected as rejected:
+            logger.info("Upload rejected while streaming: %s", rejected.detail)
+            raise HTTPException(status_code=rejected.status_code, detail=rejected.detail)
+        except MultiPartException as error:
+            raise HTTPException(status_code=400, detail=error.message)
         
         # Validate file
-        if not file:
+        file = form.get("file")
+        if not isinstance(file, StarletteUploadFile):
             raise HTTPException(status_code=400, detail="No file provided")
         
-        # Get actual file size by reading content length from request
-        content_length = request.headers.get('content-length')
-        if content_length:
-            actual_size = int(content_length)
-            print(f"Content-Length header: {actual_size} bytes")
-        else:
-            actual_size = file.size if file.size else 0
-        
-        print(f"File details: name={file.filename}, type={file.content_type}, reported_size={file.size}, actual_size={actual_size}")
-        
-        # Validate file type
-        allowed_types = [
-            "application/pdf",
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "image/jpeg",
-            "image/jpg", 
-            "image/png",
-            "image/gif",
-            "image/bmp",
-            "image/tiff",
-            "image/webp"
-        ]
-        
-        if file.content_type not in allowed_types:
-            raise HTTPException(
-                status_code=400, 
-                detail="Invalid file type. Please upload PDF, DOCX, or image files."
-            )
-        
-        # Validate file size - use actual size from content-length or file.size
-        file_size_to_check = actual_size if actual_size > 0 else (file.size if file.size else 0)
+        printOptions = form.get("printOptions")
+        if not isinstance(printOptions, str):
+            raise HTTPException(status_code=400, detail="Missing print options")
         
-        # Updated file size limits: 50MB for PDFs, 15MB for images, 10MB for DOCX
-        if file.content_type == "application/pdf":
-            max_size = 50 * 1024 * 1024  # 50MB for PDFs
-            max_size_mb = '50MB'
-        elif file.content_type.startswith('image/'):
-            max_size = 15 * 1024 * 1024  # 15MB for images
-            max_size_mb = '15MB'
-        else:  # DOCX and other documents
-            max_size = 10 * 1024 * 1024  # 10MB for DOCX
-            max_size_mb = '10MB'
-        
-        print(f"File size check: {file_size_to_check} bytes, max allowed: {max_size} bytes ({max_size_mb})")
-        
-        if file_size_to_check > max_size:
-            raise HTTPException(
-                status_code=400,
-                detail=f"File too large ({file_size_to_check} bytes). Maximum size is {max_size_mb} ({max_size} bytes)."
-            )
+        # The parser already enforced the size limit and left the file spooled
+        # at position 0: in memory up to the spool size the memory budget
+        # granted this upload (UPLOAD_SPOOL_MEMORY at most), on disk beyond it
+        file_size = file.size
+        logger.debug("Upload received", extra={"file_name": file.filename, "content_type": file.content_type, "size": file_size})
         
         # Parse print options
         try:
@@ -117,78 +226,33 @@ async def upload_file(
         except json.JSONDecodeError:
             raise HTTPException(status_code=400, detail="Invalid print options format")
         
-        # Generate OTP and unique filename
+        # Generate OTP only once the upload is known to be valid
         otp = generate_otp()
-        timestamp = int(datetime.now().timestamp() * 1000)
-        file_extension = file.filename.split('.')[-1] if '.' in file.filename else 'bin'
-        unique_filename = f"{otp}_{timestamp}.{file_extension}"
-        
-        print(f"Attempting to upload file: {unique_filename}")
-        
-        # Read file content in chunks to handle large files
-        print("Reading file content...")
-        file_content = b""
-        chunk_size = 1024 * 1024  # 1MB chunks
-        bytes_read = 0
         
+        # Store the file under its content hash, so identical uploads (the
+        # same lab manual from a whole class) share a single blob
         try:
-            # Reset file pointer to beginning
-            await file.seek(0)
+            logger.debug("Storing %d bytes with SHA-256 %s", file_size, digest)
+            file_path, uploaded = await storage.store_content(file.file, digest, file.content_type)
             
-            while True:
-                chunk = await file.read(chunk_size)
-                if not chunk:
-                    break
-                file_content += chunk
-                bytes_read += len(chunk)
-                print(f"Read {bytes_read} bytes so far...")
+            otp = await store_print_job(otp, file.filename, file_path, file.content_type, print_options)
             
-            print(f"Finished reading file: {len(file_content)} bytes total")
-            
-        except Exception as read_error:
-            print(f"Error reading file: {read_error}")
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error reading file: {str(read_error)}"
-            )
-        
-        # Verify file content size matches expected size
-        if file_size_to_check > 0 and len(file_content) != file_size_to_check:
-            print(f"Warning: File size mismatch. Expected: {file_size_to_check}, Got: {len(file_content)}")
-        
-        # Upload file to Supabase Storage
-        try:
-            print(f"Uploading {len(file_content)} bytes to Supabase...")
-            file_path = await storage.upload_file(file_content, unique_filename, file.content_type)
-            print(f"File uploaded successfully to: {file_path}")
-            
-            # Create print job
-            print_job = PrintJob(
-                otp=otp,
-                filename=file.filename,
-                file_path=file_path,
-                file_type=file.content_type,
-                print_options=print_options,
-                upload_time=datetime.now().isoformat(),
-                status="pending",
-                expires_at=(datetime.now() + timedelta(hours=24)).isoformat()
-            )
-            
-            # Store in database
-            await storage.set(otp, print_job)
+            if not uploaded:
+                await storage.ensure_blob(file_path, file.file, file.content_type)
             
             total_jobs = await storage.size()
-            print(f"Stored print job with OTP: {otp}, Total jobs: {total_jobs}")
+            logger.info("Stored print job", extra={"otp": otp, "total_jobs": total_jobs, "size": file_size})
             
             return {
                 "success": True,
                 "otp": otp,
                 "message": "File uploaded successfully",
-                "file_size": len(file_content)
+                "file_size": file_size
             }
             
         except Exception as upload_error:
-            print(f"File upload failed: {upload_error}")
+            logger.exception("File upload failed", extra={"otp": otp})
+            storage.otps.release(otp)
             raise HTTPException(
                 status_code=500,
                 detail=f"File upload failed: {str(upload_error)}"
@@ -197,18 +261,299 @@ async def upload_file(
     except HTTPException:
         raise
     except Exception as error:
-        print(f"Upload error: {error}")
+        logger.exception("Upload error")
         raise HTTPException(
             status_code=500,
             detail=f"Upload failed: {str(error)}"
         )
+    finally:
+        # Release the spooled upload (FastAPI only does this for forms it parsed)
+        if form is not None:
+            await form.close()
+
+@app.post("/api/upload/init")
+async def init_direct_upload(request_data: dict):
+    """Start a direct-to-storage upload: reserve an OTP and sign an upload URL
+    
+    The client sends the file straight to storage with the returned URL,
+    method and headers, then calls /api/upload/finalize with the
+    finalizeToken, so file bytes never pass through this process.
+    """
+    try:
+        filename = request_data.get("filename")
+        content_type = request_data.get("contentType")
+        print_options = request_data.get("printOptions")
+        
+        if not filename:
+            raise HTTPException(status_code=400, detail="Filename required")
+        if content_type not in UPLOAD_TYPES:
+            raise HTTPException(
+                status_code=400,
+                detail="Invalid file type. Please upload PDF, DOCX, or image files."
+            )
+        if not isinstance(print_options, dict):
+            raise HTTPException(status_code=400, detail="Invalid print options format")
+        
+        _, max_size = UPLOAD_TYPES[content_type]
+        try:
+            file_size = int(request_data.get("size") or 0)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid file size")
+        if file_size > max_size:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File too large ({file_size} bytes). Maximum size is {format_size(max_size)} ({max_size} bytes)."
+            )
+        
+        otp = storage.otps.reserve(settings.UPLOAD_URL_TTL)
+        timestamp = int(datetime.now().timestamp() * 1000)
+        file_extension = filename.split('.')[-1] if '.' in filename else 'bin'
+        file_path = f"uploads/{otp}_{timestamp}.{file_extension}"
+        
+        try:
+            upload = await storage.blobs.create_upload_url(file_path, content_type, max_size)
+        except Exception:
+            storage.otps.release(otp)
+            raise
+        
+        finalize_token = sign_token({
+            "kind": "finalize",
+            "otp": otp,
+            "path": file_path,
+            "filename": filename,
+            "type": content_type,
+            "options": print_options,
+        }, settings.UPLOAD_URL_TTL)
+        
+        logger.info("Issued direct upload to %s", file_path, extra={"otp": otp})
+        return {
+            "otp": otp,
+            "upload": upload,
+            "finalizeToken": finalize_token,
+            "expiresIn": settings.UPLOAD_URL_TTL
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as error:
+        logger.exception("Upload init error")
+        raise HTTPException(status_code=500, detail=f"Upload init failed: {str(error)}")
+
+@app.put(settings.LOCAL_UPLOAD_PATH)
+async def receive_direct_upload(token: str, request: Request):
+    """Local stand-in for a storage signed upload URL (BLOB_BACKEND=local)"""
+    if settings.BLOB_BACKEND != "local":
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    try:
+        grant = verify_token(token)
+    except ValueError as error:
+        raise HTTPException(status_code=403, detail=str(error))
+    if grant.get("kind") != "blob_upload":
+        raise HTTPException(status_code=403, detail="Invalid token")
+    
+    spool_memory = getattr(request.state, "upload_spool_memory", settings.UPLOAD_SPOOL_MEMORY)
+    spooled = StarletteUploadFile(SpooledTemporaryFile(max_size=max(spool_memory, 1)), size=0)
+    try:
+        async for chunk in request.stream():
+            if spooled.size + len(chunk) > grant["max"]:
+                raise HTTPException(status_code=413, detail="File too large")
+            await spooled.write(chunk)
+        
+        await storage.upload_file(spooled.file, grant["name"], grant["type"])
+        return {"Key": grant["name"]}
+        
+    except BlobExistsError:
+        raise HTTPException(status_code=409, detail="File already uploaded")
+    finally:
+        await spooled.close()
+
+@app.post("/api/upload/finalize")
+async def finalize_direct_upload(request_data: dict):
+    """Verify a directly uploaded file and create its print job"""
+    try:
+        try:
+            grant = verify_token(request_data.get("finalizeToken") or "")
+        except ValueError as error:
+            raise HTTPException(status_code=403, detail=str(error))
+        if grant.get("kind") != "finalize":
+            raise HTTPException(status_code=403, detail="Invalid token")
+        
+        otp, file_path = grant["otp"], grant["path"]
+        
+        # Finalizing twice returns the job created the first time. It is
+        # found by its blob: if the granted OTP was taken in the meantime,
+        # store_print_job stored it under another one
+        existing_job = await storage.get_by_file_path(file_path)
+        if existing_job:
+            return {"success": True, "otp": existing_job.otp, "message": "File uploaded successfully"}
+        
+        blob = await storage.read_blob_head(file_path, SNIFF_BYTES)
+        if blob is None:
+            raise HTTPException(status_code=409, detail="File has not been uploaded yet")
+        
+        file_size, head = blob
+        family, max_size = UPLOAD_TYPES[grant["type"]]
+        problem = None
+        if file_size == 0:
+            problem = (400, "Uploaded file is empty")
+        elif file_size > max_size:
+            problem = (413, f"File too large ({file_size} bytes). Maximum size is {format_size(max_size)} ({max_size} bytes).")
+        elif not matches_signature(family, head):
+            problem = (400, f"File content does not match its type ({grant['type']}).")
+        if problem:
+            logger.info("Rejecting direct upload %s: %s", file_path, problem[1])
+            await storage.delete_file(file_path)
+            storage.otps.release(otp)
+            raise HTTPException(status_code=problem[0], detail=problem[1])
+        
+        otp = await store_print_job(otp, grant["filename"], file_path, grant["type"], grant["options"])
+        total_jobs = await storage.size()
+        logger.info("Stored print job", extra={"otp": otp, "total_jobs": total_jobs})
+        
+        return {
+            "success": True,
+            "otp": otp,
+            "message": "File uploaded successfully",
+            "file_size": file_size
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as error:
+        logger.exception("Upload finalize error")
+        raise HTTPException(status_code=500, detail=f"Upload finalize failed: {str(error)}")
+
+def tus_headers(**headers) -> dict:
+    """Response headers for the resumable upload endpoints"""
+    return {"Tus-Resumable": TUS_VERSION, "Cache-Control": "no-store",
+            **{name.replace("_", "-"): str(value) for name, value in headers.items()}}
+
+@app.post("/api/uploads")
+async def create_resumable_upload(request: Request):
+    """Start a resumable (tus-style) upload
+    
+    Headers: Upload-Length, and Upload-Metadata with base64 "filename",
+    "filetype" and "printOptions" (JSON). The client then PATCHes chunks to
+    the returned Location, can HEAD it to learn the offset to resume from
+    after a dropped connection, and calls .../finalize once every byte is in.
+    """
+    try:
+        try:
+            length = int(request.headers.get("upload-length", ""))
+            metadata = parse_upload_metadata(request.headers.get("upload-metadata", ""))
+            print_options = json.loads(metadata.get("printOptions") or "{}")
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Upload-Length or Upload-Metadata")
+        
+        upload_id = resumable_uploads.create(
+            length,
+            metadata.get("filename") or "upload",
+            metadata.get("filetype", ""),
+            print_options,
+        )
+        logger.info("Created resumable upload %s (%d bytes)", upload_id, length)
+        return Response(
+            status_code=201,
+            headers=tus_headers(Location=f"/api/uploads/{upload_id}", Upload_Offset=0),
+        )
+        
+    except UploadRejected as rejected:
+        raise HTTPException(status_code=rejected.status_code, detail=rejected.detail)
+
+@app.head("/api/uploads/{upload_id}")
+async def resumable_upload_offset(upload_id: str):
+    """Report how many bytes of a resumable upload have been received"""
+    upload = resumable_uploads.info(upload_id)
+    if upload is None:
+        return Response(status_code=404, headers=tus_headers())
+    return Response(headers=tus_headers(Upload_Offset=upload["offset"], Upload_Length=upload["length"]))
+
+@app.patch("/api/uploads/{upload_id}")
+async def append_resumable_upload(upload_id: str, request: Request):
+    """Append the request body to a resumable upload at Upload-Offset"""
+    if request.headers.get("content-type") != "application/offset+octet-stream":
+        raise HTTPException(status_code=415, detail="Expected application/offset+octet-stream")
+    try:
+        offset = int(request.headers.get("upload-offset", ""))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Upload-Offset header required")
+    
+    try:
+        new_offset = await resumable_uploads.append(upload_id, offset, request.stream())
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadRejected as rejected:
+        raise HTTPException(status_code=rejected.status_code, detail=rejected.detail)
+    except ClientDisconnect:
+        # Whatever arrived is kept; the client resumes from the next HEAD
+        logger.info("Resumable upload %s interrupted", upload_id)
+        return Response(status_code=400)
+    
+    return Response(status_code=204, headers=tus_headers(Upload_Offset=new_offset))
+
+@app.delete("/api/uploads/{upload_id}")
+async def cancel_resumable_upload(upload_id: str):
+    """Abandon a resumable upload and drop its staged bytes"""
+    if resumable_uploads.info(upload_id) is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    resumable_uploads.delete(upload_id)
+    return Response(status_code=204, headers=tus_headers())
+
+@app.post("/api/uploads/{upload_id}/finalize")
+async def finalize_resumable_upload(upload_id: str):
+    """Store a completed resumable upload and create its print job"""
+    try:
+        # Finalizing twice, even concurrently, returns the job created the
+        # first time: the OTP is recorded before the upload's lock is released
+        async with resumable_uploads.finalizing(upload_id) as upload:
+            if upload is None:
+                raise HTTPException(status_code=404, detail="Upload not found")
+            if upload.get("otp"):
+                return {"success": True, "otp": upload["otp"], "message": "File uploaded successfully"}
+            
+            try:
+                staged = resumable_uploads.open_completed(upload_id)
+            except UploadRejected as rejected:
+                raise HTTPException(status_code=rejected.status_code, detail=rejected.detail)
+            
+            otp = generate_otp()
+            try:
+                digest = await asyncio.to_thread(resumable_uploads.digest, staged)
+                file_path, uploaded = await storage.store_content(staged, digest, upload["content_type"])
+                otp = await store_print_job(otp, upload["filename"], file_path, upload["content_type"], upload["print_options"])
+                if not uploaded:
+                    await storage.ensure_blob(file_path, staged, upload["content_type"])
+            except Exception:
+                storage.otps.release(otp)
+                raise
+            finally:
+                staged.close()
+            
+            resumable_uploads.mark_finalized(upload_id, otp)
+        
+        total_jobs = await storage.size()
+        logger.info("Stored print job", extra={"otp": otp, "total_jobs": total_jobs})
+        
+        return {
+            "success": True,
+            "otp": otp,
+            "message": "File uploaded successfully",
+            "file_size": upload["length"]
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as error:
+        logger.exception("Resumable upload finalize error")
+        raise HTTPException(status_code=500, detail=f"Upload finalize failed: {str(error)}")
 
 @app.get("/api/admin/lookup")
 async def lookup_print_job(otp: str):
     """Lookup print job by OTP - matches Next.js /api/admin/lookup"""
     try:
         total_jobs = await storage.size()
-        print(f"Looking up OTP: {otp}, Total jobs in database: {total_jobs}")
+        logger.debug("Looking up print job", extra={"otp": otp, "total_jobs": total_jobs})
         
         if not otp:
             raise HTTPException(status_code=400, detail="OTP required")
@@ -216,18 +561,25 @@ async def lookup_print_job(otp: str):
         print_job = await storage.get(otp.upper())
         
         if not print_job:
-            print(f"Print job not found for OTP: {otp}")
+            logger.info("Print job not found", extra={"otp": otp})
             raise HTTPException(status_code=404, detail="Print job not found or expired")
         
         # Check if expired
         expires_at = datetime.fromisoformat(print_job.expires_at.replace('Z', '+00:00'))
         if datetime.now() > expires_at.replace(tzinfo=None):
-            print(f"Print job expired for OTP: {otp}")
-            await storage.delete(otp)
-            await storage.delete_file(print_job.file_path)
+            logger.info("Print job expired", extra={"otp": otp})
+            await storage.delete(otp.upper(), print_job)
+            await storage.release_blobs(job_blob_paths(print_job))
             raise HTTPException(status_code=404, detail="Print job expired")
         
-        print(f"Found print job for OTP: {otp}")
+        logger.debug("Found print job", extra={"otp": otp})
+        
+        # Page count from the preview cache (a miss starts rendering it)
+        preview = storage.previews.cached_info(print_job)
+        
+        # The download usually follows within seconds: start pulling the
+        # file into the local blob cache now
+        storage.blobs.prefetch(served_file(print_job)[0])
         
         # Return job details
         return {
@@ -236,18 +588,58 @@ async def lookup_print_job(otp: str):
             "printOptions": print_job.print_options,
             "uploadTime": print_job.upload_time,
             "status": print_job.status,
-            "fileUrl": f"/api/admin/download?otp={otp}"
+            "printStatus": print_job.print_status,
+            "fileUrl": f"/api/admin/download?otp={otp}",
+            "previewUrl": f"/api/admin/preview?otp={otp}" if storage.previews.supports(print_job) else None,
+            "pageCount": preview["pages"] if preview else None
         }
         
     except HTTPException:
         raise
     except Exception as error:
-        print(f"Lookup error: {error}")
+        logger.exception("Lookup error")
         raise HTTPException(status_code=500, detail="Lookup failed")
 
+@app.get("/api/admin/preview")
+async def preview_file(otp: str):
+    """First-page JPEG thumbnail of a job, with its page count in X-Page-Count"""
+    try:
+        if not otp:
+            raise HTTPException(status_code=400, detail="OTP required")
+        
+        print_job = await storage.get(otp.upper())
+        
+        if not print_job:
+            raise HTTPException(status_code=404, detail="File not found")
+        
+        # Check if expired
+        expires_at = datetime.fromisoformat(print_job.expires_at.replace('Z', '+00:00'))
+        if datetime.now() > expires_at.replace(tzinfo=None):
+            raise HTTPException(status_code=404, detail="File expired")
+        
+        preview = await storage.previews.get(print_job)
+        if not preview or preview[0] is None:
+            raise HTTPException(status_code=404, detail="Preview not available")
+        
+        image, info = preview
+        headers = {"Cache-Control": "private, max-age=3600"}
+        if info.get("pages"):
+            headers["X-Page-Count"] = str(info["pages"])
+        return Response(content=image, media_type="image/jpeg", headers=headers)
+        
+    except HTTPException:
+        raise
+    except Exception as error:
+        logger.exception("Preview error")
+        raise HTTPException(status_code=500, detail="Preview failed")
+
 @app.get("/api/admin/download")
-async def download_file(otp: str):
-    """Download file by OTP - matches Next.js /api/admin/download"""
+async def download_file(otp: str, request: Request, original: bool = False):
+    """Download file by OTP - matches Next.js /api/admin/download
+    
+    Serves the print-ready PDF once it has been rendered (pass original=true
+    for the file as uploaded).
+    """
     try:
         if not otp:
             raise HTTPException(status_code=400, detail="OTP required")
@@ -260,26 +652,36 @@ async def download_file(otp: str):
         # Check if expired
         expires_at = datetime.fromisoformat(print_job.expires_at.replace('Z', '+00:00'))
         if datetime.now() > expires_at.replace(tzinfo=None):
-            await storage.delete(otp)
-            await storage.delete_file(print_job.file_path)
+            await storage.delete(otp.upper(), print_job)
+            await storage.release_blobs(job_blob_paths(print_job))
             raise HTTPException(status_code=404, detail="File expired")
         
-        # Download file from storage
-        file_content = await storage.download_file(print_job.file_path)
+        file_path, filename, media_type = served_file(print_job, original)
+        
+        # Stream the file from storage chunk by chunk, passing Range and
+        # conditional headers through so resumed/repeated downloads are cheap
+        file_stream = await storage.open_file(file_path, request.headers)
+        headers = {
+            **file_stream.headers,
+            "Content-Disposition": f'attachment; filename="{filename}"'
+        }
+        
+        if file_stream.status_code in (304, 416):
+            await file_stream.aclose()
+            return Response(status_code=file_stream.status_code, headers=headers)
         
-        # Return file as streaming response
         return StreamingResponse(
-            io.BytesIO(file_content),
-            media_type=print_job.file_type,
-            headers={
-                "Content-Disposition": f'attachment; filename="{print_job.filename}"'
-            }
+            file_stream.iter_chunks(),
+            status_code=file_stream.status_code,
+            media_type=media_type,
+            headers=headers,
+            background=BackgroundTask(file_stream.aclose)
         )
         
     except HTTPException:
         raise
     except Exception as error:
-        print(f"Download error: {error}")
+        logger.exception("Download error")
         raise HTTPException(status_code=500, detail="Download failed")
 
 @app.post("/api/admin/complete")
@@ -297,7 +699,7 @@ async def complete_print_job(request_data: dict):
             raise HTTPException(status_code=404, detail="Print job not found")
         
         # Update status to completed
-        updated = await storage.update(otp, {
+        updated = await storage.update(otp.upper(), {
             "status": "completed",
             "completed_at": datetime.now().isoformat()
         })
@@ -313,48 +715,86 @@ async def complete_print_job(request_data: dict):
     except HTTPException:
         raise
     except Exception as error:
-        print(f"Complete error: {error}")
+        logger.exception("Complete error")
         raise HTTPException(status_code=500, detail="Update failed")
 
+def collect_state_metrics() -> None:
+    """Refresh the gauges that mirror in-process state"""
+    counters = storage.counters.snapshot()
+    for status in ("total", "pending", "completed", "expired"):
+        metrics.JOBS.labels(status).set(counters[status])
+    for name, pool in admission.pools.items():
+        metrics.ADMISSION_ACTIVE.labels(name).set(pool.active)
+        metrics.ADMISSION_WAITING.labels(name).set(pool.waiting)
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Prometheus scrape endpoint (summed over all workers when there are several)"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    collect_state_metrics()
+    body = await asyncio.to_thread(metrics.render)
+    return Response(body, media_type=metrics.CONTENT_TYPE_LATEST)
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness probe - the process is up and its event loop is answering"""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """Readiness probe - storage is built and warmed up, and the worker is not shutting down"""
+    if not getattr(app.state, "ready", False):
+        return JSONResponse(status_code=503, content={"status": "not ready"})
+    return {"status": "ready", "warm_connections": storage.warm_connections}
+
 # Health check endpoint
 @app.get("/health")
 async def health_check():
-    """Health check endpoint"""
-    try:
-        # Test database connection
-        total_jobs = await storage.size()
-        return {
-            "status": "healthy",
-            "database": "connected",
-            "total_jobs": total_jobs,
-            "timestamp": datetime.now().isoformat(),
-            "file_limits": {
-                "pdf": "50MB",
-                "images": "15MB", 
-                "docx": "10MB"
-            }
-        }
-    except Exception as error:
-        return {
-            "status": "unhealthy",
-            "error": str(error),
-            "timestamp": datetime.now().isoformat()
+    """Health check - answers from in-process counters, no database round trip
+    
+    `database` reflects whether the metadata store answered its last warm-up
+    or counter reconcile (every COUNTER_RECONCILE_INTERVAL).
+    """
+    counters = storage.counters.snapshot()
+    return {
+        "status": "healthy" if storage.metadata_ready else "unhealthy",
+        "database": "connected" if storage.metadata_ready else "disconnected",
+        "total_jobs": counters["total"],
+        "jobs": counters,
+        "job_cache": storage.job_cache.stats(),
+        "expiry": storage.expiry.stats(),
+        "otp_allocator": storage.otps.stats(),
+        "admission": admission.stats(),
+        "blobs": {
+            "uploaded": storage.blobs_uploaded,
+            "deduplicated": storage.blobs_reused,
+            "compression": storage.codec_stats(),
+            "cache": storage.blobs.cache_stats()
+        },
+        "conversions": storage.conversions.stats(),
+        "previews": storage.previews.stats(),
+        "timestamp": datetime.now().isoformat(),
+        "file_limits": {
+            "pdf": "50MB",
+            "images": "15MB", 
+            "docx": "10MB"
         }
+    }
 
 if __name__ == "__main__":
-    # Configure uvicorn with increased limits for large file uploads
+    import uvicorn
+    
+    # Development server: one process with auto-reload. Production runs
+    # several workers under gunicorn (gunicorn -c gunicorn.conf.py main:app)
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=settings.HOST,
+        port=settings.PORT,
         reload=True,
-        log_level="info",
-        # Increase limits for large file uploads (100MB to handle 50MB PDFs)
-        limit_max_requests=1000,
-        limit_concurrency=100,
-        timeout_keep_alive=60,
-        # Increase request size limits
-        limit_request_line=8190,
-        limit_request_fields=100,
-        limit_request_field_size=8190
+        # Per-endpoint limits live in AdmissionMiddleware; this is only the
+        # outer cap on open connections
+        limit_concurrency=settings.MAX_CONNECTIONS,
+        timeout_keep_alive=settings.KEEPALIVE_TIMEOUT,
+        timeout_graceful_shutdown=settings.GRACEFUL_TIMEOUT,
     )
@@ -0,0 +1,449 @@
+import os
+import json
+import sqlite3
+import asyncio
+import threading
+import httpx
+from concurrent.futures import ThreadPoolExecutor
+from postgrest import AsyncPostgrestClient
+from postgrest.exceptions import APIError
+from typing import Optional, Dict, Any, List, Tuple
+from models import PrintJob
+from config import settings
+from http_client import http_limits, http_timeout, supabase_credentials
+
+JOB_COLUMNS = (
+    "otp",
+    "filename",
+    "file_path",
+    "file_type",
+    "print_options",
+    "upload_time",
+    "status",
+    "expires_at",
+    "completed_at",
+    "print_file_path",
+    "print_status",
+)
+
+
+class DuplicateOTPError(Exception):
+    """Raised by insert when another job already holds the OTP"""
+
+
+class MetadataStore:
+    """Interface for the backend that holds print_jobs rows"""
+
+    async def insert(self, otp: str, job: PrintJob) -> None:
+        """Insert a job; raises DuplicateOTPError if the OTP is taken"""
+        raise NotImplementedError
+
+    async def get(self, otp: str) -> Optional[PrintJob]:
+        raise NotImplementedError
+
+    async def get_by_file_path(self, file_path: str) -> Optional[PrintJob]:
+        """The oldest job whose original is stored at `file_path`"""
+        raise NotImplementedError
+
+    async def update(self, otp: str, updates: Dict[str, Any]) -> bool:
+        """Apply `updates` to the job; False if no such job exists"""
+        raise NotImplementedError
+
+    async def delete(self, otp: str) -> bool:
+        raise NotImplementedError
+
+    async def count(self, status: Optional[str] = None) -> int:
+        raise NotImplementedError
+
+    async def count_expired(self, before: str) -> int:
+        """Number of jobs whose expires_at is earlier than `before`"""
+        raise NotImplementedError
+
+    async def expired_file_paths(self, before: str) -> List[str]:
+        """File paths of jobs whose expires_at is earlier than `before`"""
+        raise NotImplementedError
+
+    async def delete_expired(self, before: str) -> int:
+        raise NotImplementedError
+
+    async def list_by_expiry(self, before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+                             limit: int = 1000) -> List[Dict[str, Any]]:
+        """Rows (otp, file_path, expires_at, upload_time, status) ordered by (expires_at, otp).
+
+        `before` keeps only jobs expiring earlier than it; `after` is the
+        (expires_at, otp) key of the last row of the previous page.
+        """
+        raise NotImplementedError
+
+    async def delete_expired_jobs(self, otps: List[str], before: str) -> List[PrintJob]:
+        """Delete the given jobs if they expired before `before`; returns those deleted"""
+        raise NotImplementedError
+
+    async def existing_file_paths(self, file_paths: List[str]) -> List[str]:
+        """The subset of `file_paths` that at least one job still references (as original or rendering)"""
+        raise NotImplementedError
+
+    async def warm_up(self, connections: int) -> int:
+        """Open up to `connections` pooled connections ahead of traffic; returns how many answered"""
+        return 0
+
+    async def aclose(self) -> None:
+        pass
+
+
+class PooledPostgrestClient(AsyncPostgrestClient):
+    """Async PostgREST client whose session uses our keep-alive pool limits"""
+
+    def create_session(self, base_url, headers, timeout) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            limits=http_limits(),
+        )
+
+
+class SupabaseMetadataStore(MetadataStore):
+    """print_jobs table in Supabase, over async PostgREST"""
+
+    def __init__(self):
+        supabase_url, auth_headers = supabase_credentials()
+
+        # The database client is fully async and keeps its connections alive,
+        # so a slow query only holds a pooled connection, never the event loop.
+        self.db = PooledPostgrestClient(
+            f"{supabase_url}/rest/v1",
+            headers=auth_headers,
+            timeout=http_timeout(),
+        )
+
+    async def aclose(self) -> None:
+        await self.db.aclose()
+
+    async def warm_up(self, connections: int) -> int:
+        # Concurrent requests make the pool open (and keep alive) one
+        # connection each, TLS handshake included
+        async def probe() -> bool:
+            response = await self.db.session.get("/print_jobs", params={"select": "otp", "limit": "1"})
+            return response.status_code < 500
+
+        results = await asyncio.gather(*(probe() for _ in range(connections)), return_exceptions=True)
+        return sum(result is True for result in results)
+
+    async def insert(self, otp: str, job: PrintJob) -> None:
+        data = {**job.model_dump(exclude={"completed_at"}, exclude_none=True), "otp": otp}
+        try:
+            result = await self.db.table("print_jobs").insert(data).execute()
+        except APIError as error:
+            if error.code == "23505":  # unique_violation
+                raise DuplicateOTPError(otp) from error
+            raise
+        if not result.data:
+            raise Exception("Failed to store print job")
+
+    async def get(self, otp: str) -> Optional[PrintJob]:
+        result = await self.db.table("print_jobs").select("*").eq("otp", otp).execute()
+        if result.data and len(result.data) > 0:
+            return PrintJob(**result.data[0])
+        return None
+
+    async def get_by_file_path(self, file_path: str) -> Optional[PrintJob]:
+        result = await (
+            self.db.table("print_jobs")
+            .select("*")
+            .eq("file_path", file_path)
+            .order("upload_time")
+            .limit(1)
+            .execute()
+        )
+        return PrintJob(**result.data[0]) if result.data else None
+
+    async def update(self, otp: str, updates: Dict[str, Any]) -> bool:
+        result = await self.db.table("print_jobs").update(updates).eq("otp", otp).execute()
+        return bool(result.data)
+
+    async def delete(self, otp: str) -> bool:
+        await self.db.table("print_jobs").delete().eq("otp", otp).execute()
+        return True
+
+    async def count(self, status: Optional[str] = None) -> int:
+        # The exact count comes back in Content-Range; fetch a single id
+        # rather than every row
+        query = self.db.table("print_jobs").select("id", count="exact").limit(1)
+        if status:
+            query = query.eq("status", status)
+        result = await query.execute()
+        return result.count if result.count else 0
+
+    async def count_expired(self, before: str) -> int:
+        result = await self.db.table("print_jobs").select("id", count="exact").lt("expires_at", before).limit(1).execute()
+        return result.count if result.count else 0
+
+    async def expired_file_paths(self, before: str) -> List[str]:
+        result = await self.db.table("print_jobs").select("file_path").lt("expires_at", before).execute()
+        return [row["file_path"] for row in result.data or []]
+
+    async def delete_expired(self, before: str) -> int:
+        result = await self.db.table("print_jobs").delete().lt("expires_at", before).execute()
+        return len(result.data or [])
+
+    async def list_by_expiry(self, before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+                             limit: int = 1000) -> List[Dict[str, Any]]:
+        query = (
+            self.db.table("print_jobs")
+            .select("otp,file_path,expires_at,upload_time,status")
+            .order("expires_at,otp")
+            .limit(limit)
+        )
+        if before:
+            query = query.lt("expires_at", before)
+        if after:
+            expires_at, otp = after
+            query.params = query.params.add(
+                "or", f'(expires_at.gt."{expires_at}",and(expires_at.eq."{expires_at}",otp.gt."{otp}"))'
+            )
+        result = await query.execute()
+        return result.data or []
+
+    async def delete_expired_jobs(self, otps: List[str], before: str) -> List[PrintJob]:
+        result = await self.db.table("print_jobs").delete().in_("otp", otps).lt("expires_at", before).execute()
+        return [PrintJob(**row) for row in result.data or []]
+
+    async def existing_file_paths(self, file_paths: List[str]) -> List[str]:
+        if not file_paths:
+            return []
+        originals = await self.db.table("print_jobs").select("file_path").in_("file_path", file_paths).execute()
+        rendered = await self.db.table("print_jobs").select("print_file_path").in_(
+            "print_file_path", file_paths
+        ).execute()
+        return list({row["file_path"] for row in originals.data or []} |
+                    {row["print_file_path"] for row in rendered.data or []})
+
+
+# Mirrors scripts/create-tables.sql, including its indexes
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS print_jobs (
+    id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+    otp TEXT UNIQUE NOT NULL,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    file_type TEXT NOT NULL,
+    print_options TEXT NOT NULL,
+    upload_time TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    status TEXT DEFAULT 'pending' CHECK (status IN ('pending', 'completed')),
+    expires_at TEXT NOT NULL,
+    completed_at TEXT,
+    print_file_path TEXT,
+    print_status TEXT CHECK (print_status IN ('queued', 'ready', 'failed')),
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f', 'now'))
+);
+
+CREATE INDEX IF NOT EXISTS idx_print_jobs_otp ON print_jobs(otp);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_status ON print_jobs(status);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_expires_at ON print_jobs(expires_at);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_upload_time ON print_jobs(upload_time);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_file_path ON print_jobs(file_path);
+
+CREATE TRIGGER IF NOT EXISTS update_print_jobs_updated_at
+    AFTER UPDATE ON print_jobs
+    FOR EACH ROW
+    BEGIN
+        UPDATE print_jobs SET updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') WHERE id = NEW.id;
+    END;
+"""
+
+# Columns added since the first schema, applied to older database files
+SQLITE_ADDED_COLUMNS = [
+    ("print_file_path", "TEXT"),
+    ("print_status", "TEXT CHECK (print_status IN ('queued', 'ready', 'failed'))"),
+]
+
+
+class SQLiteMetadataStore(MetadataStore):
+    """print_jobs in an embedded SQLite database in WAL mode.
+
+    Reads run on a small pool of reader threads, each with its own
+    connection, so a WAL checkpoint or a large scan (expiry paging, counts)
+    never blocks the event loop; WAL lets them proceed while a write is in
+    flight. Writes go through a single writer thread, which also keeps
+    SQLite from ever seeing two writers at once.
+    """
+
+    def __init__(self, path: str = settings.SQLITE_PATH, readers: int = settings.SQLITE_READERS):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-writer")
+        self._writer = self._connect()
+        self._writer.executescript(SQLITE_SCHEMA)
+        self._migrate()
+        self._reader_pool = ThreadPoolExecutor(max_workers=max(readers, 1), thread_name_prefix="sqlite-reader")
+        self._local = threading.local()
+        self._readers: List[sqlite3.Connection] = []
+        self._readers_lock = threading.Lock()
+
+    def _migrate(self) -> None:
+        """Add columns introduced after a database was first created"""
+        existing = {row["name"] for row in self._writer.execute("PRAGMA table_info(print_jobs)")}
+        for column, definition in SQLITE_ADDED_COLUMNS:
+            if column not in existing:
+                self._writer.execute(f"ALTER TABLE print_jobs ADD COLUMN {column} {definition}")
+        self._writer.execute(
+            "CREATE INDEX IF NOT EXISTS idx_print_jobs_print_file_path ON print_jobs(print_file_path)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={settings.SQLITE_BUSY_TIMEOUT_MS}")
+        return conn
+
+    async def _write(self, sql: str, params=()) -> sqlite3.Cursor:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool, self._writer.execute, sql, params)
+
+    def _reader(self) -> sqlite3.Connection:
+        """The calling reader thread's own connection, opened on first use"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    async def _read(self, sql: str, params=()) -> List[sqlite3.Row]:
+        def query() -> List[sqlite3.Row]:
+            return self._reader().execute(sql, params).fetchall()
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_pool, query)
+
+    @staticmethod
+    def _to_job(row: sqlite3.Row) -> PrintJob:
+        data = {column: row[column] for column in JOB_COLUMNS}
+        data["print_options"] = json.loads(data["print_options"])
+        return PrintJob(**data)
+
+    async def warm_up(self, connections: int) -> int:
+        # Open reader connections and pull the schema and index pages into
+        # the page cache
+        await asyncio.gather(*(self._read("SELECT otp FROM print_jobs LIMIT 1") for _ in range(connections)))
+        return len(self._readers)
+
+    async def aclose(self) -> None:
+        self._reader_pool.shutdown(wait=True)
+        self._writer_pool.shutdown(wait=True)
+        for conn in self._readers:
+            conn.close()
+        self._writer.close()
+
+    async def insert(self, otp: str, job: PrintJob) -> None:
+        data = {**job.model_dump(exclude={"completed_at"}, exclude_none=True), "otp": otp}
+        data["print_options"] = json.dumps(data["print_options"])
+        columns = ", ".join(data)
+        placeholders = ", ".join(f":{column}" for column in data)
+        try:
+            await self._write(f"INSERT INTO print_jobs ({columns}) VALUES ({placeholders})", data)
+        except sqlite3.IntegrityError as error:
+            if "print_jobs.otp" in str(error):
+                raise DuplicateOTPError(otp) from error
+            raise
+
+    async def get(self, otp: str) -> Optional[PrintJob]:
+        rows = await self._read("SELECT * FROM print_jobs WHERE otp = ?", (otp,))
+        return self._to_job(rows[0]) if rows else None
+
+    async def get_by_file_path(self, file_path: str) -> Optional[PrintJob]:
+        rows = await self._read(
+            "SELECT * FROM print_jobs WHERE file_path = ? ORDER BY upload_time LIMIT 1", (file_path,)
+        )
+        return self._to_job(rows[0]) if rows else None
+
+    async def update(self, otp: str, updates: Dict[str, Any]) -> bool:
+        updates = {column: value for column, value in updates.items() if column in JOB_COLUMNS}
+        if not updates:
+            return False
+        if "print_options" in updates:
+            updates["print_options"] = json.dumps(updates["print_options"])
+        assignments = ", ".join(f"{column} = :{column}" for column in updates)
+        cursor = await self._write(
+            f"UPDATE print_jobs SET {assignments} WHERE otp = :_otp",
+            {**updates, "_otp": otp},
+        )
+        return cursor.rowcount > 0
+
+    async def delete(self, otp: str) -> bool:
+        await self._write("DELETE FROM print_jobs WHERE otp = ?", (otp,))
+        return True
+
+    async def count(self, status: Optional[str] = None) -> int:
+        if status:
+            rows = await self._read("SELECT count(*) FROM print_jobs WHERE status = ?", (status,))
+        else:
+            rows = await self._read("SELECT count(*) FROM print_jobs")
+        return rows[0][0]
+
+    async def count_expired(self, before: str) -> int:
+        rows = await self._read("SELECT count(*) FROM print_jobs WHERE expires_at < ?", (before,))
+        return rows[0][0]
+
+    async def expired_file_paths(self, before: str) -> List[str]:
+        rows = await self._read("SELECT file_path FROM print_jobs WHERE expires_at < ?", (before,))
+        return [row["file_path"] for row in rows]
+
+    async def delete_expired(self, before: str) -> int:
+        cursor = await self._write("DELETE FROM print_jobs WHERE expires_at < ?", (before,))
+        return cursor.rowcount
+
+    async def list_by_expiry(self, before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+                             limit: int = 1000) -> List[Dict[str, Any]]:
+        conditions, params = [], []
+        if before:
+            conditions.append("expires_at < ?")
+            params.append(before)
+        if after:
+            conditions.append("(expires_at, otp) > (?, ?)")
+            params.extend(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = await self._read(
+            f"SELECT otp, file_path, expires_at, upload_time, status FROM print_jobs {where} ORDER BY expires_at, otp LIMIT ?",
+            (*params, limit),
+        )
+        return [dict(row) for row in rows]
+
+    async def delete_expired_jobs(self, otps: List[str], before: str) -> List[PrintJob]:
+        if not otps:
+            return []
+
+        def delete() -> List[sqlite3.Row]:
+            placeholders = ", ".join("?" for _ in otps)
+            return self._writer.execute(
+                f"DELETE FROM print_jobs WHERE otp IN ({placeholders}) AND expires_at < ? RETURNING *",
+                (*otps, before),
+            ).fetchall()
+
+        loop = asyncio.get_running_loop()
+        rows = await loop.run_in_executor(self._writer_pool, delete)
+        return [self._to_job(row) for row in rows]
+
+    async def existing_file_paths(self, file_paths: List[str]) -> List[str]:
+        if not file_paths:
+            return []
+        placeholders = ", ".join("?" for _ in file_paths)
+        rows = await self._read(
+            f"SELECT file_path AS path FROM print_jobs WHERE file_path IN ({placeholders}) "
+            f"UNION SELECT print_file_path FROM print_jobs WHERE print_file_path IN ({placeholders})",
+            file_paths * 2,
+        )
+        return [row["path"] for row in rows]
+
+
+def create_metadata_store() -> MetadataStore:
+    """Build the metadata backend selected by METADATA_BACKEND"""
+    if settings.METADATA_BACKEND == "sqlite":
+        return SQLiteMetadataStore()
+    if settings.METADATA_BACKEND == "supabase":
+        return SupabaseMetadataStore()
+    raise ValueError(f"Unknown METADATA_BACKEND: {settings.METADATA_BACKEND}")
@@ -0,0 +1,153 @@
+import os
+import time
+import functools
+from typing import Optional
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+from admission import ROUTES as ADMISSION_ROUTES
+from config import settings
+
+# Latency buckets in seconds: fast lookups at the low end, large uploads and
+# cold storage downloads at the high end
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Routes timed individually; everything else is grouped as "other" so that
+# per-upload paths (/api/uploads/{id}) cannot blow up the label set
+TIMED_ROUTES = ("/api/upload", "/api/admin/lookup", "/api/admin/download", "/api/admin/complete")
+
+# Under the multi-worker server a scrape reaches one random worker, whose
+# own counters would jump between unrelated series. gunicorn.conf.py then
+# sets PROMETHEUS_MULTIPROC_DIR before prometheus_client is imported, every
+# worker writes its samples to files there, and a scrape adds them all up.
+MULTIPROC_ENV = "PROMETHEUS_MULTIPROC_DIR"
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "xeroq_http_request_duration_seconds",
+    "Time from request start until the response body was fully sent",
+    ("route", "method", "status"),
+    buckets=LATENCY_BUCKETS,
+)
+HTTP_ERRORS = Counter(
+    "xeroq_http_errors_total", "Responses with a 4xx or 5xx status, by status class", ("route", "class"),
+)
+HTTP_RECEIVED_BYTES = Counter(
+    "xeroq_http_received_bytes_total", "Request body bytes received", ("route",),
+)
+HTTP_SENT_BYTES = Counter(
+    "xeroq_http_sent_bytes_total", "Response body bytes sent", ("route",),
+)
+UPLOADS_IN_FLIGHT = Gauge(
+    "xeroq_uploads_in_flight", "Upload requests currently being received or stored", multiprocess_mode="livesum",
+)
+STORAGE_SECONDS = Histogram(
+    "xeroq_storage_operation_duration_seconds",
+    "Time spent in a storage layer call, including database and blob store round trips",
+    ("operation", "outcome"),
+    buckets=LATENCY_BUCKETS,
+)
+STORAGE_ERRORS = Counter(
+    "xeroq_storage_errors_total", "Storage layer calls that raised, by exception class", ("operation", "error"),
+)
+# Each worker keeps its own job counters, so they are reported per worker
+# (with a pid label) rather than added up
+JOBS = Gauge(
+    "xeroq_jobs", "Print jobs by status, from the in-process counters", ("status",), multiprocess_mode="liveall",
+)
+ADMISSION_ACTIVE = Gauge(
+    "xeroq_admission_active", "Requests holding a slot in an admission pool", ("pool",), multiprocess_mode="livesum",
+)
+ADMISSION_WAITING = Gauge(
+    "xeroq_admission_waiting", "Requests queued for a slot in an admission pool", ("pool",),
+    multiprocess_mode="livesum",
+)
+
+
+def multiprocess_dir() -> Optional[str]:
+    """The shared samples directory when running as one of several workers, else None"""
+    if not settings.METRICS_ENABLED:
+        return None
+    return os.environ.get(MULTIPROC_ENV) or None
+
+
+def render() -> bytes:
+    """The scrape body: this process's metrics, or the sum over all workers (file I/O, run it in a thread)"""
+    directory = multiprocess_dir()
+    if directory is None:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=directory)
+    return generate_latest(registry)
+
+
+def route_label(path: str) -> str:
+    return path if path in TIMED_ROUTES else "other"
+
+
+def is_upload(method: str, path: str) -> bool:
+    return any(pool == "upload" and route_method == method and pattern.match(path)
+               for route_method, pattern, pool in ADMISSION_ROUTES)
+
+
+def timed(operation: str):
+    """Time an async storage call into the storage histogram and count what it raises"""
+    def decorate(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = await function(*args, **kwargs)
+            except Exception as error:
+                STORAGE_SECONDS.labels(operation, "error").observe(time.perf_counter() - started)
+                STORAGE_ERRORS.labels(operation, type(error).__name__).inc()
+                raise
+            STORAGE_SECONDS.labels(operation, "ok").observe(time.perf_counter() - started)
+            return result
+        return wrapper
+    return decorate
+
+
+class MetricsMiddleware:
+    """Per-route latency, status classes, body bytes and in-flight uploads.
+
+    Timing stops when the last body chunk has gone out, so downloads are
+    measured over the whole transfer rather than up to the first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method, path = scope["method"], scope["path"]
+        route = route_label(path)
+        upload = is_upload(method, path)
+        started = time.perf_counter()
+        status = 500
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                HTTP_RECEIVED_BYTES.labels(route).inc(len(message.get("body", b"")))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                HTTP_SENT_BYTES.labels(route).inc(len(message.get("body", b"")))
+            await send(message)
+
+        if upload:
+            UPLOADS_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            if upload:
+                UPLOADS_IN_FLIGHT.dec()
+            HTTP_REQUEST_SECONDS.labels(route, method, str(status)).observe(time.perf_counter() - started)
+            if status >= 400:
+                HTTP_ERRORS.labels(route, f"{status // 100}xx").inc()
@@ -19,6 +19,9 @@ class PrintJob(BaseModel):
     status: str = "pending"
     expires_at: str
     completed_at: Optional[str] = None
+    # Print-ready PDF rendered after upload (DOCX and images only)
+    print_file_path: Optional[str] = None
+    print_status: Optional[str] = None  # queued, ready or failed
     
     class Config:
         from_attributes = True
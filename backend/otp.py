@@ -0,0 +1,119 @@
+import secrets
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Set
+from config import settings
+
+OTP_ALPHABET = "ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+OTP_LENGTH = 6
+OTP_SPACE = len(OTP_ALPHABET) ** OTP_LENGTH  # ~2.2 billion codes
+
+
+def encode_otp(code: int) -> str:
+    chars = []
+    for _ in range(OTP_LENGTH):
+        code, index = divmod(code, len(OTP_ALPHABET))
+        chars.append(OTP_ALPHABET[index])
+    return "".join(reversed(chars))
+
+
+def decode_otp(otp: str) -> int:
+    code = 0
+    for char in otp.upper():
+        code = code * len(OTP_ALPHABET) + OTP_ALPHABET.index(char)
+    return code
+
+
+class OTPAllocator:
+    """Collision-free OTP allocation with no database round trip.
+
+    Active codes are tracked as integers in a set (a few dozen bytes each,
+    where a bitmap over the whole 36^6 space would need ~270MB). Fresh
+    random codes are pre-generated into a pool, so `allocate` is an O(1)
+    pop. Released codes become free again and can be drawn into a later
+    pool refill.
+
+    The set only knows about jobs this process has seen; the UNIQUE
+    constraint on print_jobs.otp stays the backstop against codes handed
+    out by other workers.
+    """
+
+    def __init__(self, pool_size: int = settings.OTP_POOL_SIZE):
+        self.pool_size = pool_size
+        self._active: Set[int] = set()
+        self._pool: Deque[int] = deque()
+        self._pooled: Set[int] = set()
+        self._reservations: Dict[int, float] = {}  # code -> monotonic deadline
+        self.allocated_total = 0
+        self.refills = 0
+
+    def _refill(self) -> None:
+        while len(self._pool) < self.pool_size:
+            code = secrets.randbelow(OTP_SPACE)
+            if code in self._active or code in self._pooled:
+                continue
+            self._pool.append(code)
+            self._pooled.add(code)
+        self.refills += 1
+
+    def allocate(self) -> str:
+        """Reserve and return an OTP that no known job is using"""
+        while True:
+            if not self._pool:
+                self._refill()
+            code = self._pool.popleft()
+            self._pooled.discard(code)
+            # A code can have become active since it was pooled (mark_active)
+            if code not in self._active:
+                break
+
+        self._active.add(code)
+        self.allocated_total += 1
+        return encode_otp(code)
+
+    def reserve(self, ttl: float) -> str:
+        """Allocate an OTP that is released again unless a job claims it within `ttl` seconds"""
+        self._release_lapsed()
+        otp = self.allocate()
+        self._reservations[decode_otp(otp)] = time.monotonic() + ttl
+        return otp
+
+    def _release_lapsed(self) -> None:
+        now = time.monotonic()
+        lapsed = [code for code, deadline in self._reservations.items() if deadline <= now]
+        for code in lapsed:
+            del self._reservations[code]
+            self._active.discard(code)
+
+    def mark_active(self, otp: str) -> None:
+        """Record an OTP already in use (e.g. loaded from the database)"""
+        try:
+            code = decode_otp(otp)
+        except ValueError:
+            return  # not one of our codes
+        self._reservations.pop(code, None)
+        self._active.add(code)
+
+    def release(self, otp: str) -> None:
+        """Return an OTP to the free space once its job is gone"""
+        try:
+            code = decode_otp(otp)
+        except ValueError:
+            return
+        self._reservations.pop(code, None)
+        self._active.discard(code)
+
+    def is_active(self, otp: str) -> bool:
+        try:
+            return decode_otp(otp) in self._active
+        except ValueError:
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": len(self._active),
+            "pool": len(self._pool),
+            "reserved": len(self._reservations),
+            "allocated_total": self.allocated_total,
+            "refills": self.refills,
+        }
@@ -0,0 +1,228 @@
+import io
+import os
+import re
+import json
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import tempfile
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Set, Tuple
+from config import settings
+from cache import DiskCache
+from models import PrintJob
+from upload_stream import UPLOAD_TYPES
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# pypdfium2 is only used inside the preview workers, so the server process
+# just checks that it is installed; without it PDFs get no thumbnail
+HAS_PDFIUM = importlib.util.find_spec("pypdfium2") is not None
+
+logger = logging.getLogger(__name__)
+
+
+# --- Worker side: run in the process pool ---
+
+def _encode_jpeg(image, max_size: int, quality: int) -> bytes:
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGBA")
+        background = Image.new("RGBA", image.size, "white")
+        image = Image.alpha_composite(background, image).convert("RGB")
+    image.thumbnail((max_size, max_size), Image.LANCZOS)
+    out = io.BytesIO()
+    image.save(out, "JPEG", quality=quality, optimize=True)
+    return out.getvalue()
+
+
+def _docx_page_count(source: str) -> Optional[int]:
+    # Word records the page count in the document's extended properties
+    try:
+        with zipfile.ZipFile(source) as archive:
+            properties = archive.read("docProps/app.xml").decode("utf-8", "replace")
+    except (KeyError, zipfile.BadZipFile):
+        return None
+    match = re.search(r"<Pages>(\d+)</Pages>", properties)
+    return int(match.group(1)) if match else None
+
+
+def render_preview(source: str, family: str, max_size: int, quality: int) -> Tuple[Optional[bytes], Optional[int]]:
+    """First-page JPEG thumbnail and page count of a file (either can be None)"""
+    if family == "pdf":
+        if not HAS_PDFIUM:
+            return None, None
+        import pypdfium2 as pdfium
+        document = pdfium.PdfDocument(source)
+        try:
+            pages = len(document)
+            page = document[0]
+            scale = max_size / max(page.get_size())
+            image = page.render(scale=scale).to_pil()
+            return _encode_jpeg(image, max_size, quality), pages
+        finally:
+            document.close()
+
+    if family == "image":
+        with Image.open(source) as image:
+            pages = getattr(image, "n_frames", 1) if image.format == "TIFF" else 1
+            image.draft("RGB", (max_size, max_size))  # JPEGs decode straight at a reduced scale
+            return _encode_jpeg(image, max_size, quality), pages
+
+    if family == "docx":
+        return None, _docx_page_count(source)
+
+    return None, None
+
+
+# --- Event loop side ---
+
+class PreviewService:
+    """Low-resolution first-page previews and page counts for the print counter.
+
+    Staff can check a job from a thumbnail of a few KB instead of pulling
+    the whole file. Previews are rendered in a small process pool, right
+    after upload and again on demand if they have since been evicted, and
+    kept in a size-bounded disk cache keyed by the blob they were made from.
+    DOCX jobs are previewed from their print-ready PDF once it exists;
+    before that only their page count is known.
+    """
+
+    def __init__(self, storage, workers: int = settings.PREVIEW_WORKERS):
+        self.storage = storage
+        self.workers = workers
+        self.cache = DiskCache(settings.PREVIEW_CACHE_DIR, DiskCache.worker_share(settings.PREVIEW_CACHE_BYTES))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str, "asyncio.Task[Optional[Dict[str, Any]]]"] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.rendered = 0
+        self.failed = 0
+
+    @staticmethod
+    def _source(job: PrintJob) -> Tuple[str, str]:
+        """The blob a job's preview is made from, and its format family"""
+        if job.print_status == "ready" and job.print_file_path:
+            return job.print_file_path, "pdf"
+        family, _ = UPLOAD_TYPES.get(job.file_type, ("", 0))
+        return job.file_path, family
+
+    def supports(self, job: PrintJob) -> bool:
+        if not settings.PREVIEW_ENABLED:
+            return False
+        _, family = self._source(job)
+        if family == "docx":
+            return True
+        return Image is not None and (family == "image" or (family == "pdf" and HAS_PDFIUM))
+
+    @staticmethod
+    def _key(file_path: str) -> str:
+        return hashlib.sha256(f"{file_path}:{settings.PREVIEW_MAX_SIZE}".encode()).hexdigest()
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def _recycle(self, pool: ProcessPoolExecutor) -> None:
+        # A render that timed out keeps its worker busy until it finishes,
+        # so the pool is torn down and the next render starts a fresh one
+        if self._pool is pool:
+            self._pool = None
+        for process in list((pool._processes or {}).values()):
+            process.terminate()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def cached_info(self, job: PrintJob) -> Optional[Dict[str, Any]]:
+        """Preview details if they are cached; otherwise start rendering them in the background"""
+        if not self.supports(job):
+            return None
+        file_path, _ = self._source(job)
+        data = self.cache.get(f"{self._key(file_path)}.json")
+        if data is None:
+            self.submit(job)
+            return None
+        return json.loads(data)
+
+    def submit(self, job: PrintJob) -> None:
+        """Render a job's preview in the background"""
+        if not self.supports(job):
+            return
+        task = asyncio.create_task(self.get(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def get(self, job: PrintJob) -> Optional[Tuple[Optional[bytes], Dict[str, Any]]]:
+        """The job's thumbnail (None if it has none) and preview details, rendering them if needed"""
+        if not self.supports(job):
+            return None
+        file_path, family = self._source(job)
+        key = self._key(file_path)
+
+        info = self.cache.get(f"{key}.json")
+        if info is not None:
+            info = json.loads(info)
+            if not info["has_image"]:
+                return None, info
+            image = self.cache.get(f"{key}.jpg")
+            if image is not None:
+                return image, info
+
+        # Concurrent requests for the same blob share one render
+        task = self._pending.get(key)
+        if task is None:
+            task = asyncio.create_task(self._render(key, file_path, family))
+            self._pending[key] = task
+            task.add_done_callback(lambda _: self._pending.pop(key, None))
+        info = await asyncio.shield(task)
+        if info is None:
+            return None
+        return (self.cache.get(f"{key}.jpg") if info["has_image"] else None), info
+
+    async def _render(self, key: str, file_path: str, family: str) -> Optional[Dict[str, Any]]:
+        try:
+            with tempfile.TemporaryDirectory() as workdir:
+                source = os.path.join(workdir, "source")
+                await self.storage.download_to_file(file_path, source)
+                loop = asyncio.get_running_loop()
+                pool = self._executor()
+                try:
+                    image, pages = await asyncio.wait_for(
+                        loop.run_in_executor(pool, render_preview, source, family,
+                                             settings.PREVIEW_MAX_SIZE, settings.PREVIEW_QUALITY),
+                        timeout=settings.PREVIEW_TIMEOUT,
+                    )
+                except asyncio.TimeoutError:
+                    self._recycle(pool)
+                    raise
+        except Exception as error:
+            self.failed += 1
+            logger.warning("Preview of %s failed: %r", file_path, error)
+            return None
+
+        info = {"pages": pages, "has_image": image is not None, "bytes": len(image) if image else 0}
+        if image is not None:
+            self.cache.put(f"{key}.jpg", image)
+        self.cache.put(f"{key}.json", json.dumps(info).encode())
+        self.rendered += 1
+        return info
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": settings.PREVIEW_ENABLED,
+            "rendered": self.rendered,
+            "failed": self.failed,
+            "in_progress": len(self._pending),
+            "cache": self.cache.stats(),
+        }
+
+    async def aclose(self) -> None:
+        for task in list(self._tasks) + list(self._pending.values()):
+            task.cancel()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,243 @@
+import os
+import json
+import base64
+import time
+import uuid
+import fcntl
+import asyncio
+import hashlib
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Optional
+from config import settings
+from upload_stream import SNIFF_BYTES, UPLOAD_TYPES, UploadRejected, matches_signature, too_large
+
+TUS_VERSION = "1.0.0"
+
+
+def parse_upload_metadata(header: str) -> Dict[str, str]:
+    """Decode a tus Upload-Metadata header ("key base64value,key base64value")"""
+    metadata = {}
+    for pair in filter(None, (item.strip() for item in header.split(","))):
+        key, _, value = pair.partition(" ")
+        try:
+            metadata[key] = base64.b64decode(value).decode() if value else ""
+        except (ValueError, UnicodeDecodeError):
+            raise UploadRejected(400, f"Invalid Upload-Metadata value for {key!r}")
+    return metadata
+
+
+class ResumableUploads:
+    """Staging area for tus-style resumable uploads.
+
+    Each upload is a `{id}.part` file that chunks are appended to, plus a
+    `{id}.json` sidecar with its declared length and job details. The
+    offset is simply the size of the part file, so it survives dropped
+    connections and restarts, and any worker on the host can continue an
+    upload another one started (a file lock keeps two PATCHes, or two
+    finalizes, from interleaving).
+    """
+
+    def __init__(self, root: str = settings.RESUMABLE_UPLOAD_DIR):
+        self.root = os.path.realpath(root)
+        os.makedirs(self.root, exist_ok=True)
+
+    def _paths(self, upload_id: str):
+        # Ids are uuid4 hex, which also keeps them from escaping the root
+        if len(upload_id) != 32 or not all(c in "0123456789abcdef" for c in upload_id):
+            raise KeyError(upload_id)
+        base = os.path.join(self.root, upload_id)
+        return f"{base}.part", f"{base}.json"
+
+    def _read_meta(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            _, meta_path = self._paths(upload_id)
+            with open(meta_path) as f:
+                return json.load(f)
+        except (KeyError, FileNotFoundError):
+            return None
+
+    def _write_meta(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        _, meta_path = self._paths(upload_id)
+        partial_path = f"{meta_path}.tmp"
+        with open(partial_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(partial_path, meta_path)
+
+    def create(self, length: int, filename: str, content_type: str, print_options: Dict[str, Any]) -> str:
+        """Register a new upload of `length` bytes and return its id"""
+        if content_type not in UPLOAD_TYPES:
+            raise UploadRejected(400, "Invalid file type. Please upload PDF, DOCX, or image files.")
+        _, max_size = UPLOAD_TYPES[content_type]
+        if length > max_size:
+            raise too_large(length, max_size)
+        if length <= 0:
+            raise UploadRejected(400, "Uploaded file is empty")
+
+        upload_id = uuid.uuid4().hex
+        part_path, _ = self._paths(upload_id)
+        open(part_path, "wb").close()
+        self._write_meta(upload_id, {
+            "length": length,
+            "filename": filename,
+            "content_type": content_type,
+            "print_options": print_options,
+            "created_at": time.time(),
+        })
+        return upload_id
+
+    def info(self, upload_id: str) -> Optional[Dict[str, Any]]:
+        """Upload details plus the current offset, or None if unknown"""
+        meta = self._read_meta(upload_id)
+        if meta is None:
+            return None
+        part_path, _ = self._paths(upload_id)
+        try:
+            meta["offset"] = os.path.getsize(part_path)
+        except FileNotFoundError:
+            meta["offset"] = meta["length"]  # already finalized
+        return meta
+
+    async def append(self, upload_id: str, offset: int, chunks: AsyncIterator[bytes]) -> int:
+        """Append a PATCH body at `offset`; returns the new offset.
+
+        Bytes that arrived before a dropped connection are kept, so the
+        client resumes from whatever offset a HEAD reports next.
+        """
+        meta = self._read_meta(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if meta.get("otp"):
+            raise UploadRejected(409, "Upload is already complete")
+        part_path, _ = self._paths(upload_id)
+
+        # Never create the part file here: finalize (or a purge) removes it,
+        # and a late PATCH must not bring it back as an orphan
+        try:
+            out = os.fdopen(os.open(part_path, os.O_WRONLY | os.O_APPEND), "ab")
+        except FileNotFoundError:
+            raise UploadRejected(409, "Upload is already complete")
+        try:
+            try:
+                fcntl.flock(out.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadRejected(409, "Another request is writing to this upload")
+
+            current = os.fstat(out.fileno()).st_size
+            if offset != current:
+                raise UploadRejected(409, f"Upload-Offset {offset} does not match current offset {current}")
+
+            try:
+                async for chunk in chunks:
+                    if current + len(chunk) > meta["length"]:
+                        raise UploadRejected(413, "Chunk runs past the declared Upload-Length")
+                    await asyncio.to_thread(out.write, chunk)
+                    current += len(chunk)
+            finally:
+                out.flush()
+        finally:
+            out.close()
+
+        if offset < SNIFF_BYTES and (current >= SNIFF_BYTES or current == meta["length"]):
+            await self._check_signature(upload_id, meta)
+        return current
+
+    async def _check_signature(self, upload_id: str, meta: Dict[str, Any]) -> None:
+        part_path, _ = self._paths(upload_id)
+        with open(part_path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+        family, _ = UPLOAD_TYPES[meta["content_type"]]
+        if not matches_signature(family, head):
+            self.delete(upload_id)
+            raise UploadRejected(400, f"File content does not match its type ({meta['content_type']}).")
+
+    def open_completed(self, upload_id: str):
+        """Open a fully received upload for reading"""
+        meta = self.info(upload_id)
+        if meta is None:
+            raise KeyError(upload_id)
+        if meta["offset"] != meta["length"]:
+            raise UploadRejected(409, f"Upload incomplete ({meta['offset']} of {meta['length']} bytes)")
+        part_path, _ = self._paths(upload_id)
+        return open(part_path, "rb")
+
+    @asynccontextmanager
+    async def finalizing(self, upload_id: str) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """Hold an upload's lock while its job is created; yields info() as of taking it.
+
+        A concurrent finalize of the same upload, in this worker or another,
+        waits here and then finds the OTP this one recorded with
+        mark_finalized; PATCHes are turned away meanwhile.
+        """
+        try:
+            part_path, _ = self._paths(upload_id)
+            fd = os.open(part_path, os.O_RDONLY)
+        except (KeyError, FileNotFoundError):
+            # Unknown, or finalized already (which removes the part file)
+            yield self.info(upload_id)
+            return
+        try:
+            # flock locks per open file, so this also serializes coroutines
+            # of one process; polled so a cancelled request leaves no thread waiting
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    await asyncio.sleep(0.05)
+            yield self.info(upload_id)
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def digest(file_obj) -> str:
+        """SHA-256 of a staged file (run in a thread)"""
+        sha256 = hashlib.sha256()
+        for chunk in iter(lambda: file_obj.read(settings.UPLOAD_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+        file_obj.seek(0)
+        return sha256.hexdigest()
+
+    def mark_finalized(self, upload_id: str, otp: str) -> None:
+        """Record the job created for an upload and drop its staged bytes"""
+        meta = self._read_meta(upload_id)
+        if meta is None:
+            return
+        meta["otp"] = otp
+        self._write_meta(upload_id, meta)
+        part_path, _ = self._paths(upload_id)
+        try:
+            os.unlink(part_path)
+        except FileNotFoundError:
+            pass
+
+    def delete(self, upload_id: str) -> None:
+        for path in self._paths(upload_id):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def purge_stale(self, max_age: float = settings.RESUMABLE_UPLOAD_TTL) -> int:
+        """Remove uploads abandoned (or finalized) more than `max_age` seconds ago.
+
+        An upload counts as active from its last PATCH, so a slow client
+        still sending chunks is not purged just because it started long ago.
+        """
+        cutoff = time.time() - max_age
+        removed = 0
+        for name in os.listdir(self.root):
+            if not name.endswith(".json"):
+                continue
+            upload_id = name[:-len(".json")]
+            meta = self._read_meta(upload_id)
+            if meta is None:
+                continue
+            part_path, _ = self._paths(upload_id)
+            try:
+                last_active = max(meta.get("created_at", 0), os.path.getmtime(part_path))
+            except FileNotFoundError:
+                last_active = meta.get("created_at", 0)
+            if last_active < cutoff:
+                self.delete(upload_id)
+                removed += 1
+        return removed
@@ -0,0 +1,77 @@
+import os
+import signal
+import asyncio
+import logging
+import resource
+from typing import Any
+from uvicorn.workers import UvicornWorker
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # No procfs: the peak so far is the closest we get (KB on Linux)
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class XeroQWorker(UvicornWorker):
+    """Gunicorn worker running the app on uvloop and httptools.
+
+    On SIGTERM (a deploy, or gunicorn stopping) uvicorn stops accepting
+    connections and lets in-flight requests, uploads included, finish for up
+    to GRACEFUL_TIMEOUT before the app shuts down. A worker whose RSS grows
+    past WORKER_MAX_MEMORY sends itself the same signal, so it drains and
+    gunicorn starts a fresh one in its place. This replaces recycling after a
+    fixed number of requests, which restarted workers whether or not they
+    had grown.
+
+    uvicorn only calls `callback_notify` from its main loop, which stops on
+    SIGTERM, so a draining worker would fall silent and be killed by the
+    arbiter after gunicorn's `timeout`, well inside GRACEFUL_TIMEOUT. A
+    separate heartbeat task keeps notifying until the server has exited;
+    a worker whose event loop is blocked still misses it and is restarted.
+    """
+
+    CONFIG_KWARGS = {
+        "loop": "uvloop",
+        "http": "httptools",
+        "limit_concurrency": settings.MAX_CONNECTIONS,
+        "timeout_graceful_shutdown": settings.GRACEFUL_TIMEOUT,
+    }
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.recycling = False
+
+    async def _heartbeat(self) -> None:
+        # self.timeout is half of gunicorn's timeout, like uvicorn's own ticks
+        while True:
+            await asyncio.sleep(self.timeout)
+            self.notify()
+
+    async def _serve(self) -> None:
+        heartbeat = asyncio.create_task(self._heartbeat())
+        try:
+            await super()._serve()
+        finally:
+            heartbeat.cancel()
+
+    async def callback_notify(self) -> None:
+        # Called on gunicorn's heartbeat, every `timeout / 2` seconds
+        await super().callback_notify()
+        if not settings.WORKER_MAX_MEMORY or self.recycling:
+            return
+        rss = current_rss()
+        if rss > settings.WORKER_MAX_MEMORY:
+            self.recycling = True
+            logger.warning(
+                "Worker RSS %d MB is over WORKER_MAX_MEMORY, restarting once in-flight requests finish",
+                rss // (1024 * 1024), extra={"pid": os.getpid(), "rss": rss},
+            )
+            os.kill(os.getpid(), signal.SIGTERM)
@@ -0,0 +1,56 @@
+import base64
+import hashlib
+import hmac
+import json
+import logging
+import secrets
+import time
+from typing import Any, Dict, Optional
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+_secret: Optional[bytes] = None
+
+
+def _signing_key() -> bytes:
+    global _secret
+    if _secret is None:
+        if settings.UPLOAD_SIGNING_SECRET:
+            _secret = settings.UPLOAD_SIGNING_SECRET.encode()
+        else:
+            # Tokens then only verify in the process that issued them
+            logger.warning("UPLOAD_SIGNING_SECRET is not set, using a per-process signing key")
+            _secret = secrets.token_bytes(32)
+    return _secret
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+def sign_token(payload: Dict[str, Any], expires_in: float) -> str:
+    """HMAC-signed, URL-safe token carrying `payload` until it expires"""
+    body = _b64encode(json.dumps({**payload, "exp": int(time.time() + expires_in)}, separators=(",", ":")).encode())
+    signature = _b64encode(hmac.new(_signing_key(), body.encode(), hashlib.sha256).digest())
+    return f"{body}.{signature}"
+
+
+def verify_token(token: str) -> Dict[str, Any]:
+    """Return the payload of a token this deployment signed; ValueError if invalid or expired"""
+    try:
+        body, signature = token.split(".")
+        expected = _b64encode(hmac.new(_signing_key(), body.encode(), hashlib.sha256).digest())
+        if not hmac.compare_digest(signature, expected):
+            raise ValueError("bad signature")
+        payload = json.loads(_b64decode(body))
+    except (ValueError, TypeError) as error:
+        raise ValueError(f"Invalid token: {error}")
+
+    if payload.get("exp", 0) < time.time():
+        raise ValueError("Token expired")
+    return payload
@@ -32,7 +32,13 @@ fi
 
 echo "✅ Environment variables configured"
 
-# Start the server
+# Start the server: ./start.sh --production runs gunicorn with one worker
+# per core (see gunicorn.conf.py); otherwise a single auto-reloading process
+if [ "$1" = "--production" ]; then
+    echo "🌟 Starting production server on http://localhost:${PORT:-8000}"
+    exec gunicorn -c gunicorn.conf.py main:app
+fi
+
 echo "🌟 Starting FastAPI server on http://localhost:8000"
 echo "📖 API documentation available at http://localhost:8000/docs"
 echo "🔄 Auto-reload enabled for development"
@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import asyncio
+from datetime import datetime, timezone
+from email.utils import formatdate
+import httpx
+import pytest
+
+# The backend is a flat set of modules run from its own directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+
+
+@pytest.fixture
+def local_backends(tmp_path, monkeypatch):
+    """SQLite and local-disk storage under tmp_path (the default ./data paths), without background rendering"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(settings, "METADATA_BACKEND", "sqlite")
+    monkeypatch.setattr(settings, "BLOB_BACKEND", "local")
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "CONVERSION_ENABLED", False)
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", False)
+    return tmp_path
+
+
+@pytest.fixture
+def storage(local_backends):
+    from storage import SupabaseStorage
+    store = SupabaseStorage()
+    yield store
+    asyncio.run(store.aclose())
+
+
+@pytest.fixture
+def client(local_backends, monkeypatch):
+    """The app with its lifespan running, as a single worker would serve it"""
+    import main
+    from resumable import ResumableUploads
+    from starlette.testclient import TestClient
+    monkeypatch.setattr(main, "resumable_uploads", ResumableUploads(str(local_backends / "data" / "uploads")))
+    with TestClient(main.app) as test_client:
+        yield test_client
+
+
+class FakeBucket:
+    """An in-memory Supabase Storage bucket, served through httpx.MockTransport"""
+
+    def __init__(self, name: str = "print-files"):
+        self.name = name
+        self.objects = {}  # name -> (bytes, created timestamp)
+
+    def put(self, name: str, data: bytes, created_at: float = None) -> None:
+        self.objects[name] = (data, created_at if created_at is not None else datetime.now().timestamp())
+
+    def _list(self, prefix: str):
+        prefix = f"{prefix}/" if prefix else ""
+        entries = {}
+        for name, (_, created_at) in self.objects.items():
+            if not name.startswith(prefix):
+                continue
+            child, slash, _ = name[len(prefix):].partition("/")
+            if slash:
+                entries.setdefault(child, {"name": child, "id": None})
+            else:
+                entries[child] = {"name": child, "id": name,
+                                  "created_at": datetime.fromtimestamp(created_at, timezone.utc).isoformat()}
+        return [entries[child] for child in sorted(entries)]
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path.removeprefix("/storage/v1")
+        body = await request.aread()
+
+        if path == f"/bucket/{self.name}":
+            return httpx.Response(200, json={"id": self.name})
+        if path == f"/object/list/{self.name}":
+            query = json.loads(body)
+            entries = self._list(query["prefix"])
+            return httpx.Response(200, json=entries[query["offset"]:query["offset"] + query["limit"]])
+        if path == "/object/move":
+            move = json.loads(body)
+            if move["sourceKey"] not in self.objects:
+                return httpx.Response(400, json={"error": "not_found"})
+            if move["destinationKey"] in self.objects:
+                return httpx.Response(400, json={"error": "Duplicate", "message": "The resource already exists"})
+            self.objects[move["destinationKey"]] = self.objects.pop(move["sourceKey"])
+            return httpx.Response(200, json={"message": "Successfully moved"})
+        if path == f"/object/{self.name}" and request.method == "DELETE":
+            for name in json.loads(body)["prefixes"]:
+                self.objects.pop(name, None)
+            return httpx.Response(200, json=[])
+
+        name = path.removeprefix(f"/object/{self.name}/")
+        if request.method == "POST":
+            if name in self.objects:
+                return httpx.Response(400, json={"error": "Duplicate"})
+            self.put(name, body)
+            return httpx.Response(200, json={"Key": name})
+        if name not in self.objects:
+            return httpx.Response(400, json={"error": "not_found"})
+        data, created_at = self.objects[name]
+        headers = {"etag": f'"{hash(data) & 0xffffffff:x}"', "last-modified": formatdate(created_at, usegmt=True)}
+        if request.method == "HEAD":
+            return httpx.Response(200, headers=headers)
+        if request.headers.get("if-none-match") == headers["etag"]:
+            return httpx.Response(304, headers=headers)
+        if request.headers.get("range"):
+            start, _, end = request.headers["range"].removeprefix("bytes=").partition("-")
+            if not start:  # the last `end` bytes
+                start, end = str(max(len(data) - int(end), 0)), ""
+            start, end = int(start), min(int(end or len(data) - 1), len(data) - 1)
+            headers["content-range"] = f"bytes {start}-{end}/{len(data)}"
+            return httpx.Response(206, headers=headers, content=data[start:end + 1])
+        return httpx.Response(200, headers=headers, content=data)
+
+
+@pytest.fixture
+def bucket(monkeypatch):
+    """A SupabaseBlobStore talking to a FakeBucket; the bucket is at `.fake`"""
+    from blob_store import SupabaseBlobStore
+    monkeypatch.setenv("NEXT_PUBLIC_SUPABASE_URL", "http://supabase.test")
+    monkeypatch.setenv("SUPABASE_SERVICE_ROLE_KEY", "service-role-key")
+    fake = FakeBucket()
+    store = SupabaseBlobStore(fake.name)
+    asyncio.run(store.http.aclose())
+    store.http = httpx.AsyncClient(base_url="http://supabase.test/storage/v1",
+                                   transport=httpx.MockTransport(fake.handle))
+    store.fake = fake
+    yield store
+    asyncio.run(store.http.aclose())
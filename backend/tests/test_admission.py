@@ -0,0 +1,128 @@
+import asyncio
+import json
+import pytest
+from admission import AdmissionControl, AdmissionMiddleware, AdmissionPool, MemoryBudget, Overloaded
+from config import settings
+
+
+def test_pool_queues_then_rejects():
+    async def run():
+        pool = AdmissionPool("upload", concurrency=1, queue_limit=1, queue_timeout=0.05)
+        await pool.acquire()
+        waiter = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0)
+        assert pool.stats()["waiting"] == 1
+        with pytest.raises(Overloaded, match="queue is full"):
+            await pool.acquire()
+        with pytest.raises(Overloaded, match="Timed out"):
+            await waiter
+
+        pool.release()
+        await pool.acquire()
+        return pool.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 1
+    assert stats["admitted_total"] == 2
+    assert stats["rejected_total"] == 2
+
+
+def test_memory_budget_spills_instead_of_waiting():
+    budget = MemoryBudget(10)
+    assert budget.reserve(6) == 6
+    assert budget.reserve(6) == 0
+    assert budget.reserve(0) == 0
+    budget.release(6)
+    assert budget.reserve(10) == 10
+    assert budget.stats() == {"limit": 10, "in_use": 10, "spilled_total": 1}
+
+
+def test_memory_budget_is_split_between_workers(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_MEMORY_BUDGET", 64)
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 4)
+    assert AdmissionControl().memory.limit == 16
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 0)
+    assert AdmissionControl().memory.limit == 64
+
+
+class Recorder:
+    """An app that records the spool it was granted; the next request waits on `hold` if set"""
+
+    def __init__(self):
+        self.granted = []
+        self.hold = None
+
+    async def __call__(self, scope, receive, send):
+        self.granted.append(scope.get("state", {}).get("upload_spool_memory"))
+        hold, self.hold = self.hold, None
+        if hold:
+            await hold.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+
+async def request(app, method: str, path: str, content_length: str = None):
+    headers = [(b"content-length", content_length.encode())] if content_length is not None else []
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    await app({"type": "http", "method": method, "path": path, "headers": headers}, receive, send)
+    return sent
+
+
+def test_middleware_reserves_the_body_size_up_to_the_spool(monkeypatch):
+    monkeypatch.setattr(settings, "UPLOAD_SPOOL_MEMORY", 1000)
+    monkeypatch.setattr(settings, "UPLOAD_MEMORY_BUDGET", 1500)
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "UPLOAD_CONCURRENCY", 2)
+    control = AdmissionControl()
+    inner = Recorder()
+    app = AdmissionMiddleware(inner, control)
+
+    async def run():
+        for content_length in ("200", "5000", None, "junk"):
+            await request(app, "POST", "/api/upload", content_length)
+        # Budget left after a held upload decides the next one's spool
+        inner.hold = hold = asyncio.Event()
+        held = asyncio.create_task(request(app, "POST", "/api/upload", "1000"))
+        while inner.hold:
+            await asyncio.sleep(0)
+        await request(app, "POST", "/api/upload", "800")
+        hold.set()
+        await held
+        # Lookups are not uploads
+        await request(app, "GET", "/api/admin/lookup")
+
+    asyncio.run(run())
+    assert inner.granted == [200, 1000, 1000, 1000, 1000, 0, None]
+    assert control.memory.stats()["in_use"] == 0
+
+
+def test_middleware_turns_away_a_full_queue(monkeypatch):
+    monkeypatch.setattr(settings, "ADMIN_CONCURRENCY", 1)
+    monkeypatch.setattr(settings, "ADMIN_QUEUE_LIMIT", 0)
+    inner = Recorder()
+    app = AdmissionMiddleware(inner, AdmissionControl())
+
+    async def run():
+        inner.hold = hold = asyncio.Event()
+        held = asyncio.create_task(request(app, "GET", "/api/admin/lookup"))
+        while inner.hold:
+            await asyncio.sleep(0)
+        rejected = await request(app, "GET", "/api/admin/lookup")
+        passed = await request(app, "GET", "/health")
+        hold.set()
+        await held
+        return rejected, passed
+
+    rejected, passed = asyncio.run(run())
+    assert rejected[0]["status"] == 503
+    assert (b"retry-after", str(settings.ADMISSION_RETRY_AFTER).encode()) in rejected[0]["headers"]
+    assert "Server busy" in json.loads(rejected[1]["body"])["detail"]
+    # Routes without a pool are never throttled
+    assert passed[0]["status"] == 200
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import subprocess
+import sys
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_health_reports_the_database(client):
+    health = client.get("/health").json()
+    assert health["status"] == "healthy"
+    assert health["database"] == "connected"
+    assert health["total_jobs"] == 0
+
+
+def test_importing_the_app_builds_no_storage(tmp_path):
+    # Each worker builds its own in the lifespan, after gunicorn has forked
+    check = "import sys, main; print(main.storage is None, 'pypdfium2' in sys.modules)"
+    env = {**os.environ, "PYTHONPATH": BACKEND}
+    output = subprocess.run([sys.executable, "-c", check], cwd=tmp_path, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    assert output.split() == ["True", "False"]
+
+
+def test_probes_follow_the_lifespan(local_backends):
+    import main
+    from starlette.testclient import TestClient
+
+    # Without the lifespan nothing is built yet
+    outside = TestClient(main.app)
+    assert outside.get("/health/live").json() == {"status": "alive"}
+    assert outside.get("/health/ready").status_code == 503
+
+    with TestClient(main.app) as client:
+        ready = client.get("/health/ready")
+        assert ready.status_code == 200
+        assert ready.json()["warm_connections"]["metadata"] > 0
+        assert client.get("/health/live").status_code == 200
+
+    # Shutting down takes the worker out of rotation
+    assert outside.get("/health/ready").status_code == 503
+
+
+def taken(client, otp: str) -> None:
+    """Insert a job behind this worker's back, as another worker would"""
+    import main
+    from models import PrintJob
+    client.portal.call(main.storage.jobs.insert, otp, PrintJob(
+        otp=otp, filename="a.pdf", file_path="uploads/a.pdf", file_type="application/pdf", print_options={},
+        upload_time="2030-01-01T00:00:00", expires_at="2030-01-02T00:00:00",
+    ))
+
+
+def test_store_print_job_retries_and_releases_colliding_codes(client, monkeypatch):
+    import main
+    taken(client, "TAKEN1")
+    taken(client, "TAKEN2")
+    drawn = iter(["TAKEN2", "FRESH1"])
+    monkeypatch.setattr(main, "generate_otp", lambda: next(drawn))
+    main.storage.otps.mark_active("TAKEN1")
+    main.storage.otps.mark_active("TAKEN2")
+
+    otp = client.portal.call(main.store_print_job, "TAKEN1", "a.pdf", "uploads/a.pdf", "application/pdf", {})
+    assert otp == "FRESH1"
+    assert main.storage.otps.is_active("FRESH1")
+    assert not main.storage.otps.is_active("TAKEN1")
+    assert not main.storage.otps.is_active("TAKEN2")
+
+
+def test_store_print_job_releases_codes_it_drew_when_it_fails(client, monkeypatch):
+    import main
+    taken(client, "TAKEN1")
+    monkeypatch.setattr(main, "generate_otp", lambda: "FRESH2")
+    main.storage.otps.mark_active("FRESH2")
+    insert = main.storage.jobs.insert
+
+    async def database_goes_down(otp, job):
+        if otp == "FRESH2":
+            raise ConnectionError("database is down")
+        return await insert(otp, job)
+
+    monkeypatch.setattr(main.storage.jobs, "insert", database_goes_down)
+    with pytest.raises(ConnectionError):
+        client.portal.call(main.store_print_job, "TAKEN1", "a.pdf", "uploads/a.pdf", "application/pdf", {})
+    assert not main.storage.otps.is_active("FRESH2")
+
+
+PDF = b"%PDF-1.4\n" + b"0" * 1000
+
+
+def test_direct_upload_finalizes_once_under_the_otp_it_got(client):
+    init = client.post("/api/upload/init", json={
+        "filename": "a.pdf", "contentType": "application/pdf", "size": len(PDF), "printOptions": {"copies": "1"},
+    }).json()
+    upload = init["upload"]
+    assert client.request(upload["method"], upload["url"], content=PDF, headers=upload["headers"]).status_code == 200
+
+    # Another worker stores a job under the granted code before we finalize
+    taken(client, init["otp"])
+    first = client.post("/api/upload/finalize", json={"finalizeToken": init["finalizeToken"]}).json()
+    assert first["otp"] != init["otp"]
+    again = client.post("/api/upload/finalize", json={"finalizeToken": init["finalizeToken"]}).json()
+    assert again["otp"] == first["otp"]
+    import main
+    assert client.portal.call(main.storage.jobs.count) == 2
+
+
+def test_concurrent_resumable_finalizes_create_one_job(client):
+    import main
+
+    async def upload_and_finalize_thrice():
+        upload_id = main.resumable_uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+
+        async def body():
+            yield PDF
+
+        await main.resumable_uploads.append(upload_id, 0, body())
+        return await asyncio.gather(*(main.finalize_resumable_upload(upload_id) for _ in range(3)))
+
+    results = client.portal.call(upload_and_finalize_thrice)
+    assert len({result["otp"] for result in results}) == 1
+    assert client.portal.call(main.storage.jobs.count) == 1
@@ -0,0 +1,136 @@
+import asyncio
+import io
+import os
+import pytest
+from email.utils import formatdate
+from blob_store import BlobExistsError, LocalBlobStore, _conditional_range, _parse_range
+
+ETAG = '"abc"'
+MTIME = 1735689600.0  # 2025-01-01 00:00:00 GMT
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=10-", (10, 99)),
+    ("bytes=-10", (90, 99)),
+    ("bytes=-500", (0, 99)),
+    ("bytes=90-1000", (90, 99)),
+    (" bytes = 5-5", (5, 5)),
+])
+def test_parse_range(header, expected):
+    assert _parse_range(header, 100) == expected
+
+
+@pytest.mark.parametrize("header", ["bytes=100-", "bytes=-0"])
+def test_parse_range_unsatisfiable(header):
+    assert _parse_range(header, 100) is None
+
+
+@pytest.mark.parametrize("header", ["items=0-9", "bytes=0-9,20-29", "bytes=9-0", "bytes=a-b"])
+def test_parse_range_malformed(header):
+    with pytest.raises(ValueError):
+        _parse_range(header, 100)
+
+
+def test_conditional_range_whole_file():
+    status, headers, start, end = _conditional_range(100, ETAG, MTIME, None)
+    assert (status, start, end) == (200, 0, 99)
+    assert headers["content-length"] == "100"
+    assert headers["etag"] == ETAG
+    assert headers["accept-ranges"] == "bytes"
+
+
+def test_conditional_range_partial():
+    status, headers, start, end = _conditional_range(100, ETAG, MTIME, {"range": "bytes=10-19"})
+    assert (status, start, end) == (206, 10, 19)
+    assert headers["content-range"] == "bytes 10-19/100"
+    assert headers["content-length"] == "10"
+
+
+def test_conditional_range_unsatisfiable():
+    status, headers, start, end = _conditional_range(100, ETAG, MTIME, {"range": "bytes=200-"})
+    assert status == 416
+    assert headers["content-range"] == "bytes */100"
+    assert end < start
+
+
+def test_conditional_range_malformed_range_sends_whole_file():
+    status, _, start, end = _conditional_range(100, ETAG, MTIME, {"range": "bytes=0-1,5-6"})
+    assert (status, start, end) == (200, 0, 99)
+
+
+@pytest.mark.parametrize("if_none_match", [ETAG, 'W/"abc"', '"other", "abc"', "*"])
+def test_conditional_range_not_modified_by_etag(if_none_match):
+    status, _, start, end = _conditional_range(100, ETAG, MTIME, {"if-none-match": if_none_match})
+    assert status == 304
+    assert end < start
+
+
+def test_conditional_range_changed_etag():
+    status, _, _, _ = _conditional_range(100, ETAG, MTIME, {"if-none-match": '"other"'})
+    assert status == 200
+
+
+def test_conditional_range_if_modified_since():
+    assert _conditional_range(100, ETAG, MTIME, {"if-modified-since": formatdate(MTIME, usegmt=True)})[0] == 304
+    assert _conditional_range(100, ETAG, MTIME, {"if-modified-since": formatdate(MTIME - 60, usegmt=True)})[0] == 200
+    assert _conditional_range(100, ETAG, MTIME, {"if-modified-since": "garbage"})[0] == 200
+
+
+def test_conditional_range_if_range():
+    assert _conditional_range(100, ETAG, MTIME, {"range": "bytes=0-9", "if-range": ETAG})[0] == 206
+    # A stale validator means the file changed: send all of it
+    assert _conditional_range(100, ETAG, MTIME, {"range": "bytes=0-9", "if-range": '"old"'})[0] == 200
+
+
+def test_local_download_survives_unlink(tmp_path):
+    data = os.urandom(300_000)
+
+    async def run():
+        store = LocalBlobStore(str(tmp_path))
+        await store.upload(io.BytesIO(data), "uploads/a.pdf", "application/pdf")
+        file_stream = await store.open("uploads/a.pdf", {"range": "bytes=100-200099"})
+        os.unlink(tmp_path / "uploads" / "a.pdf")
+        try:
+            return file_stream.status_code, b"".join([chunk async for chunk in file_stream.iter_chunks()])
+        finally:
+            await file_stream.aclose()
+
+    status, body = asyncio.run(run())
+    assert status == 206
+    assert body == data[100:200100]
+
+
+def test_local_not_modified_holds_no_descriptor(tmp_path):
+    async def run():
+        store = LocalBlobStore(str(tmp_path))
+        await store.upload(io.BytesIO(b"%PDF-1.4"), "a.pdf", "application/pdf")
+        first = await store.open("a.pdf")
+        await first.aclose()
+        return await store.open("a.pdf", {"if-none-match": first.headers["etag"]})
+
+    file_stream = asyncio.run(run())
+    assert file_stream.status_code == 304
+    assert file_stream.fd == -1
+
+
+@pytest.mark.parametrize("backend", ["local", "supabase"])
+def test_move_never_overwrites(backend, tmp_path, request):
+    store = LocalBlobStore(str(tmp_path)) if backend == "local" else request.getfixturevalue("bucket")
+
+    async def run():
+        await store.upload(io.BytesIO(b"first"), "uploads/a.pdf", "application/pdf")
+        await store.upload(io.BytesIO(b"second"), "uploads/b.pdf", "application/pdf")
+        assert await store.move("uploads/a.pdf", "released/1/uploads/a.pdf")
+        assert not await store.exists("uploads/a.pdf")
+        assert await store.download("released/1/uploads/a.pdf") == b"first"
+        assert not await store.move("uploads/a.pdf", "released/2/uploads/a.pdf")
+        with pytest.raises(BlobExistsError):
+            await store.move("released/1/uploads/a.pdf", "uploads/b.pdf")
+        assert await store.download("uploads/b.pdf") == b"second"
+
+    asyncio.run(run())
+
+
+def test_bucket_warm_up_probes_the_bucket(bucket):
+    assert asyncio.run(bucket.warm_up(4)) == 4
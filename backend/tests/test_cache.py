@@ -0,0 +1,145 @@
+import os
+import pytest
+import cache
+from cache import DiskCache, TTLCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_ttl_cache_get_set_and_expiry(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    jobs = TTLCache(max_entries=4, ttl=30)
+    jobs.set("A", 1)
+    assert jobs.get("A") == 1
+    clock.now += 31
+    assert jobs.get("A") is None
+    assert len(jobs) == 0
+    assert jobs.stats()["hits"] == 1
+    assert jobs.stats()["misses"] == 1
+
+
+def test_ttl_cache_expires_in_only_shortens(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    jobs = TTLCache(max_entries=4, ttl=30)
+    jobs.set("short", 1, expires_in=5)
+    jobs.set("long", 2, expires_in=600)
+    jobs.set("gone", 3, expires_in=-1)
+    clock.now += 10
+    assert jobs.get("short") is None
+    assert jobs.get("long") == 2
+    assert jobs.peek("gone") is None
+    clock.now += 30
+    assert jobs.get("long") is None
+
+
+def test_ttl_cache_evicts_least_recently_used():
+    jobs = TTLCache(max_entries=2, ttl=30)
+    jobs.set("A", 1)
+    jobs.set("B", 2)
+    jobs.get("A")
+    jobs.set("C", 3)
+    assert jobs.peek("B") is None
+    assert jobs.peek("A") == 1
+    assert jobs.stats()["evictions"] == 1
+
+
+def test_ttl_cache_disabled_with_no_entries():
+    jobs = TTLCache(max_entries=0, ttl=30)
+    jobs.set("A", 1)
+    assert jobs.get("A") is None
+
+
+def test_ttl_cache_peek_leaves_counters_alone():
+    jobs = TTLCache(max_entries=2, ttl=30)
+    jobs.set("A", 1)
+    assert jobs.peek("A") == 1
+    jobs.invalidate("A")
+    assert jobs.peek("A") is None
+    assert jobs.stats()["hits"] == jobs.stats()["misses"] == 0
+
+
+def test_disk_cache_put_get_invalidate(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=1000)
+    files.put("a", b"x" * 100)
+    assert files.get("a") == b"x" * 100
+    assert files.path("a") == os.path.join(str(tmp_path), "a")
+    files.invalidate("a")
+    assert files.get("a") is None
+    assert files.size == 0
+
+
+def test_disk_cache_evicts_to_its_budget(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=250)
+    files.put("a", b"x" * 100)
+    files.put("b", b"x" * 100)
+    files.get("a")
+    files.put("c", b"x" * 100)
+    assert files.get("b") is None
+    assert files.get("a") is not None
+    assert files.size <= 250
+    assert sorted(os.listdir(tmp_path)) == ["a", "c"]
+
+
+def test_disk_cache_skips_files_over_budget(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=10)
+    files.put("a", b"x" * 100)
+    assert files.get("a") is None
+    source = files.temp_path()
+    with open(source, "wb") as f:
+        f.write(b"x" * 100)
+    assert not files.put_file("b", source)
+    assert not os.path.exists(source)
+
+
+def test_disk_cache_put_file(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=1000)
+    source = files.temp_path()
+    with open(source, "wb") as f:
+        f.write(b"y" * 10)
+    assert files.put_file("k", source)
+    assert files.get("k") == b"y" * 10
+
+
+def test_disk_cache_rebuilds_index_on_restart(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=1000)
+    files.put("old", b"x" * 100)
+    files.put("new", b"x" * 100)
+    os.utime(tmp_path / "old", (1, 1))
+    stale = tmp_path / "abandoned.tmp"
+    stale.write_bytes(b"partial")
+    os.utime(stale, (1, 1))
+
+    restarted = DiskCache(str(tmp_path), max_bytes=150)
+    # Oldest first: only the most recently used entry fits the new budget
+    assert sorted(os.listdir(tmp_path)) == ["new"]
+    assert restarted.size == 100
+
+
+def test_disk_cache_notices_files_removed_elsewhere(tmp_path):
+    files = DiskCache(str(tmp_path), max_bytes=1000)
+    files.put("a", b"x" * 100)
+    os.unlink(tmp_path / "a")
+    assert files.path("a") is None
+    assert files.size == 0
+
+
+@pytest.mark.parametrize("key", ["../escape", "", ".hidden", "UPPER"])
+def test_disk_cache_rejects_unsafe_keys(tmp_path, key):
+    files = DiskCache(str(tmp_path), max_bytes=1000)
+    with pytest.raises(ValueError):
+        files.put(key, b"x")
+
+
+def test_disk_cache_worker_share(monkeypatch):
+    monkeypatch.setattr(cache.settings, "WEB_CONCURRENCY", 0)
+    assert DiskCache.worker_share(1000) == 1000
+    monkeypatch.setattr(cache.settings, "WEB_CONCURRENCY", 4)
+    assert DiskCache.worker_share(1000) == 250
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import cleanup
+from blob_store import MANIFEST_SUFFIX
+from config import settings
+from models import PrintJob
+
+LONG_AGO = time.time() - 86400
+
+
+def job(otp: str, file_path: str, expires_at: datetime) -> PrintJob:
+    return PrintJob(
+        otp=otp, filename="a.pdf", file_path=file_path, file_type="application/pdf", print_options={},
+        upload_time=(datetime.now() - timedelta(days=1)).isoformat(), expires_at=expires_at.isoformat(),
+    )
+
+
+def test_expired_jobs_are_removed_page_by_page(storage, tmp_path):
+    checkpoint = str(tmp_path / "checkpoint.json")
+    past, future = datetime.now() - timedelta(minutes=1), datetime.now() + timedelta(hours=1)
+
+    async def scenario():
+        for index in range(5):
+            await storage.set(f"OLD00{index}", job(f"OLD00{index}", f"uploads/{index}.pdf", past))
+        await storage.set("NEW001", job("NEW001", "uploads/new.pdf", future))
+
+        expire_jobs = storage.expire_jobs
+        calls = []
+
+        async def fail_second_page(otps):
+            calls.append(otps)
+            if len(calls) == 2:
+                raise ConnectionError("database is down")
+            return await expire_jobs(otps)
+
+        storage.expire_jobs = fail_second_page
+        assert await cleanup.cleanup_expired_jobs(storage, batch_size=2, concurrency=1,
+                                                  checkpoint_path=checkpoint) == 3
+        # The checkpoint stops before the failed page
+        with open(checkpoint) as f:
+            assert tuple(json.load(f)["after"])[1] == calls[0][-1]
+
+        storage.expire_jobs = expire_jobs
+        assert await cleanup.cleanup_expired_jobs(storage, batch_size=2, concurrency=1,
+                                                  checkpoint_path=checkpoint, resume=True) == 2
+        assert not os.path.exists(checkpoint)
+        assert await storage.jobs.count() == 1
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_removes_orphans_and_abandoned_parts(storage, bucket, monkeypatch):
+    monkeypatch.setattr(settings, "MULTIPART_THRESHOLD", 1000)
+    monkeypatch.setattr(settings, "MULTIPART_PART_SIZE", 1000)
+    storage.blobs = bucket
+    fake = bucket.fake
+    future = datetime.now() + timedelta(hours=1)
+
+    async def scenario():
+        with tempfile.TemporaryFile() as upload:
+            upload.write(b"%PDF" + b"0" * 2500)
+            committed = await bucket.upload(upload, "uploads/big.pdf" + MANIFEST_SUFFIX, "application/pdf")
+        assert committed.endswith(MANIFEST_SUFFIX)
+        await storage.set("KEEP01", job("KEEP01", committed, future))
+        await storage.set("GONE01", job("GONE01", "uploads/missing.pdf", future))
+        fake.put("uploads/orphan.pdf", b"%PDF")
+        # A retry left its first attempt behind next to the committed parts,
+        # and another transfer died before writing its manifest
+        fake.put("uploads/big.pdf.parts/0123abcd/00000", b"0" * 1000)
+        fake.put("uploads/lost.pdf.parts/4567cdef/00000", b"0" * 1000)
+        fake.put("uploads/lost.pdf.parts/4567cdef/00001", b"0" * 1000)
+        for name, (data, _) in list(fake.objects.items()):
+            fake.put(name, data, LONG_AGO)
+        # Still being uploaded
+        fake.put("uploads/busy.pdf.parts/89abef01/00000", b"0" * 1000)
+
+        result = await cleanup.reconcile_orphans(storage, batch_size=2, concurrency=2)
+        assert result == {"orphan_blobs": 1, "orphan_part_sets": 2, "failed_blob_batches": 0,
+                          "jobs_missing_blobs": 1}
+
+        remaining = sorted(fake.objects)
+        assert "uploads/orphan.pdf" not in remaining
+        assert not any(name.startswith(("uploads/lost.pdf.parts/", "uploads/big.pdf.parts/0123abcd/"))
+                       for name in remaining)
+        assert "uploads/busy.pdf.parts/89abef01/00000" in remaining
+        assert await storage.get("GONE01") is None
+        assert await bucket.download(committed) == b"%PDF" + b"0" * 2500
+
+    asyncio.run(scenario())
@@ -0,0 +1,141 @@
+import asyncio
+import io
+import os
+import pytest
+import codec
+from blob_store import FileStream
+from codec import CODECS, DecodedFileStream, GzipCodec, ZstdCodec, codec_for_path, decode_bytes
+
+DATA = b"%PDF-1.4\n" + b"stream of fairly repetitive text " * 20_000 + os.urandom(1000)
+
+
+class BytesStream(FileStream):
+    """A stored blob served in fixed-size chunks"""
+
+    def __init__(self, data: bytes, status_code: int = 200, chunk_size: int = 4096):
+        self.data = data
+        self.status_code = status_code
+        self.chunk_size = chunk_size
+        self.headers = {"etag": '"abc"', "last-modified": "Wed, 01 Jan 2025 00:00:00 GMT",
+                        "content-length": str(len(data)), "accept-ranges": "bytes"}
+        self.closed = False
+
+    async def iter_chunks(self):
+        for start in range(0, len(self.data), self.chunk_size):
+            yield self.data[start:start + self.chunk_size]
+
+    async def aclose(self):
+        self.closed = True
+
+
+def compressed(blob_codec) -> bytes:
+    target = io.BytesIO()
+    blob_codec.compress(io.BytesIO(DATA), target, len(DATA))
+    return target.getvalue()
+
+
+codecs = pytest.mark.parametrize("blob_codec", CODECS.values(), ids=lambda blob_codec: blob_codec.name)
+
+
+@codecs
+def test_round_trip(blob_codec):
+    stored = compressed(blob_codec)
+    assert len(stored) < len(DATA)
+    assert decode_bytes(blob_codec, stored) == DATA
+
+
+def decode(blob_codec, request_headers=None, stored=None):
+    """Open the stored blob through DecodedFileStream and read the body"""
+    stored = compressed(blob_codec) if stored is None else stored
+    inner = BytesStream(stored)
+
+    async def read_tail(length: int) -> bytes:
+        return stored[-length:]
+
+    async def run():
+        stream = await DecodedFileStream.open(inner, blob_codec, request_headers, read_tail)
+        return stream, b"".join([chunk async for chunk in stream.iter_chunks()])
+
+    stream, body = asyncio.run(run())
+    assert inner.closed
+    return stream, body
+
+
+@codecs
+def test_decoded_stream(blob_codec):
+    stream, body = decode(blob_codec)
+    assert body == DATA
+    assert stream.status_code == 200
+    assert stream.headers["etag"] == '"abc"'
+    assert stream.headers["accept-ranges"] == "bytes"
+    assert stream.headers["content-length"] == str(len(DATA))
+
+
+@codecs
+@pytest.mark.parametrize("byte_range,start,end", [
+    ("bytes=0-99", 0, 99),
+    ("bytes=5000-70000", 5000, 70000),
+    ("bytes=-1000", len(DATA) - 1000, len(DATA) - 1),
+    (f"bytes={len(DATA) - 10}-", len(DATA) - 10, len(DATA) - 1),
+])
+def test_decoded_stream_range(blob_codec, byte_range, start, end):
+    stream, body = decode(blob_codec, {"range": byte_range})
+    assert stream.status_code == 206
+    assert body == DATA[start:end + 1]
+    assert stream.headers["content-range"] == f"bytes {start}-{end}/{len(DATA)}"
+    assert stream.headers["content-length"] == str(end - start + 1)
+
+
+@codecs
+def test_decoded_stream_range_conditions(blob_codec):
+    stream, body = decode(blob_codec, {"range": f"bytes={len(DATA)}-"})
+    assert stream.status_code == 416
+    assert stream.headers["content-range"] == f"bytes */{len(DATA)}"
+    assert body == b""
+
+    # A stale If-Range gets the whole file
+    stream, body = decode(blob_codec, {"range": "bytes=0-99", "if-range": '"old"'})
+    assert stream.status_code == 200
+    assert body == DATA
+    stream, body = decode(blob_codec, {"range": "bytes=0-99", "if-range": '"abc"'})
+    assert stream.status_code == 206
+    assert body == DATA[:100]
+
+
+def test_decoded_stream_without_a_size_sends_everything():
+    # A truncated gzip trailer leaves the size unknown
+    stream, body = decode(CODECS[GzipCodec.suffix], {"range": "bytes=0-99"}, stored=b"")
+    assert stream.status_code == 200
+    assert stream.headers["accept-ranges"] == "none"
+    assert body == b""
+
+
+def test_decoded_stream_not_modified():
+    inner = BytesStream(b"", status_code=304)
+
+    async def run():
+        stream = await DecodedFileStream.open(inner, CODECS[GzipCodec.suffix])
+        return stream, [chunk async for chunk in stream.iter_chunks()]
+
+    stream, chunks = asyncio.run(run())
+    assert stream.status_code == 304
+    assert chunks == []
+
+
+def test_codec_for_path():
+    assert codec_for_path("uploads/a.pdf") is None
+    assert codec_for_path("uploads/a.pdf.gz") is CODECS[GzipCodec.suffix]
+    assert codec_for_path("uploads/a.pdf.zst") is CODECS[ZstdCodec.suffix]
+    assert codec_for_path("uploads/a.pdf.zst.manifest.json") is CODECS[ZstdCodec.suffix]
+
+
+def test_active_codec(monkeypatch):
+    monkeypatch.setattr(codec.settings, "BLOB_CODEC", "none")
+    assert codec.active_codec() is None
+    monkeypatch.setattr(codec.settings, "BLOB_CODEC", "gzip")
+    assert codec.active_codec() is CODECS[GzipCodec.suffix]
+    monkeypatch.setattr(codec.settings, "BLOB_CODEC", "zstd")
+    monkeypatch.setattr(codec, "zstandard", None)
+    assert codec.active_codec() is CODECS[GzipCodec.suffix]
+    with pytest.raises(RuntimeError):
+        codec_for_path("uploads/a.pdf.zst")
@@ -0,0 +1,89 @@
+import asyncio
+import io
+import pypdfium2 as pdfium
+from PIL import Image
+import conversion
+from config import settings
+from conversion import PAPER_SIZES, rendered_blob_name, render_image
+from models import PrintJob
+
+
+def tiff(path, pages: int) -> None:
+    frames = [Image.new("RGB", (400, 300), (60 * index, 120, 200)) for index in range(pages)]
+    frames[0].save(path, "TIFF", save_all=True, append_images=frames[1:])
+
+
+def pdf_pages(path) -> list:
+    document = pdfium.PdfDocument(str(path))
+    try:
+        return [document[index].get_size() for index in range(len(document))]
+    finally:
+        document.close()
+
+
+def closed(image) -> bool:
+    try:
+        image.getpixel((0, 0))
+        return False
+    except ValueError:  # operation on closed image
+        return True
+
+
+def test_rendered_blob_name_follows_the_rendering_options():
+    options = {"colorMode": "bw", "paperSize": "a4", "imageSize": "fit", "copies": "1"}
+    name = rendered_blob_name("sha256/abc", options)
+    assert name.startswith("sha256/abc.print/") and name.endswith(".pdf")
+    assert rendered_blob_name("sha256/abc", {**options, "copies": "3"}) == name
+    assert rendered_blob_name("sha256/abc", {**options, "colorMode": "color"}) != name
+    assert rendered_blob_name("sha256/abc.manifest.json", options) == name
+
+
+def test_every_tiff_page_is_rendered_one_at_a_time(tmp_path, monkeypatch):
+    source, target = tmp_path / "scan.tiff", tmp_path / "print.pdf"
+    tiff(source, 4)
+    rendered = []
+    render_page = conversion._render_page
+
+    def track(image, print_options, dpi):
+        # The previous page was written out and released before this one
+        assert all(closed(page) for page in rendered)
+        rendered.append(render_page(image, print_options, dpi))
+        return rendered[-1]
+
+    monkeypatch.setattr(conversion, "_render_page", track)
+    render_image(str(source), str(target), {"paperSize": "letter", "colorMode": "bw"}, 72)
+
+    pages = pdf_pages(target)
+    assert len(pages) == 4
+    # Landscape scans get a landscape page
+    assert pages[0] == (PAPER_SIZES["letter"][1], PAPER_SIZES["letter"][0])
+
+
+def test_conversion_timeout_recycles_the_pool(storage, monkeypatch):
+    image = io.BytesIO()
+    Image.new("RGB", (400, 300), "red").save(image, "PNG")
+    service = storage.conversions
+
+    async def scenario():
+        file_path = await storage.upload_file(image, "uploads/photo.png", "image/png")
+        job = PrintJob(otp="IMG001", filename="photo.png", file_path=file_path, file_type="image/png",
+                       print_options={"paperSize": "a4"}, upload_time="2030-01-01T00:00:00",
+                       expires_at="2099-01-01T00:00:00", print_status="queued")
+        await storage.set(job.otp, job)
+
+        # Far shorter than starting a worker takes
+        monkeypatch.setattr(settings, "CONVERSION_TIMEOUT", 0.001)
+        await service._convert(job)
+        assert (await storage.get(job.otp)).print_status == "failed"
+        assert service._pool is None
+
+        monkeypatch.setattr(settings, "CONVERSION_TIMEOUT", 60)
+        await service._convert(job)
+        converted = await storage.get(job.otp)
+        assert converted.print_status == "ready"
+        assert await storage.blobs.exists(converted.print_file_path)
+        await service.aclose()
+
+    asyncio.run(scenario())
+    assert service.stats()["failed"] == 1
+    assert service.stats()["converted"] == 1
@@ -0,0 +1,105 @@
+import asyncio
+import io
+import time
+from datetime import datetime, timedelta
+from expiry import ExpiryScheduler
+from models import PrintJob
+
+PAST = "2020-01-01T00:00:00"
+FUTURE = "2099-01-01T00:00:00"
+
+
+class FakeStorage:
+    """Records the batches the scheduler asks to expire"""
+
+    def __init__(self, fail: bool = False):
+        self.batches = []
+        self.fail = fail
+
+    async def expire_jobs(self, otps):
+        if self.fail:
+            raise ConnectionError("database is down")
+        self.batches.append(sorted(otps))
+        return len(otps)
+
+
+def test_sweeps_due_jobs_in_batches():
+    fake = FakeStorage()
+    scheduler = ExpiryScheduler(fake, batch_size=2, concurrency=2)
+    for otp in ("A00001", "A00002", "A00003"):
+        scheduler.schedule(otp, PAST)
+    scheduler.schedule("LATER1", FUTURE)
+
+    assert asyncio.run(scheduler.sweep()) == 3
+    assert sorted(otp for batch in fake.batches for otp in batch) == ["A00001", "A00002", "A00003"]
+    assert max(len(batch) for batch in fake.batches) == 2
+    assert scheduler.stats()["scheduled"] == 1
+    assert scheduler.stats()["next_due_in"] > 0
+
+
+def test_a_job_scheduled_twice_is_expired_once():
+    fake = FakeStorage()
+    scheduler = ExpiryScheduler(fake)
+    scheduler.schedule("A00001", PAST)
+    scheduler.schedule("A00001", PAST)  # seen again by a rescan
+    assert scheduler.stats()["scheduled"] == 1
+    asyncio.run(scheduler.sweep())
+    assert fake.batches == [["A00001"]]
+
+
+def test_unscheduled_jobs_are_skipped():
+    fake = FakeStorage()
+    scheduler = ExpiryScheduler(fake)
+    scheduler.schedule("A00001", PAST)
+    scheduler.schedule("A00002", PAST)
+    scheduler.unschedule("A00001")  # deleted early
+    assert scheduler.stats()["scheduled"] == 1
+    asyncio.run(scheduler.sweep())
+    assert fake.batches == [["A00002"]]
+
+
+def test_stale_entries_do_not_pile_up():
+    scheduler = ExpiryScheduler(FakeStorage())
+    for index in range(1000):
+        otp = f"J{index:05d}"
+        scheduler.schedule(otp, FUTURE)
+        scheduler.unschedule(otp)
+    assert scheduler.stats()["scheduled"] == 0
+    assert scheduler.stats()["next_due_in"] is None
+    assert len(scheduler._heap) <= 64
+
+
+def test_failed_batches_are_retried_later(monkeypatch):
+    fake = FakeStorage(fail=True)
+    scheduler = ExpiryScheduler(fake)
+    scheduler.schedule("A00001", PAST)
+    assert asyncio.run(scheduler.sweep()) == 0
+    stats = scheduler.stats()
+    assert stats["failed_batches"] == 1
+    assert stats["scheduled"] == 1
+    assert stats["next_due_in"] > 0
+
+    fake.fail = False
+    monkeypatch.setattr(time, "time", lambda real=time.time: real() + 3600)
+    assert asyncio.run(scheduler.sweep()) == 1
+
+
+def test_removes_expired_jobs_and_their_blobs(storage):
+    now = datetime.now()
+
+    async def scenario():
+        path = await storage.upload_file(io.BytesIO(b"%PDF-1.4"), "uploads/a.pdf", "application/pdf")
+        for otp, expires_at in (("OLD001", now - timedelta(seconds=1)), ("NEW001", now + timedelta(hours=1))):
+            await storage.set(otp, PrintJob(
+                otp=otp, filename="a.pdf", file_path=path, file_type="application/pdf",
+                print_options={}, upload_time=now.isoformat(), expires_at=expires_at.isoformat(),
+            ))
+        assert await storage.expiry.sweep() == 1
+        assert await storage.get("OLD001") is None
+        # The other job still uses the blob
+        assert await storage.blobs.exists(path)
+
+        await storage.delete("NEW001")
+        assert storage.expiry.stats()["scheduled"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,156 @@
+import asyncio
+import sqlite3
+import pytest
+from metadata_store import DuplicateOTPError, SQLiteMetadataStore
+from models import PrintJob
+
+
+def job(otp: str, expires_at: str = "2030-01-01T00:00:00", **fields) -> PrintJob:
+    return PrintJob(**{
+        "otp": otp,
+        "filename": f"{otp}.pdf",
+        "file_path": f"uploads/{otp}.pdf",
+        "file_type": "application/pdf",
+        "print_options": {"copies": "1", "colorMode": "bw"},
+        "upload_time": "2029-12-31T23:00:00",
+        "expires_at": expires_at,
+        **fields,
+    })
+
+
+@pytest.fixture
+def run(tmp_path):
+    """Run coroutines against one store on one event loop, closing it afterwards"""
+    loop = asyncio.new_event_loop()
+    store = SQLiteMetadataStore(str(tmp_path / "jobs.db"), readers=2)
+    yield lambda make: loop.run_until_complete(make(store))
+    loop.run_until_complete(store.aclose())
+    loop.close()
+
+
+def test_insert_get_update_delete(run):
+    async def scenario(store):
+        await store.insert("AAAAAA", job("AAAAAA"))
+        stored = await store.get("AAAAAA")
+        assert stored.filename == "AAAAAA.pdf"
+        assert stored.print_options == {"copies": "1", "colorMode": "bw"}
+        assert stored.status == "pending"
+
+        assert await store.update("AAAAAA", {"status": "completed", "completed_at": "2030-01-01T00:00:00",
+                                             "not_a_column": 1})
+        assert (await store.get("AAAAAA")).status == "completed"
+        assert not await store.update("ZZZZZZ", {"status": "completed"})
+        assert not await store.update("AAAAAA", {"not_a_column": 1})
+
+        assert await store.delete("AAAAAA")
+        assert await store.get("AAAAAA") is None
+
+    run(scenario)
+
+
+def test_duplicate_otp(run):
+    async def scenario(store):
+        await store.insert("AAAAAA", job("AAAAAA"))
+        with pytest.raises(DuplicateOTPError):
+            await store.insert("AAAAAA", job("AAAAAA"))
+
+    run(scenario)
+
+
+def test_counts_and_expiry(run):
+    async def scenario(store):
+        await store.insert("OLD001", job("OLD001", "2020-01-01T00:00:00"))
+        await store.insert("OLD002", job("OLD002", "2020-01-01T00:00:00", status="completed"))
+        await store.insert("NEW001", job("NEW001"))
+        now = "2025-01-01T00:00:00"
+
+        assert await store.count() == 3
+        assert await store.count("completed") == 1
+        assert await store.count_expired(now) == 2
+        assert sorted(await store.expired_file_paths(now)) == ["uploads/OLD001.pdf", "uploads/OLD002.pdf"]
+
+        deleted = await store.delete_expired_jobs(["OLD001", "NEW001"], now)
+        assert [deleted_job.otp for deleted_job in deleted] == ["OLD001"]
+        assert await store.delete_expired(now) == 1
+        assert await store.count() == 1
+
+    run(scenario)
+
+
+def test_list_by_expiry_pages_in_order(run):
+    async def scenario(store):
+        for index in range(5):
+            await store.insert(f"JOB00{index}", job(f"JOB00{index}", f"2030-01-0{5 - index}T00:00:00"))
+        first = await store.list_by_expiry(limit=2)
+        after = (first[-1]["expires_at"], first[-1]["otp"])
+        rest = await store.list_by_expiry(after=after, limit=10)
+        assert [row["otp"] for row in first + rest] == ["JOB004", "JOB003", "JOB002", "JOB001", "JOB000"]
+        assert [row["otp"] for row in await store.list_by_expiry(before="2030-01-03T00:00:00")] == ["JOB004", "JOB003"]
+
+    run(scenario)
+
+
+def test_existing_file_paths_include_renderings(run):
+    async def scenario(store):
+        await store.insert("DOCX01", job("DOCX01", print_file_path="prints/DOCX01.pdf"))
+        found = await store.existing_file_paths(["uploads/DOCX01.pdf", "prints/DOCX01.pdf", "uploads/gone.pdf"])
+        assert sorted(found) == ["prints/DOCX01.pdf", "uploads/DOCX01.pdf"]
+        assert await store.existing_file_paths([]) == []
+
+    run(scenario)
+
+
+def test_warm_up_opens_reader_connections(run):
+    async def scenario(store):
+        assert 1 <= await store.warm_up(4) <= 2
+
+    run(scenario)
+
+
+def test_migrates_a_database_from_the_first_schema(tmp_path):
+    path = str(tmp_path / "old.db")
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE print_jobs (
+            id TEXT PRIMARY KEY DEFAULT (lower(hex(randomblob(16)))),
+            otp TEXT UNIQUE NOT NULL,
+            filename TEXT NOT NULL,
+            file_path TEXT NOT NULL,
+            file_type TEXT NOT NULL,
+            print_options TEXT NOT NULL,
+            upload_time TEXT,
+            status TEXT DEFAULT 'pending',
+            expires_at TEXT NOT NULL,
+            completed_at TEXT,
+            created_at TEXT,
+            updated_at TEXT
+        );
+        INSERT INTO print_jobs (otp, filename, file_path, file_type, print_options, upload_time, expires_at)
+        VALUES ('OLDJOB', 'a.pdf', 'uploads/a.pdf', 'application/pdf', '{}', '2029-01-01T00:00:00', '2030-01-01T00:00:00');
+    """)
+    conn.close()
+
+    async def scenario():
+        store = SQLiteMetadataStore(path, readers=1)
+        try:
+            old = await store.get("OLDJOB")
+            assert old.print_file_path is None
+            assert await store.update("OLDJOB", {"print_file_path": "prints/a.pdf", "print_status": "ready"})
+            assert (await store.get("OLDJOB")).print_status == "ready"
+        finally:
+            await store.aclose()
+
+    asyncio.run(scenario())
+
+    # Opening it again finds nothing left to migrate
+    asyncio.run(SQLiteMetadataStore(path, readers=1).aclose())
+
+
+def test_get_by_file_path_finds_the_oldest_job(run):
+    async def scenario(store):
+        await store.insert("LATER1", job("LATER1", file_path="uploads/shared.pdf", upload_time="2030-01-01T00:00:02"))
+        await store.insert("FIRST1", job("FIRST1", file_path="uploads/shared.pdf", upload_time="2030-01-01T00:00:01"))
+        assert (await store.get_by_file_path("uploads/shared.pdf")).otp == "FIRST1"
+        assert await store.get_by_file_path("uploads/other.pdf") is None
+
+    run(scenario)
@@ -0,0 +1,65 @@
+import os
+import subprocess
+import sys
+from prometheus_client import multiprocess
+import metrics
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKER = """
+import sys
+import metrics
+metrics.HTTP_SENT_BYTES.labels("other").inc(int(sys.argv[1]))
+metrics.UPLOADS_IN_FLIGHT.inc()
+metrics.JOBS.labels("total").set(int(sys.argv[1]))
+print(__import__("os").getpid())
+"""
+
+
+def sample(body: str, line: str) -> float:
+    """The value of the sample whose name and labels start `line`"""
+    for row in body.splitlines():
+        if row.startswith(line + " "):
+            return float(row.rsplit(" ", 1)[1])
+    raise AssertionError(f"{line} not in the scrape")
+
+
+def test_scrape_reports_requests_and_state(client):
+    assert client.get("/api/admin/lookup", params={"otp": "ABC123"}).status_code == 404
+    client.get("/health")
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    body = response.text
+    lookup = 'route="/api/admin/lookup"'
+    assert sample(body, f'xeroq_http_request_duration_seconds_count{{method="GET",{lookup},status="404"}}') >= 1
+    assert sample(body, f'xeroq_http_errors_total{{class="4xx",{lookup}}}') >= 1
+    assert sample(body, 'xeroq_storage_operation_duration_seconds_count{operation="get",outcome="ok"}') >= 1
+    assert sample(body, 'xeroq_http_sent_bytes_total{route="other"}') > 0
+    assert sample(body, 'xeroq_jobs{status="total"}') == 0
+    assert 'xeroq_admission_active{pool="upload"}' in body
+
+
+def test_workers_are_added_up_from_the_shared_directory(tmp_path, monkeypatch):
+    # prometheus_client picks its multiprocess mode when first imported, so
+    # the workers are separate interpreters
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    pids = [
+        int(subprocess.run([sys.executable, "-c", WORKER, sent], cwd=BACKEND, env=env, check=True,
+                           capture_output=True, text=True).stdout)
+        for sent in ("100", "250")
+    ]
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    assert metrics.multiprocess_dir() == str(tmp_path)
+
+    body = metrics.render().decode()
+    assert sample(body, 'xeroq_http_sent_bytes_total{route="other"}') == 350
+    assert sample(body, "xeroq_uploads_in_flight") == 2
+    assert sample(body, f'xeroq_jobs{{pid="{pids[0]}",status="total"}}') == 100
+
+    # An exited worker's counters stay, its live gauges go
+    multiprocess.mark_process_dead(pids[0], str(tmp_path))
+    body = metrics.render().decode()
+    assert sample(body, 'xeroq_http_sent_bytes_total{route="other"}') == 350
+    assert sample(body, "xeroq_uploads_in_flight") == 1
+    assert f'pid="{pids[0]}"' not in body
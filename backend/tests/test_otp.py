@@ -0,0 +1,57 @@
+from otp import OTP_ALPHABET, OTP_LENGTH, OTPAllocator, decode_otp, encode_otp
+
+
+def test_encode_decode_round_trip():
+    for code in (0, 1, 35, 36, 123456789, 36 ** 6 - 1):
+        otp = encode_otp(code)
+        assert len(otp) == OTP_LENGTH
+        assert set(otp) <= set(OTP_ALPHABET)
+        assert decode_otp(otp) == code
+    assert decode_otp("abc123") == decode_otp("ABC123")
+
+
+def test_allocates_unique_active_codes():
+    allocator = OTPAllocator(pool_size=16)
+    otps = [allocator.allocate() for _ in range(100)]
+    assert len(set(otps)) == 100
+    assert all(allocator.is_active(otp) for otp in otps)
+    assert allocator.stats()["allocated_total"] == 100
+    assert allocator.stats()["refills"] >= 100 // 16
+
+
+def test_release_frees_a_code():
+    allocator = OTPAllocator(pool_size=4)
+    otp = allocator.allocate()
+    allocator.release(otp)
+    assert not allocator.is_active(otp)
+    assert allocator.stats()["active"] == 0
+
+
+def test_never_hands_out_a_code_marked_active_after_pooling():
+    allocator = OTPAllocator(pool_size=8)
+    allocator._refill()
+    pooled = [encode_otp(code) for code in allocator._pool]
+    for otp in pooled[:4]:
+        allocator.mark_active(otp)  # e.g. loaded from the database
+    handed_out = {allocator.allocate() for _ in range(4)}
+    assert handed_out.isdisjoint(pooled[:4])
+
+
+def test_reservation_lapses_unless_claimed():
+    allocator = OTPAllocator(pool_size=4)
+    lapsed = allocator.reserve(ttl=0)
+    claimed = allocator.reserve(ttl=0)
+    # The second reservation released the first, which had already lapsed
+    assert not allocator.is_active(lapsed)
+    allocator.mark_active(claimed)
+    allocator.reserve(ttl=60)
+    assert allocator.is_active(claimed)
+    assert allocator.stats()["reserved"] == 1
+
+
+def test_ignores_foreign_codes():
+    allocator = OTPAllocator(pool_size=4)
+    allocator.mark_active("not-an-otp")
+    allocator.release("??????")
+    assert not allocator.is_active("!!!!!!")
+    assert allocator.stats()["active"] == 0
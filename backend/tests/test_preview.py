@@ -0,0 +1,81 @@
+import asyncio
+import io
+import zipfile
+from PIL import Image
+from config import settings
+from models import PrintJob
+from preview import render_preview
+
+
+def job(otp: str, file_path: str, file_type: str, **fields) -> PrintJob:
+    return PrintJob(otp=otp, filename="a", file_path=file_path, file_type=file_type, print_options={},
+                    upload_time="2030-01-01T00:00:00", expires_at="2099-01-01T00:00:00", **fields)
+
+
+def test_image_preview_is_a_small_jpeg(tmp_path):
+    source = tmp_path / "scan.tiff"
+    frames = [Image.new("RGBA", (2000, 1000), (255, 0, 0, 128)) for _ in range(3)]
+    frames[0].save(source, "TIFF", save_all=True, append_images=frames[1:])
+
+    image, pages = render_preview(str(source), "image", 200, 70)
+    assert pages == 3
+    with Image.open(io.BytesIO(image)) as thumbnail:
+        assert thumbnail.format == "JPEG"
+        assert thumbnail.size == (200, 100)
+
+
+def test_pdf_preview_counts_pages(tmp_path):
+    source = tmp_path / "doc.pdf"
+    pages = [Image.new("RGB", (595, 842), "white") for _ in range(2)]
+    pages[0].save(source, "PDF", save_all=True, append_images=pages[1:])
+
+    image, count = render_preview(str(source), "pdf", 100, 70)
+    assert count == 2
+    with Image.open(io.BytesIO(image)) as thumbnail:
+        assert max(thumbnail.size) == 100
+
+
+def test_docx_preview_reads_the_page_count(tmp_path):
+    source = tmp_path / "doc.docx"
+    with zipfile.ZipFile(source, "w") as archive:
+        archive.writestr("docProps/app.xml", "<Properties><Pages>12</Pages></Properties>")
+    assert render_preview(str(source), "docx", 100, 70) == (None, 12)
+
+    with zipfile.ZipFile(source, "w") as archive:
+        archive.writestr("word/document.xml", "<document/>")
+    assert render_preview(str(source), "docx", 100, 70) == (None, None)
+
+
+def test_previews_are_cached_and_a_timeout_recycles_the_pool(storage, monkeypatch):
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", True)
+    upload = io.BytesIO()
+    Image.new("RGB", (800, 600), "blue").save(upload, "PNG")
+    service = storage.previews
+
+    async def scenario():
+        file_path = await storage.upload_file(upload, "uploads/photo.png", "image/png")
+        photo = job("IMG001", file_path, "image/png")
+        assert service.cached_info(photo) is None  # starts rendering it
+
+        monkeypatch.setattr(settings, "PREVIEW_TIMEOUT", 0.001)
+        assert await service.get(photo) is None
+        assert service._pool is None
+
+        monkeypatch.setattr(settings, "PREVIEW_TIMEOUT", 60)
+        image, info = await service.get(photo)
+        assert info == {"pages": 1, "has_image": True, "bytes": len(image)}
+        assert service.cached_info(photo) == info
+        rendered = service.stats()["rendered"]
+        assert (await service.get(photo))[0] == image
+        assert service.stats()["rendered"] == rendered
+        await service.aclose()
+
+    asyncio.run(scenario())
+
+
+def test_docx_jobs_are_previewed_from_their_rendering(storage, monkeypatch):
+    monkeypatch.setattr(settings, "PREVIEW_ENABLED", True)
+    docx = job("DOC001", "sha256/doc", "application/vnd.openxmlformats-officedocument.wordprocessingml.document")
+    assert storage.previews._source(docx) == ("sha256/doc", "docx")
+    ready = job("DOC001", "sha256/doc", docx.file_type, print_status="ready", print_file_path="sha256/doc.print/k.pdf")
+    assert storage.previews._source(ready) == ("sha256/doc.print/k.pdf", "pdf")
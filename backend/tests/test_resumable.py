@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import hashlib
+import os
+import time
+import pytest
+from resumable import ResumableUploads, parse_upload_metadata
+from upload_stream import UploadRejected
+
+PDF = b"%PDF-1.4\n" + b"0" * 4000
+
+
+def append(uploads: ResumableUploads, upload_id: str, offset: int, *chunks: bytes) -> int:
+    async def body():
+        for chunk in chunks:
+            yield chunk
+
+    return asyncio.run(uploads.append(upload_id, offset, body()))
+
+
+@pytest.fixture
+def uploads(tmp_path):
+    return ResumableUploads(str(tmp_path))
+
+
+def test_parse_upload_metadata():
+    header = f"filename {base64.b64encode(b'report.pdf').decode()}, empty,"
+    assert parse_upload_metadata(header) == {"filename": "report.pdf", "empty": ""}
+    with pytest.raises(UploadRejected):
+        parse_upload_metadata("filename //4=")  # not UTF-8
+
+
+def test_create_validates_declared_upload(uploads):
+    with pytest.raises(UploadRejected) as rejected:
+        uploads.create(10, "a.exe", "application/x-msdownload", {})
+    assert rejected.value.status_code == 400
+    with pytest.raises(UploadRejected) as rejected:
+        uploads.create(10 ** 12, "a.pdf", "application/pdf", {})
+    assert rejected.value.status_code == 413
+    with pytest.raises(UploadRejected):
+        uploads.create(0, "a.pdf", "application/pdf", {})
+
+
+def test_chunks_advance_the_offset(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {"copies": "2"})
+    assert uploads.info(upload_id)["offset"] == 0
+    assert append(uploads, upload_id, 0, PDF[:1000], PDF[1000:1500]) == 1500
+    assert uploads.info(upload_id)["offset"] == 1500
+    assert append(uploads, upload_id, 1500, PDF[1500:]) == len(PDF)
+
+    with uploads.open_completed(upload_id) as staged:
+        assert uploads.digest(staged) == hashlib.sha256(PDF).hexdigest()
+        assert staged.read() == PDF
+
+
+def test_rejects_a_wrong_offset(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    append(uploads, upload_id, 0, PDF[:100])
+    with pytest.raises(UploadRejected) as rejected:
+        append(uploads, upload_id, 50, PDF[50:200])
+    assert rejected.value.status_code == 409
+    assert uploads.info(upload_id)["offset"] == 100
+
+
+def test_rejects_bytes_past_the_declared_length(uploads):
+    upload_id = uploads.create(100, "a.pdf", "application/pdf", {})
+    with pytest.raises(UploadRejected) as rejected:
+        append(uploads, upload_id, 0, PDF[:60], PDF[60:120])
+    assert rejected.value.status_code == 413
+    # The chunk that fit is kept for the client to resume from
+    assert uploads.info(upload_id)["offset"] == 60
+
+
+def test_deletes_an_upload_whose_content_does_not_match(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    with pytest.raises(UploadRejected) as rejected:
+        append(uploads, upload_id, 0, b"MZ" + b"0" * 100)
+    assert rejected.value.status_code == 400
+    assert uploads.info(upload_id) is None
+
+
+def test_incomplete_upload_cannot_be_finalized(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    append(uploads, upload_id, 0, PDF[:100])
+    with pytest.raises(UploadRejected) as rejected:
+        uploads.open_completed(upload_id)
+    assert rejected.value.status_code == 409
+
+
+def test_patch_after_finalize_is_rejected(uploads, tmp_path):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    append(uploads, upload_id, 0, PDF)
+    uploads.mark_finalized(upload_id, "ABC123")
+
+    info = uploads.info(upload_id)
+    assert info["otp"] == "ABC123"
+    assert info["offset"] == len(PDF)
+    for offset in (0, len(PDF)):
+        with pytest.raises(UploadRejected) as rejected:
+            append(uploads, upload_id, offset, b"0")
+        assert rejected.value.status_code == 409
+    assert not os.path.exists(tmp_path / f"{upload_id}.part")
+
+
+def test_patch_after_purge_does_not_recreate_the_part_file(uploads, tmp_path):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    os.unlink(tmp_path / f"{upload_id}.part")
+    with pytest.raises(UploadRejected):
+        append(uploads, upload_id, 0, PDF[:100])
+    assert not os.path.exists(tmp_path / f"{upload_id}.part")
+
+
+@pytest.mark.parametrize("upload_id", ["../../etc/passwd", "A" * 32, "abc"])
+def test_unknown_ids(uploads, upload_id):
+    assert uploads.info(upload_id) is None
+    with pytest.raises(KeyError):
+        append(uploads, upload_id, 0, b"")
+
+
+def test_purge_stale_counts_from_the_last_chunk(uploads, tmp_path):
+    idle = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    busy = uploads.create(len(PDF), "b.pdf", "application/pdf", {})
+    long_ago = time.time() - 3600
+    for upload_id in (idle, busy):
+        meta = uploads.info(upload_id)
+        meta["created_at"] = long_ago
+        del meta["offset"]
+        uploads._write_meta(upload_id, meta)
+    os.utime(tmp_path / f"{idle}.part", (long_ago, long_ago))
+    append(uploads, busy, 0, PDF[:100])
+
+    assert uploads.purge_stale(max_age=60) == 1
+    assert uploads.info(idle) is None
+    assert uploads.info(busy)["offset"] == 100
+
+
+def test_finalizing_is_serialized(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    append(uploads, upload_id, 0, PDF)
+    created = []
+
+    async def finalize():
+        async with uploads.finalizing(upload_id) as info:
+            if info.get("otp"):
+                return info["otp"]
+            await asyncio.sleep(0.1)  # storing the blob and the job
+            otp = f"JOB00{len(created)}"
+            created.append(otp)
+            uploads.mark_finalized(upload_id, otp)
+            return otp
+
+    async def run():
+        return await asyncio.gather(finalize(), finalize(), finalize())
+
+    assert asyncio.run(run()) == ["JOB000"] * 3
+    assert created == ["JOB000"]
+
+
+def test_patch_is_turned_away_while_finalizing(uploads):
+    upload_id = uploads.create(len(PDF), "a.pdf", "application/pdf", {})
+    append(uploads, upload_id, 0, PDF[:100])
+
+    async def run():
+        async with uploads.finalizing(upload_id):
+            async def body():
+                yield PDF[100:]
+
+            with pytest.raises(UploadRejected) as rejected:
+                await uploads.append(upload_id, 100, body())
+            assert rejected.value.status_code == 409
+
+    asyncio.run(run())
+
+
+def test_finalizing_an_unknown_upload(uploads):
+    async def run(upload_id):
+        async with uploads.finalizing(upload_id) as info:
+            return info
+
+    assert asyncio.run(run("../../etc/passwd")) is None
+    assert asyncio.run(run("a" * 32)) is None
@@ -0,0 +1,89 @@
+import asyncio
+import os
+import runpy
+import signal
+from uvicorn.workers import UvicornWorker
+import server
+from config import settings
+from server import XeroQWorker
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def worker(timeout: float = 1) -> XeroQWorker:
+    """A worker as gunicorn would hand it over, with notify() recorded instead of touching its tmp file"""
+    instance = XeroQWorker.__new__(XeroQWorker)
+    instance.recycling = False
+    instance.timeout = timeout
+    instance.beats = 0
+
+    def notify():
+        instance.beats += 1
+
+    instance.notify = notify
+    return instance
+
+
+def test_worker_recycles_itself_once_over_the_memory_limit(monkeypatch):
+    signals = []
+    monkeypatch.setattr(server.os, "kill", lambda pid, sig: signals.append((pid, sig)))
+    monkeypatch.setattr(server, "current_rss", lambda: 600 * 1024 * 1024)
+    instance = worker()
+
+    monkeypatch.setattr(settings, "WORKER_MAX_MEMORY", 1024 * 1024 * 1024)
+    asyncio.run(instance.callback_notify())
+    assert signals == [] and not instance.recycling
+
+    monkeypatch.setattr(settings, "WORKER_MAX_MEMORY", 512 * 1024 * 1024)
+    asyncio.run(instance.callback_notify())
+    asyncio.run(instance.callback_notify())
+    assert signals == [(os.getpid(), signal.SIGTERM)]
+    assert instance.recycling
+    assert instance.beats == 3
+
+
+def test_worker_keeps_beating_while_the_server_drains(monkeypatch):
+    async def draining_server(self):
+        # uvicorn's main loop, and with it callback_notify, has stopped
+        await asyncio.sleep(0.2)
+
+    monkeypatch.setattr(UvicornWorker, "_serve", draining_server)
+    instance = worker(timeout=0.02)
+
+    async def run():
+        await instance._serve()
+        beats = instance.beats
+        await asyncio.sleep(0.1)
+        return beats
+
+    beats = asyncio.run(run())
+    assert beats >= 3
+    # The heartbeat stops with the server
+    assert instance.beats == beats
+
+
+def test_gunicorn_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "WEB_CONCURRENCY", 3)
+    monkeypatch.setattr(settings, "UPLOAD_SIGNING_SECRET", "")
+    monkeypatch.setattr(settings, "METRICS_ENABLED", True)
+    monkeypatch.setattr(settings, "METRICS_MULTIPROC_DIR", str(tmp_path / "metrics"))
+    for name in ("WEB_CONCURRENCY", "UPLOAD_SIGNING_SECRET", "PROMETHEUS_MULTIPROC_DIR"):
+        monkeypatch.delenv(name, raising=False)
+
+    config = runpy.run_path(os.path.join(BACKEND, "gunicorn.conf.py"))
+    assert config["workers"] == 3
+    assert config["worker_class"] == "server.XeroQWorker"
+    assert config["preload_app"] is False
+    assert config["max_requests"] == 0
+    assert config["timeout"] < config["graceful_timeout"]
+    assert config["graceful_timeout"] > settings.GRACEFUL_TIMEOUT
+    # Workers forked from the master see these
+    assert settings.WEB_CONCURRENCY == 3 and os.environ["WEB_CONCURRENCY"] == "3"
+    assert settings.UPLOAD_SIGNING_SECRET
+    assert os.environ["PROMETHEUS_MULTIPROC_DIR"] == str(tmp_path / "metrics")
+
+    # Every run starts from an empty metrics directory
+    os.makedirs(tmp_path / "metrics")
+    (tmp_path / "metrics" / "counter_1.db").write_bytes(b"stale")
+    config["on_starting"](None)
+    assert os.listdir(tmp_path / "metrics") == []
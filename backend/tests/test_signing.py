@@ -0,0 +1,54 @@
+import pytest
+import signing
+from signing import sign_token, verify_token
+
+
+@pytest.fixture(autouse=True)
+def signing_secret(monkeypatch):
+    monkeypatch.setattr(signing.settings, "UPLOAD_SIGNING_SECRET", "test-secret")
+    monkeypatch.setattr(signing, "_secret", None)
+
+
+def test_round_trip():
+    token = sign_token({"kind": "blob_upload", "name": "uploads/a.pdf", "max": 10}, expires_in=60)
+    payload = verify_token(token)
+    assert payload["kind"] == "blob_upload"
+    assert payload["name"] == "uploads/a.pdf"
+    assert payload["max"] == 10
+
+
+def test_tokens_are_url_safe():
+    token = sign_token({"name": "a/b?c=d&e"}, expires_in=60)
+    assert set(token) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_.")
+
+
+def test_rejects_tampered_payload():
+    _, signature = sign_token({"max": 10}, expires_in=60).split(".")
+    forged = signing._b64encode(b'{"max":999999,"exp":9999999999}')
+    with pytest.raises(ValueError):
+        verify_token(f"{forged}.{signature}")
+
+
+@pytest.mark.parametrize("token", ["", "no-dot", "a.b.c", "!!!.???"])
+def test_rejects_malformed_tokens(token):
+    with pytest.raises(ValueError):
+        verify_token(token)
+
+
+def test_rejects_expired_token():
+    with pytest.raises(ValueError, match="expired"):
+        verify_token(sign_token({"max": 10}, expires_in=-5))
+
+
+def test_rejects_token_signed_with_another_key(monkeypatch):
+    token = sign_token({"max": 10}, expires_in=60)
+    monkeypatch.setattr(signing.settings, "UPLOAD_SIGNING_SECRET", "another-secret")
+    monkeypatch.setattr(signing, "_secret", None)
+    with pytest.raises(ValueError):
+        verify_token(token)
+
+
+def test_falls_back_to_a_per_process_key(monkeypatch):
+    monkeypatch.setattr(signing.settings, "UPLOAD_SIGNING_SECRET", "")
+    token = sign_token({"max": 10}, expires_in=60)
+    assert verify_token(token)["max"] == 10
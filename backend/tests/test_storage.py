@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import io
+import pytest
+from config import settings
+from models import PrintJob
+from storage import RELEASED_PREFIX
+
+
+def test_metadata_readiness_follows_the_database(storage, monkeypatch):
+    assert not storage.metadata_ready
+    asyncio.run(storage.warm_up())
+    assert storage.metadata_ready
+
+    async def unreachable(*args):
+        raise ConnectionError("database is down")
+
+    monkeypatch.setattr(storage.jobs, "count", unreachable)
+    asyncio.run(storage.reconcile_counters())
+    assert not storage.metadata_ready
+
+
+PDF = b"%PDF-1.4\n" + b"0" * 1000
+DIGEST = hashlib.sha256(PDF).hexdigest()
+
+
+def job(otp: str, file_path: str) -> PrintJob:
+    return PrintJob(
+        otp=otp, filename="a.pdf", file_path=file_path, file_type="application/pdf", print_options={},
+        upload_time="2030-01-01T00:00:00", expires_at="2099-01-01T00:00:00",
+    )
+
+
+def released_leftovers(storage) -> list:
+    async def scan():
+        return [name async for name, _ in storage.blobs.iter_blobs() if name.startswith(RELEASED_PREFIX)]
+
+    return asyncio.run(scan())
+
+
+def test_identical_uploads_share_a_blob_until_the_last_job_goes(storage):
+    async def scenario():
+        first_path, uploaded = await storage.store_content(io.BytesIO(PDF), DIGEST, "application/pdf")
+        assert uploaded
+        second_path, uploaded = await storage.store_content(io.BytesIO(PDF), DIGEST, "application/pdf")
+        assert (second_path, uploaded) == (first_path, False)
+        await storage.set("JOB001", job("JOB001", first_path))
+        await storage.set("JOB002", job("JOB002", first_path))
+
+        await storage.delete("JOB001")
+        assert await storage.release_blobs([first_path])
+        assert await storage.blobs.exists(first_path)
+
+        await storage.delete("JOB002")
+        assert await storage.release_blobs([first_path])
+        assert not await storage.blobs.exists(first_path)
+
+    asyncio.run(scenario())
+    assert released_leftovers(storage) == []
+
+
+def test_release_keeps_a_blob_a_concurrent_upload_reused(storage, monkeypatch):
+    """The new job is stored, and finds the blob, between the reference check and the delete"""
+    move = storage.blobs.move
+
+    async def scenario():
+        path, _ = await storage.store_content(io.BytesIO(PDF), DIGEST, "application/pdf")
+
+        async def upload_meanwhile(source, destination):
+            if not source.startswith(RELEASED_PREFIX):
+                await storage.set("NEW001", job("NEW001", path))
+                await storage.ensure_blob(path, io.BytesIO(PDF), "application/pdf")
+            return await move(source, destination)
+
+        monkeypatch.setattr(storage.blobs, "move", upload_meanwhile)
+        assert await storage.release_blobs([path])
+        assert await storage.download_file(path) == PDF
+
+    asyncio.run(scenario())
+    assert released_leftovers(storage) == []
+
+
+def test_release_defers_to_a_copy_a_concurrent_upload_put_back(storage, monkeypatch):
+    """The new job is stored after the blob was moved aside, so its upload puts the bytes back itself"""
+    move = storage.blobs.move
+
+    async def scenario():
+        path, _ = await storage.store_content(io.BytesIO(PDF), DIGEST, "application/pdf")
+
+        async def upload_meanwhile(source, destination):
+            moved = await move(source, destination)
+            if not source.startswith(RELEASED_PREFIX):
+                await storage.set("NEW001", job("NEW001", path))
+                await storage.ensure_blob(path, io.BytesIO(PDF), "application/pdf")
+            return moved
+
+        monkeypatch.setattr(storage.blobs, "move", upload_meanwhile)
+        assert await storage.release_blobs([path])
+        assert await storage.download_file(path) == PDF
+
+    asyncio.run(scenario())
+    assert released_leftovers(storage) == []
+
+
+def test_release_puts_blobs_back_when_the_recheck_fails(storage, monkeypatch):
+    async def scenario():
+        path, _ = await storage.store_content(io.BytesIO(PDF), DIGEST, "application/pdf")
+        existing_file_paths = storage.jobs.existing_file_paths
+        calls = []
+
+        async def fail_second_check(file_paths):
+            calls.append(file_paths)
+            if len(calls) == 2:
+                raise ConnectionError("database is down")
+            return await existing_file_paths(file_paths)
+
+        monkeypatch.setattr(storage.jobs, "existing_file_paths", fail_second_check)
+        assert not await storage.release_blobs([path])
+        assert await storage.blobs.exists(path)
+
+    asyncio.run(scenario())
+    assert released_leftovers(storage) == []
+
+
+@pytest.mark.parametrize("codec_name", ["gzip", "zstd"])
+@pytest.mark.parametrize("backend", ["local", "supabase"])
+def test_compressed_blobs_serve_ranges(storage, bucket, monkeypatch, backend, codec_name):
+    monkeypatch.setattr(settings, "BLOB_CODEC", codec_name)
+    monkeypatch.setattr(settings, "BLOB_CODEC_TYPES", {"image/bmp"})
+    if backend == "supabase":
+        storage.blobs = bucket
+    data = b"BM" + bytes(range(256)) * 400
+
+    async def read(file_path, request_headers):
+        stream = await storage.open_file(file_path, request_headers)
+        return stream, b"".join([chunk async for chunk in stream.iter_chunks()])
+
+    async def scenario():
+        file_path, _ = await storage.store_content(io.BytesIO(data), hashlib.sha256(data).hexdigest(), "image/bmp")
+        assert file_path.endswith((".gz", ".zst"))
+
+        stream, body = await read(file_path, {"range": "bytes=1000-1999"})
+        assert stream.status_code == 206
+        assert body == data[1000:2000]
+        assert stream.headers["content-range"] == f"bytes 1000-1999/{len(data)}"
+
+        stream, body = await read(file_path, {})
+        assert stream.status_code == 200
+        assert stream.headers["content-length"] == str(len(data))
+        assert body == data
+
+        stream, _ = await read(file_path, {"if-none-match": stream.headers["etag"], "range": "bytes=0-9"})
+        assert stream.status_code == 304
+
+    asyncio.run(scenario())
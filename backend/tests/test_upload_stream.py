@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import pytest
+from starlette.datastructures import Headers
+import upload_stream
+from upload_stream import UploadRejected, ValidatingMultiPartParser
+
+BOUNDARY = "xeroq-test-boundary"
+PDF = b"%PDF-1.4\n" + b"0" * 4000
+PNG = b"\x89PNG\r\n\x1a\n" + b"0" * 4000
+
+
+def multipart(content: bytes, content_type: str, filename: str = "upload.bin") -> bytes:
+    return (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="printOptions"\r\n\r\n{{}}\r\n'
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f"Content-Type: {content_type}\r\n\r\n"
+    ).encode() + content + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+
+def parse(body: bytes, declared_length=None, chunk_size: int = 1024, spool_memory: int = 1024 * 1024):
+    async def stream():
+        for start in range(0, len(body), chunk_size):
+            yield body[start:start + chunk_size]
+
+    async def run():
+        headers = Headers({"content-type": f"multipart/form-data; boundary={BOUNDARY}"})
+        parser = ValidatingMultiPartParser(headers, stream(), declared_length, spool_memory)
+        form = await parser.parse()
+        return form, parser
+
+    return asyncio.run(run())
+
+
+def test_accepts_and_hashes_a_valid_upload():
+    form, parser = parse(multipart(PDF, "application/pdf"))
+    upload = form["file"]
+    assert upload.content_type == "application/pdf"
+    assert upload.file.read() == PDF
+    assert parser.digest == hashlib.sha256(PDF).hexdigest()
+    assert form["printOptions"] == "{}"
+
+
+def test_small_spool_rolls_over_to_disk():
+    form, _ = parse(multipart(PDF, "application/pdf"), spool_memory=1024)
+    assert form["file"].file._rolled
+
+
+def test_rejects_unsupported_type():
+    with pytest.raises(UploadRejected) as rejected:
+        parse(multipart(b"<html></html>", "text/html"))
+    assert rejected.value.status_code == 400
+
+
+def test_rejects_content_that_does_not_match_its_type():
+    with pytest.raises(UploadRejected) as rejected:
+        parse(multipart(PDF, "image/png"))
+    assert rejected.value.status_code == 400
+    assert "does not match" in rejected.value.detail
+
+
+def test_image_types_are_checked_as_a_family():
+    form, _ = parse(multipart(PNG, "image/jpeg"))
+    assert form["file"].file.read() == PNG
+
+
+def test_rejects_short_mislabeled_file():
+    # Fewer bytes than the sniff window are still checked at the end of the part
+    with pytest.raises(UploadRejected):
+        parse(multipart(b"GIF8", "application/pdf"))
+
+
+def test_rejects_empty_file():
+    with pytest.raises(UploadRejected) as rejected:
+        parse(multipart(b"", "application/pdf"))
+    assert rejected.value.status_code == 400
+
+
+def test_size_cap_applies_while_streaming(monkeypatch):
+    monkeypatch.setitem(upload_stream.UPLOAD_TYPES, "application/pdf", ("pdf", 2048))
+    with pytest.raises(UploadRejected) as rejected:
+        parse(multipart(PDF, "application/pdf"))
+    assert rejected.value.status_code == 413
+
+
+def test_size_cap_applies_to_declared_length(monkeypatch):
+    monkeypatch.setitem(upload_stream.UPLOAD_TYPES, "application/pdf", ("pdf", 2048))
+    body = multipart(PDF[:1024], "application/pdf")
+    declared = 2048 + upload_stream.FORM_OVERHEAD + 1
+    with pytest.raises(UploadRejected) as rejected:
+        parse(body, declared_length=declared)
+    assert rejected.value.status_code == 413
+
+
+def test_oversized_form_field_is_rejected():
+    body = (
+        f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="printOptions"\r\n\r\n'.encode()
+        + b"x" * (upload_stream.FORM_OVERHEAD + 1)
+        + f"\r\n--{BOUNDARY}--\r\n".encode()
+    )
+    with pytest.raises(UploadRejected) as rejected:
+        parse(body, chunk_size=64 * 1024)
+    assert rejected.value.status_code == 400
+
+
+def test_matches_signature():
+    assert upload_stream.matches_signature("pdf", b"%PDF-1.7")
+    assert upload_stream.matches_signature("docx", b"PK\x03\x04rest")
+    assert upload_stream.matches_signature("image", b"RIFF\x00\x00\x00\x00WEBPVP8 ")
+    assert not upload_stream.matches_signature("image", b"%PDF-1.7")
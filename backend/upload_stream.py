@@ -0,0 +1,181 @@
+import hashlib
+import logging
+from typing import Callable, Dict, List, Optional, Tuple
+from starlette.datastructures import FormData, Headers
+from starlette.formparsers import MultiPartException, MultiPartParser
+from starlette.requests import Request
+from config import settings
+
+# One record per received chunk; silenced unless LOG_CHUNK_TRACE is set
+chunk_logger = logging.getLogger("upload_stream.chunks")
+
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+# Allowed upload types: content type -> (format family, size limit)
+UPLOAD_TYPES: Dict[str, Tuple[str, int]] = {
+    "application/pdf": ("pdf", settings.MAX_FILE_SIZE_PDF),
+    DOCX_CONTENT_TYPE: ("docx", settings.MAX_FILE_SIZE_DOCX),
+    "image/jpeg": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/jpg": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/png": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/gif": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/bmp": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/tiff": ("image", settings.MAX_FILE_SIZE_IMAGES),
+    "image/webp": ("image", settings.MAX_FILE_SIZE_IMAGES),
+}
+
+# Magic bytes per format family. Images are checked as a family: a PNG
+# saved as .jpg still prints fine, a PDF renamed to .png does not.
+SIGNATURES: Dict[str, List[Callable[[bytes], bool]]] = {
+    "pdf": [lambda head: head.startswith(b"%PDF-")],
+    "docx": [lambda head: head.startswith(b"PK\x03\x04")],  # OOXML is a zip archive
+    "image": [
+        lambda head: head.startswith(b"\xff\xd8\xff"),  # JPEG
+        lambda head: head.startswith(b"\x89PNG\r\n\x1a\n"),
+        lambda head: head.startswith((b"GIF87a", b"GIF89a")),
+        lambda head: head.startswith(b"BM"),
+        lambda head: head.startswith((b"II*\x00", b"MM\x00*")),  # TIFF
+        lambda head: head[:4] == b"RIFF" and head[8:12] == b"WEBP",
+    ],
+}
+
+SNIFF_BYTES = 16
+
+# Multipart boundaries, part headers and the printOptions field on top of the file
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadRejected(Exception):
+    """An upload that fails validation while it is still being received"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+def format_size(size: int) -> str:
+    return f"{size // (1024 * 1024)}MB"
+
+
+def too_large(size: int, max_size: int) -> UploadRejected:
+    return UploadRejected(
+        413,
+        f"File too large ({size} bytes). Maximum size is {format_size(max_size)} ({max_size} bytes)."
+    )
+
+
+def matches_signature(family: str, head: bytes) -> bool:
+    return any(check(head) for check in SIGNATURES[family])
+
+
+class ValidatingMultiPartParser(MultiPartParser):
+    """Multipart parser that validates the uploaded file as it arrives.
+
+    The declared type is checked as soon as the file part's headers are
+    parsed, its magic bytes on the first few bytes of data, and its size on
+    every chunk, so a mislabeled or oversized upload is cut off after a few
+    KB rather than after the whole body has been spooled. The file is also
+    hashed on the way through, for content-addressed storage.
+    """
+
+    def __init__(self, headers: Headers, stream, declared_length: Optional[int] = None,
+                 spool_memory: int = settings.UPLOAD_SPOOL_MEMORY):
+        super().__init__(headers, stream, max_files=1, max_fields=16)
+        self.declared_length = declared_length
+        # Size of the in-memory spool before the file rolls over to disk
+        # (at least 1, as 0 would mean never rolling over)
+        self.max_file_size = max(spool_memory, 1)
+        self._family = ""
+        self._max_size = 0
+        self._received = 0
+        self._head = b""
+        self._sniffed = False
+        self._sha256 = hashlib.sha256()
+
+    @property
+    def digest(self) -> str:
+        """Hex SHA-256 of the file received so far"""
+        return self._sha256.hexdigest()
+
+    def on_headers_finished(self) -> None:
+        super().on_headers_finished()
+        upload = self._current_part.file
+        if upload is None:
+            return
+
+        if upload.content_type not in UPLOAD_TYPES:
+            raise UploadRejected(400, "Invalid file type. Please upload PDF, DOCX, or image files.")
+
+        self._family, self._max_size = UPLOAD_TYPES[upload.content_type]
+        if self.declared_length is not None and self.declared_length > self._max_size + FORM_OVERHEAD:
+            raise too_large(self.declared_length, self._max_size)
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._current_part.file is None:
+            if len(self._current_part.data) + end - start > FORM_OVERHEAD:
+                raise UploadRejected(400, f"Form field {self._current_part.field_name!r} is too large")
+            super().on_part_data(data, start, end)
+            return
+
+        self._received += end - start
+        if self._received > self._max_size:
+            raise too_large(self._received, self._max_size)
+
+        if not self._sniffed:
+            self._head += data[start:min(end, start + SNIFF_BYTES)]
+            if len(self._head) >= SNIFF_BYTES:
+                self._sniff()
+
+        self._sha256.update(memoryview(data)[start:end])
+        if chunk_logger.isEnabledFor(logging.DEBUG):
+            chunk_logger.debug("Received %d bytes (%d total)", end - start, self._received)
+        super().on_part_data(data, start, end)
+
+    def on_part_end(self) -> None:
+        if self._current_part.file is not None:
+            if not self._received:
+                raise UploadRejected(400, "Uploaded file is empty")
+            if not self._sniffed:
+                self._sniff()
+        super().on_part_end()
+
+    def _sniff(self) -> None:
+        self._sniffed = True
+        if not matches_signature(self._family, self._head):
+            raise UploadRejected(
+                400,
+                f"File content does not match its type ({self._current_part.file.content_type})."
+            )
+
+
+async def receive_upload(request: Request) -> Tuple[FormData, str]:
+    """Parse a multipart upload, rejecting bad files while they stream in.
+
+    Returns the form and the SHA-256 hex digest of its file.
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        raise UploadRejected(400, "Expected a multipart/form-data upload")
+
+    declared_length = None
+    if request.headers.get("content-length"):
+        try:
+            declared_length = int(request.headers["content-length"])
+        except ValueError:
+            raise UploadRejected(400, "Invalid Content-Length header")
+
+        largest = max(max_size for _, max_size in UPLOAD_TYPES.values())
+        if declared_length > largest + FORM_OVERHEAD:
+            raise too_large(declared_length, largest)
+
+    spool_memory = getattr(request.state, "upload_spool_memory", settings.UPLOAD_SPOOL_MEMORY)
+    parser = ValidatingMultiPartParser(request.headers, request.stream(), declared_length, spool_memory)
+    try:
+        form = await parser.parse()
+    except (UploadRejected, MultiPartException):
+        for spooled in parser._files_to_close_on_error:
+            spooled.close()
+        raise
+
+    return form, parser.digest
@@ -10,15 +10,24 @@ CREATE TABLE IF NOT EXISTS print_jobs (
     status VARCHAR(20) DEFAULT 'pending' CHECK (status IN ('pending', 'completed')),
     expires_at TIMESTAMPTZ NOT NULL,
     completed_at TIMESTAMPTZ,
+    print_file_path TEXT,
+    print_status VARCHAR(20) CHECK (print_status IN ('queued', 'ready', 'failed')),
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
 
+-- Print-ready renderings, for tables created before they were added
+ALTER TABLE print_jobs ADD COLUMN IF NOT EXISTS print_file_path TEXT;
+ALTER TABLE print_jobs ADD COLUMN IF NOT EXISTS print_status VARCHAR(20)
+    CHECK (print_status IN ('queued', 'ready', 'failed'));
+
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_print_jobs_otp ON print_jobs(otp);
 CREATE INDEX IF NOT EXISTS idx_print_jobs_status ON print_jobs(status);
 CREATE INDEX IF NOT EXISTS idx_print_jobs_expires_at ON print_jobs(expires_at);
 CREATE INDEX IF NOT EXISTS idx_print_jobs_upload_time ON print_jobs(upload_time);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_file_path ON print_jobs(file_path);
+CREATE INDEX IF NOT EXISTS idx_print_jobs_print_file_path ON print_jobs(print_file_path);
 
 -- Create a function to automatically update the updated_at column
 CREATE OR REPLACE FUNCTION update_updated_at_column()